@@ -0,0 +1,32 @@
+import os
+import tempfile
+import timeit
+
+from ssdtools.grid import Grid, enable_envira_cache, disable_envira_cache
+
+
+def benchmark_read_enviras(path, pattern, number=5):
+    """
+    Compare reading a multigrid from the envira text files (cold) with reading it from the binary cache (warm).
+
+    :param str path: the path to the envira files.
+    :param str pattern: the pattern used to match the envira files.
+    :param int number: the number of repetitions.
+    """
+
+    with tempfile.TemporaryDirectory() as cache_directory:
+        # Read the envira files without cache
+        disable_envira_cache()
+        cold = timeit.timeit(lambda: Grid.read_enviras(path, pattern), number=number) / number
+
+        # Fill the cache once and read the envira files from the cache
+        enable_envira_cache(cache_directory)
+        Grid.read_enviras(path, pattern)
+        warm = timeit.timeit(lambda: Grid.read_enviras(path, pattern), number=number) / number
+        disable_envira_cache()
+
+    print('cold: {:.3f}s, warm: {:.3f}s, speed-up: {:.1f}x'.format(cold, warm, cold / warm))
+
+
+if __name__ == "__main__":
+    benchmark_read_enviras(os.path.join('..', 'tests', 'data', 'H_500_00_doc29'), r'[\w\d\s]+Lden[\w\d\s]+\.dat')
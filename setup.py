@@ -3,7 +3,7 @@ import sys
 from setuptools import find_packages, setup
 
 CURRENT_PYTHON = sys.version_info[:2]
-REQUIRED_PYTHON = (3, 6)
+REQUIRED_PYTHON = (3, 8)
 
 # This check and everything above must remain compatible with Python 2.7.
 if CURRENT_PYTHON < REQUIRED_PYTHON:
@@ -41,8 +41,8 @@ setup(
     license='None',
     packages=find_packages(exclude=EXCLUDE_FROM_PACKAGES),
     include_package_data=True,
-    install_requires=['pandas', 'numpy', 'scipy', 'xlrd', 'tables', 'matplotlib', 'pyshp', 'requests', 'geopandas',
-                      'descartes'],
+    install_requires=['pandas', 'numpy>=1.17', 'scipy>=1.8', 'xlrd', 'tables', 'matplotlib', 'pyshp', 'requests',
+                      'geopandas', 'descartes'],
     zip_safe=False,
     project_urls={
         'Source': 'https://github.com/schiphol-Hub/SSDTools/',
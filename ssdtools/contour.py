@@ -0,0 +1,333 @@
+import numpy as np
+
+
+def contour_segments(data, x, y, level):
+    """
+    Determine the contour segments of a grid at the given level with a marching squares algorithm.
+
+    The area above the level (data >= level) is enclosed by the segments. The grid is padded with values below the
+    level, so contours that run over the edge of the grid are closed along the boundary of the grid. Each segment has
+    the enclosed area on its left-hand side, which makes outer rings counter-clockwise and holes clockwise. NaN values
+    are treated as values below the level.
+
+    :param np.ndarray data: the two-dimensional grid data with the shape (y, x).
+    :param np.ndarray x: the x coordinates of the grid.
+    :param np.ndarray y: the y coordinates of the grid.
+    :param float level: the contour level.
+    :return: the start and end edge identifiers of each segment and the coordinates of the start and end points.
+    :rtype: (np.ndarray, np.ndarray, np.ndarray, np.ndarray)
+    """
+
+    # Pad the grid with values below any level
+    data = np.asarray(data, dtype=float)
+    ny, nx = data.shape[0] + 2, data.shape[1] + 2
+    z = np.full((ny, nx), -np.inf)
+    z[1:-1, 1:-1] = np.where(np.isnan(data), -np.inf, data)
+
+    # The crossings with the padding are located at the grid nodes, so the padding coordinates are never used
+    x = np.concatenate(([x[0]], x, [x[-1]]))
+    y = np.concatenate(([y[0]], y, [y[-1]]))
+
+    # Mark the nodes that are inside the contour
+    inside = z >= level
+
+    # Set the corners of each cell in counter-clockwise order
+    corners = [inside[:-1, :-1], inside[:-1, 1:], inside[1:, 1:], inside[1:, :-1]]
+
+    # Set the identifiers of the edges of each cell, edge k connects corner k and k + 1
+    horizontal = np.arange(ny * (nx - 1)).reshape(ny, nx - 1)
+    vertical = ny * (nx - 1) + np.arange((ny - 1) * nx).reshape(ny - 1, nx)
+    edges = [horizontal[:-1, :], vertical[:, 1:], horizontal[1:, :], vertical[:, :-1]]
+
+    # Determine for each edge if the contour leaves or enters the area
+    leaving = [corners[k] & ~corners[(k + 1) % 4] for k in range(4)]
+    entering = [~corners[k] & corners[(k + 1) % 4] for k in range(4)]
+
+    # Saddle cells are separated if the average of the corners is below the level
+    saddle = (corners[0] & corners[2] & ~corners[1] & ~corners[3]) | \
+        (corners[1] & corners[3] & ~corners[0] & ~corners[2])
+    with np.errstate(invalid='ignore'):
+        separated = saddle & ~((z[:-1, :-1] + z[:-1, 1:] + z[1:, 1:] + z[1:, :-1]) / 4. >= level)
+
+    # Each segment starts at a leaving edge and ends at the next entering edge in counter-clockwise order, except for
+    # separated saddles which cut off the corner of the leaving edge
+    start, end = [], []
+    for k in range(4):
+        start.append(edges[k][leaving[k]])
+        end.append(np.choose(segment_partner(entering, separated, k), edges)[leaving[k]])
+    start = np.concatenate(start)
+    end = np.concatenate(end)
+
+    # Reverse the segments if the coordinate system is mirrored
+    if (x[-1] - x[0]) * (y[-1] - y[0]) < 0:
+        start, end = end, start
+
+    return start, end, edge_points(start, z, x, y, level), edge_points(end, z, x, y, level)
+
+
+def segment_partner(entering, separated, k):
+    """
+    Determine the edge where a segment ends that starts at edge k of a cell. This is the next entering edge in
+    counter-clockwise order, except for separated saddles where the segment cuts off the corner of the leaving edge.
+
+    :param list(np.ndarray) entering: for each edge of the cells, whether the contour enters the area.
+    :param np.ndarray separated: whether the cells are separated saddles.
+    :param int k: the edge where the segment starts.
+    :return: the edge where the segment ends for each cell.
+    :rtype: np.ndarray
+    """
+
+    partner = np.where(entering[(k + 1) % 4], (k + 1) % 4, np.where(entering[(k + 2) % 4], (k + 2) % 4, (k + 3) % 4))
+    partner[separated] = (k + 3) % 4
+
+    return partner
+
+
+def edge_points(edge, z, x, y, level):
+    """
+    Determine the coordinates where the contour crosses the given edges of a padded grid.
+
+    :param np.ndarray edge: the edge identifiers.
+    :param np.ndarray z: the padded grid data.
+    :param np.ndarray x: the padded x coordinates.
+    :param np.ndarray y: the padded y coordinates.
+    :param float level: the contour level.
+    :return: the coordinates of the crossings.
+    :rtype: np.ndarray
+    """
+
+    ny, nx = z.shape
+
+    # Determine the nodes of each edge
+    is_horizontal = edge < ny * (nx - 1)
+    vertical = edge - ny * (nx - 1)
+    i0 = np.where(is_horizontal, edge // (nx - 1), vertical // nx)
+    j0 = np.where(is_horizontal, edge % (nx - 1), vertical % nx)
+    i1 = np.where(is_horizontal, i0, i0 + 1)
+    j1 = np.where(is_horizontal, j0 + 1, j0)
+
+    # Swap the nodes such that the first node is inside the contour
+    swap = z[i0, j0] < level
+    i0, i1 = np.where(swap, i1, i0), np.where(swap, i0, i1)
+    j0, j1 = np.where(swap, j1, j0), np.where(swap, j0, j1)
+
+    # Interpolate linearly from the inside node, which puts crossings with the padding exactly on the grid nodes
+    t = (z[i0, j0] - level) / (z[i0, j0] - z[i1, j1])
+
+    return np.column_stack((x[j0] + t * (x[j1] - x[j0]), y[i0] + t * (y[i1] - y[i0])))
+
+
+def contour_rings(data, x, y, level):
+    """
+    Link the contour segments of a grid into closed rings.
+
+    :param np.ndarray data: the two-dimensional grid data with the shape (y, x).
+    :param np.ndarray x: the x coordinates of the grid.
+    :param np.ndarray y: the y coordinates of the grid.
+    :param float level: the contour level.
+    :return: the closed rings, outer rings are counter-clockwise and holes are clockwise.
+    :rtype: list(np.ndarray)
+    """
+
+    start, end, points, _ = contour_segments(data, x, y, level)
+
+    # Find the segment that starts where each segment ends
+    order = np.argsort(start)
+    successor = order[np.searchsorted(start, end, sorter=order)].tolist()
+
+    # Follow the segments until each ring is closed
+    visited = [False] * len(successor)
+    rings = []
+    for first in range(len(successor)):
+        if visited[first]:
+            continue
+        ring = []
+        k = first
+        while not visited[k]:
+            visited[k] = True
+            ring.append(k)
+            k = successor[k]
+
+        # Close the ring and remove the duplicate points where the ring runs through a corner of the grid
+        coordinates = points[ring + ring[:1]]
+        coordinates = coordinates[np.r_[True, np.any(np.diff(coordinates, axis=0) != 0, axis=1)]]
+        if len(coordinates) > 3:
+            rings.append(coordinates)
+
+    return rings
+
+
+def contour_polygons(data, x, y, level):
+    """
+    Determine the polygons enclosing the area of a grid at or above the given level.
+
+    :param np.ndarray data: the two-dimensional grid data with the shape (y, x).
+    :param np.ndarray x: the x coordinates of the grid.
+    :param np.ndarray y: the y coordinates of the grid.
+    :param float level: the contour level.
+    :return: the polygons as a list of exterior rings with a list of the holes in each polygon.
+    :rtype: list((np.ndarray, list(np.ndarray)))
+    """
+
+    rings = contour_rings(data, x, y, level)
+    areas = np.array([ring_area(ring) for ring in rings])
+
+    # Create a polygon for each exterior ring
+    exteriors = [i for i in range(len(rings)) if areas[i] > 0]
+    polygons = [(rings[i], []) for i in exteriors]
+
+    # Assign each hole to the smallest exterior ring that contains it
+    for i in np.flatnonzero(areas < 0):
+        containing = [k for k, j in enumerate(exteriors) if ring_contains(rings[j], rings[i][0])]
+        if containing:
+            polygons[min(containing, key=lambda k: areas[exteriors[k]])][1].append(rings[i])
+
+    return polygons
+
+
+def contour_levels(data, x, y, levels):
+    """
+    Determine the polygons for multiple contour levels.
+
+    :param np.ndarray data: the two-dimensional grid data with the shape (y, x).
+    :param np.ndarray x: the x coordinates of the grid.
+    :param np.ndarray y: the y coordinates of the grid.
+    :param list(float) levels: the contour levels.
+    :return: the polygons for each level.
+    :rtype: list(list((np.ndarray, list(np.ndarray))))
+    """
+
+    return [contour_polygons(data, x, y, level) for level in levels]
+
+
+def contour_area(data, x, y, level):
+    """
+    Calculate the area of a grid at or above the given level.
+
+    :param np.ndarray data: the two-dimensional grid data with the shape (y, x).
+    :param np.ndarray x: the x coordinates of the grid.
+    :param np.ndarray y: the y coordinates of the grid.
+    :param float level: the contour level.
+    :return: the enclosed area in the squared unit of the coordinates.
+    :rtype: float
+    """
+
+    return contour_area_levels(data, x, y, [level])[0]
+
+
+def contour_area_levels(data, x, y, levels, interpolate=True):
+    """
+    Calculate the area of a grid at or above each of the given levels.
+
+    The interpolated area is the area enclosed by the marching squares contours. The signed areas of the contour
+    segments are summed directly, so the segments do not have to be linked into rings, and only the cells that are
+    crossed by a level are visited for that level. Without interpolation the area is approximated as the number of grid
+    nodes at or above the level times the area of a cell. Each node then represents the cell around it, so the result
+    can differ by up to a row and a column of cells from the interpolated area, e.g. for a level crossing the grid edge.
+
+    :param np.ndarray data: the two-dimensional grid data with the shape (y, x).
+    :param np.ndarray x: the x coordinates of the grid.
+    :param np.ndarray y: the y coordinates of the grid.
+    :param list(float) levels: the contour levels.
+    :param bool interpolate: use the sub-cell interpolated area, defaults to True.
+    :return: the enclosed area for each level in the squared unit of the coordinates.
+    :rtype: np.ndarray
+    """
+
+    # Determine the area of a cell, the areas are summed in index coordinates where the orientation is never mirrored
+    cell_area = abs((np.diff(x[:2]).sum() if len(x) > 1 else 1.) * (np.diff(y[:2]).sum() if len(y) > 1 else 1.))
+    levels = np.asarray(levels, dtype=float)
+
+    # NaN values are treated as values below any level
+    data = np.asarray(data, dtype=float)
+    data = np.where(np.isnan(data), -np.inf, data)
+
+    if not interpolate:
+        # Count the nodes at or above each level from the sorted values
+        count = data.size - np.searchsorted(np.sort(data, axis=None), levels, side='left')
+        return count * cell_area
+
+    # Pad the grid with values below any level and collect the corner values of each cell in counter-clockwise order
+    z = np.full((data.shape[0] + 2, data.shape[1] + 2), -np.inf)
+    z[1:-1, 1:-1] = data
+    corners = np.stack([z[:-1, :-1], z[:-1, 1:], z[1:, 1:], z[1:, :-1]]).reshape(4, -1)
+    lowest = corners.min(axis=0)
+    highest = corners.max(axis=0)
+
+    # Set the index coordinates of the corners relative to each cell
+    corner_x = np.array([0., 1., 1., 0.])
+    corner_y = np.array([0., 0., 1., 1.])
+
+    areas = np.zeros(len(levels))
+    for n, level in enumerate(levels):
+
+        # Select the cells that are crossed by the contour
+        cells = np.flatnonzero((lowest < level) & (highest >= level))
+        if cells.size == 0:
+            continue
+        values = corners[:, cells]
+        inside = values >= level
+
+        # Determine the crossing on each edge relative to the cell, interpolated from the inside corner
+        points = []
+        for k in range(4):
+            z_in = np.where(inside[k], values[k], values[(k + 1) % 4])
+            z_out = np.where(inside[k], values[(k + 1) % 4], values[k])
+            with np.errstate(invalid='ignore', divide='ignore'):
+                t = (z_in - level) / (z_in - z_out)
+                t = np.where(inside[k], t, 1 - t)
+                points.append((corner_x[k] + t * (corner_x[(k + 1) % 4] - corner_x[k]),
+                               corner_y[k] + t * (corner_y[(k + 1) % 4] - corner_y[k])))
+
+        # Determine for each edge if the contour leaves or enters the area
+        leaving = [inside[k] & ~inside[(k + 1) % 4] for k in range(4)]
+        entering = [~inside[k] & inside[(k + 1) % 4] for k in range(4)]
+        saddle = (inside[0] & inside[2] & ~inside[1] & ~inside[3]) | (inside[1] & inside[3] & ~inside[0] & ~inside[2])
+        with np.errstate(invalid='ignore'):
+            separated = saddle & ~(values.mean(axis=0) >= level)
+
+        # Sum the signed areas of the segments in index coordinates, offset by the position of each cell
+        i, j = np.divmod(cells, z.shape[1] - 1)
+        total = 0.
+        for k in range(4):
+            partner = segment_partner(entering, separated, k)
+            x0 = (points[k][0] + j)[leaving[k]]
+            y0 = (points[k][1] + i)[leaving[k]]
+            x1 = (np.choose(partner, [point[0] for point in points]) + j)[leaving[k]]
+            y1 = (np.choose(partner, [point[1] for point in points]) + i)[leaving[k]]
+            total += (x0 * y1 - x1 * y0).sum()
+        areas[n] = total / 2.
+
+    return areas * cell_area
+
+
+def ring_area(ring):
+    """
+    Calculate the signed area of a closed ring with the shoelace formula.
+
+    :param np.ndarray ring: the coordinates of the closed ring.
+    :return: the area, which is positive for counter-clockwise rings and negative for clockwise rings.
+    :rtype: float
+    """
+
+    return (ring[:-1, 0] * ring[1:, 1] - ring[1:, 0] * ring[:-1, 1]).sum() / 2.
+
+
+def ring_contains(ring, point):
+    """
+    Check if a point is inside a closed ring with the even-odd rule.
+
+    :param np.ndarray ring: the coordinates of the closed ring.
+    :param np.ndarray point: the coordinates of the point.
+    :rtype: bool
+    """
+
+    x0, y0 = ring[:-1, 0], ring[:-1, 1]
+    x1, y1 = ring[1:, 0], ring[1:, 1]
+
+    # Count the edges that cross a ray from the point in the positive x direction
+    crossing = (y0 > point[1]) != (y1 > point[1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        intersection = x0 + (point[1] - y0) * (x1 - x0) / (y1 - y0)
+
+    return np.count_nonzero(crossing & (point[0] < intersection)) % 2 == 1
@@ -241,7 +241,7 @@ class GridPlot(object):
         y = shape.get_y_coordinates()
 
         # If the grid is a multigrid, all noise levels should be plotted.
-        if isinstance(self.grid.data, list):
+        if self.grid.is_multigrid():
 
             # Get the various statistics of the data
             statistic_grids = self.grid.statistics()
@@ -341,7 +341,7 @@ class GridPlot(object):
         y = grid.shape.get_y_coordinates()
 
         # If the grid is a multigrid, all noise levels should be plotted.
-        if isinstance(grid.data, list):
+        if grid.is_multigrid():
 
             # Get the various statistics of the data
             statistic_grids = self.grid.statistics()
@@ -1,14 +1,37 @@
 import copy
+import gzip
+import hashlib
 import io
+import json
 import os
+import queue
 import re
+import sqlite3
+import tarfile
 import textwrap
+import threading
+import zipfile
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+from contextlib import closing
+from functools import lru_cache
+from multiprocessing import shared_memory
 import pandas as pd
 import shapefile
-import matplotlib.pyplot as plt
-from scipy.interpolate import RectBivariateSpline
-from shapely.geometry import Polygon
+import tables
+from scipy.interpolate import BSpline, RectBivariateSpline
+from scipy.sparse import csr_matrix
+from ssdtools.contour import contour_area, contour_area_levels, contour_polygons, contour_rings
+from ssdtools.utils.dtype import as_dtype, get_dtype
+
+# Settings for the binary envira cache, which is disabled by default
+envira_cache = {'enabled': False, 'directory': None}
+
+# The line-offset indices of the most recent envira files that were read with a window, keyed on path, size and
+# modification time
+envira_line_indices = OrderedDict()
+envira_line_indices_size = 64
 
 # Set the gelijkwaardigheidscriteria
 gwc = {'doc29_2005': [13600, 166500, 14600, 45000],
@@ -58,6 +81,150 @@ def meteotoeslag_years(method, unit):
     return np.setdiff1d(np.arange(1971, 2011), exceptional_years[(method, unit)])
 
 
+def meteotoeslag_from_grids(grids, methods=('empirisch', 'hybride')):
+    """
+    Determine the meteotoeslag for multiple methods in a single pass over the grids of the meteorological years. A
+    running max-grid is kept for each method, so only one grid at a time has to be held in memory.
+
+    :param iterable grids: the year and the Grid for each meteorological year, e.g. a generator that reads the grids.
+     The file name of the grid can be added as third element, which is used in the error messages.
+    :param list(str) methods: the methods for selecting the meteorological representative years, defaults to both
+     'empirisch' and 'hybride'.
+    :return: the grid with meteotoeslag for each method.
+    :rtype dict(Grid)
+    """
+
+    unit = None
+    info = None
+    shape = None
+    years = {}
+    surcharges = {}
+    counts = dict.fromkeys(methods, 0)
+
+    for item in grids:
+        year, grid = item[:2]
+        name = item[2] if len(item) > 2 else 'the grid of {}'.format(year)
+
+        # Set the unit, the shape, the info, the name and the years to include from the first grid
+        if unit is None:
+            unit = grid.unit
+            shape = getattr(grid, 'shape', None)
+            info = getattr(grid, 'info', None)
+            first_name = name
+            years = {method: meteotoeslag_years(method, unit) for method in methods}
+        elif grid.unit != unit:
+            raise ValueError('All grids should have the same unit.')
+
+        # Update the running max-grid of each method that includes this year
+        for method in methods:
+            if year in years[method]:
+                if surcharges.get(method) is None:
+                    surcharges[method] = np.array(grid.data, dtype=get_dtype())
+                elif grid.data.shape != surcharges[method].shape:
+                    raise ValueError('The shape {} of {} differs from the shape {} of {}'.format(
+                        grid.data.shape, name, surcharges[method].shape, first_name))
+                else:
+                    np.maximum(surcharges[method], grid.data, out=surcharges[method])
+                counts[method] += 1
+
+    # There should be 32 years to include for each method
+    for method in methods:
+        if counts[method] != 32:
+            raise LookupError(
+                'Expected 32 years for the meteorological surcharge but found {} years'.format(counts[method]))
+
+    return {method: Grid(data=surcharges[method], unit=unit, years=years[method],
+                         shape=None if shape is None else shape.copy(), info=copy.deepcopy(info))
+            for method in methods}
+
+
+def number_above(data, thresholds, weights=None):
+    """
+    Count the weighted number of grids at or above each threshold, e.g. to create NA60, NA65 and NA70 grids from a
+    stack of LAmax grids in a single pass.
+
+    Each grid is binned once against the sorted thresholds and its weight is added to the bin of each grid point. The
+    counts per threshold follow from a cumulative sum over the bins, so no full-size arrays of scaling factors are
+    needed. The counts are accumulated in double precision and returned in the floating point type of the package.
+    Grid points with a NaN value in any of the grids have a NaN count, as without a value the count is unknown.
+
+    :param np.ndarray|list(np.ndarray) data: the equally sized grids, e.g. with the shape (grids, y, x).
+    :param list(float) thresholds: the thresholds in dB.
+    :param list(float)|np.ndarray weights: the weight of each grid, e.g. the number of flights. Defaults to 1 for each
+     grid.
+    :return: the weighted count for each threshold, with the shape (thresholds, y, x).
+    :rtype: np.ndarray
+    """
+
+    thresholds = np.asarray(thresholds, dtype=float)
+    weights = np.ones(len(data)) if weights is None else np.asarray(weights, dtype=float)
+    if len(data) == 0:
+        raise ValueError('At least one grid is required to count the number above a threshold.')
+    if len(weights) != len(data):
+        raise ValueError('The number of weights should be equal to the number of grids.')
+
+    # Sort the thresholds, the bins are the intervals between the sorted thresholds
+    order = np.argsort(thresholds)
+    sorted_thresholds = thresholds[order]
+
+    bins = None
+    for layer, weight in zip(data, weights):
+        if bins is None:
+            shape = np.shape(layer)
+            bins = np.zeros((len(thresholds) + 1, np.size(layer)))
+            cells = np.arange(np.size(layer))
+            missing = np.zeros(np.size(layer), dtype=bool)
+        elif np.shape(layer) != shape:
+            raise ValueError('All grids should have the same shape.')
+
+        # Add the weight to the bin of each grid point, NaN values are put in the lowest bin and marked as missing
+        values = np.ravel(layer)
+        index = np.searchsorted(sorted_thresholds, values, side='right')
+        nan = np.isnan(values)
+        index[nan] = 0
+        missing |= nan
+        bins[index, cells] += weight
+
+    # The count for a threshold is the sum of the bins above it
+    counts = np.cumsum(bins[:0:-1], axis=0)[::-1]
+    counts[:, missing] = np.nan
+
+    # Restore the order of the thresholds
+    counts[order] = counts.copy()
+
+    return as_dtype(counts.reshape((len(thresholds),) + shape))
+
+
+def read_only(data):
+    """
+    Create a read-only view of noise data, so writing to it raises an error instead of changing the arrays it is shared
+    with.
+
+    :param np.ndarray|list(np.ndarray) data: the noise data, or a list with the noise data of unequal grids.
+    :rtype: np.ndarray|list(np.ndarray)
+    """
+
+    if isinstance(data, list):
+        return [read_only(d) for d in data]
+    if isinstance(data, np.ndarray):
+        data = data.view()
+        data.flags.writeable = False
+    return data
+
+
+def is_writeable(data):
+    """
+    Check if noise data can be changed in place.
+
+    :param np.ndarray|list(np.ndarray) data: the noise data, or a list with the noise data of unequal grids.
+    :rtype: bool
+    """
+
+    if isinstance(data, list):
+        return all(is_writeable(d) for d in data)
+    return not isinstance(data, np.ndarray) or data.flags.writeable
+
+
 class Grid(object):
     """
     A Grid object contains the data and methods related to noise grids.
@@ -66,22 +233,35 @@ class Grid(object):
     1) A single contour grid
     2) A multi-contour grid
 
-    Multi-contour grids are use to indicate the certainty ranges of the noise levels for a given traffic scenario.
+    Multi-contour grids are use to indicate the certainty ranges of the noise levels for a given traffic scenario. The
+    data of a multi-contour grid is stored as one contiguous three-dimensional array with the shape (years, y, x), where
+    the first axis corresponds to the years attribute.
     """
 
-    def __init__(self, data=None, info=None, shape=None, years=None, unit=None, unequal_grids=None):
+    def __init__(self, data=None, info=None, shape=None, years=None, unit=None, unequal_grids=None, energy=None):
         """
 
         :param list(np.ndarray)|np.ndarray data: grid data, is two-dimensional for single contour grids and
-        three-dimensional for multi-contour grids.
+        three-dimensional for multi-contour grids. A list of equally sized grids is stacked to a three-dimensional
+        array.
         :param list(dict)|dict info: grid information
+        :param np.ndarray energy: grid data in the energy domain, i.e. 10^(L/10), as an alternative to the data in dB.
 
         todo: Create a format specification for the grid information.
 
         """
 
+        # The data is held in the dB domain, the energy domain or both. A domain is only converted when it is requested.
+        self._data = None
+        self._energy = None
+
+        # The splines of the data, see cached_spline()
+        self._splines = {}
+
         if data is not None:
             self.data = data
+        elif energy is not None:
+            self.energy = energy
         if info is not None:
             self.info = info
             self.shape = Shape(info if isinstance(info, dict) else info[0])
@@ -96,17 +276,83 @@ class Grid(object):
         if unequal_grids is None:
             self.validate(exclude=['datum', 'tijd', 'nvlb'])
 
+            # Store the grids of a multigrid as one contiguous array
+            if isinstance(self._data, list) and len(self._data) > 0:
+                self.data = np.stack(self._data)
+
+    @property
+    def data(self):
+        """
+        The grid data in dB. If the grid only holds energy, the noise levels are derived from it and kept as a read-only
+        array, because writing to it would not update the energy.
+
+        Writeable noise levels can be changed in place, e.g. grid.data[mask] = 0. The energy and the splines that were
+        derived from them are therefore dropped when the noise levels are requested, and derived again when needed.
+
+        :rtype: np.ndarray|list(np.ndarray)
+        """
+
+        if self._data is None:
+            if self._energy is None:
+                raise AttributeError("'Grid' object has no attribute 'data'")
+            self._data = read_only(10 * np.log10(self._energy))
+        elif is_writeable(self._data):
+            self._energy = None
+            self._splines = {}
+        return self._data
+
+    @data.setter
+    def data(self, data):
+
+        # New noise levels invalidate the energy and the splines
+        self._data = data
+        self._energy = None
+        self._splines = {}
+
+    @property
+    def energy(self):
+        """
+        The grid data in the energy domain, i.e. 10^(L/10). The energy is derived from the noise levels on first use and
+        kept as a read-only array, so chained energetic operations skip the conversions in between.
+
+        As for the data, a writeable energy can be changed in place, so the noise levels and the splines that were
+        derived from it are dropped when the energy is requested.
+
+        :rtype: np.ndarray
+        """
+
+        if self._energy is None:
+            if self._data is None:
+                raise AttributeError("'Grid' object has no attribute 'energy'")
+            if isinstance(self._data, list):
+                raise TypeError('The energy cannot be determined for a multigrid with unequal grids.')
+            self._energy = read_only(10 ** (self._data / 10.))
+        elif is_writeable(self._energy):
+            self._data = None
+            self._splines = {}
+        return self._energy
+
+    @energy.setter
+    def energy(self, energy):
+
+        # A new energy invalidates the noise levels and the splines
+        self._energy = energy
+        self._data = None
+        self._splines = {}
+
     @classmethod
-    def read_envira(cls, path):
+    def read_envira(cls, path, bbox=None):
         """
         Create a Grid object from an envira file.
 
         :param str path: The path to the envira file.
+        :param tuple(float) bbox: only read the nodes inside the bounding box (x_min, y_min, x_max, y_max). Defaults to
+         None for the full grid.
         :rtype Grid
         """
 
         # Read the envira file
-        info, data = read_envira(path)
+        info, data = read_envira(path, bbox=bbox)
 
         # Extract the unit from the envira file
         unit = info['eenheid']
@@ -115,36 +361,68 @@ class Grid(object):
         return cls(data=data, info=info, unit=unit)
 
     @classmethod
-    def read_enviras(cls, path, pattern='*.dat', year_extractor=extract_year_from_file_name):
+    def read_enviras(cls, path, pattern=r'\.dat$', year_extractor=extract_year_from_file_name, workers=None, unit=None,
+                     years=None, shape=None):
         """
         Create a Grid object from multiple envira files.
 
-        :param str path: The path to the envira files.
+        :param str path: The path to the envira files, or to a zip or tar archive with the envira files. Archives are
+         read without extracting them to disk.
         :param str pattern: The pattern used to match the envira files.
         :param function year_extractor: The method used to extract the year from the file name.
+        :param int workers: The number of worker processes used to read the envira files, defaults to reading the files
+         one after another in this process. Archives are always read in this process, while the next envira file is
+         decompressed in a background thread.
+        :param str unit: only read the envira files with this noise level unit, e.g. 'Lden'.
+        :param list(int) years: only read the envira files of these years.
+        :param Shape shape: only read the envira files with this grid shape. The selection by unit, years and shape
+         uses the envira index, which is only stored on disk in the directory of enable_envira_cache(), see
+         index_enviras().
         :rtype Grid
         """
 
-        # Get the envira files
-        file_paths = [os.path.join(path, f) for f in os.listdir(path) if re.search(pattern, f)]
+        if is_envira_archive(path):
+            # Stream the envira files from the archive
+            file_paths, cls_info, cls_data = [], [], []
+            for file_path, info, data in read_archive_enviras(path, pattern, year_extractor, unit=unit, years=years,
+                                                              shape=shape):
+                if cls_data and data.shape != cls_data[0].shape:
+                    raise ValueError('All info in the provided info list should be the same')
+                file_paths.append(file_path)
+                cls_info.append(info)
+                cls_data.append(data)
+            cls_data = np.stack(cls_data) if cls_data else None
+        else:
+            if unit is None and years is None and shape is None:
+                # Get the envira files
+                file_paths = [os.path.join(path, f) for f in os.listdir(path) if re.search(pattern, f)]
+            else:
+                # Select the envira files from the index, without parsing the noise data
+                file_paths = select_enviras(path, pattern, year_extractor, unit=unit, years=years, shape=shape)
 
-        # Create info and data lists
-        cls_info = []
-        cls_data = []
-        cls_years = []
+            if workers is not None and workers > 1:
+                # Read the envira files in parallel
+                cls_info, cls_data = read_enviras_parallel(file_paths, workers)
+            else:
+                # Create an info list and a data stack
+                cls_info = []
+                cls_data = None
 
-        # Read the envira files
-        for file_path in file_paths:
-            # Extract the data and header from the file
-            info, data = read_envira(file_path)
+                # Read the envira files
+                for i, file_path in enumerate(file_paths):
+                    # Extract the data and header from the file
+                    info, data = read_envira(file_path)
 
-            # Extract the year from the file path
-            year = year_extractor(file_path)
+                    # Put the extracted data in the stack, which is allocated when the first grid is known
+                    if cls_data is None:
+                        cls_data = np.empty((len(file_paths),) + data.shape, dtype=get_dtype())
+                    if data.shape != cls_data.shape[1:]:
+                        raise ValueError('All info in the provided info list should be the same')
+                    cls_data[i] = data
+                    cls_info.append(info)
 
-            # Put the extracted data in the lists
-            cls_info.append(info)
-            cls_data.append(data)
-            cls_years.append(year)
+        # Extract the years from the file paths
+        cls_years = [year_extractor(file_path) for file_path in file_paths]
 
         # Extract the unit from the first envira file
         unit = cls_info[0]['eenheid']
@@ -152,6 +430,35 @@ class Grid(object):
         # Add the data to a Grid object
         return cls(data=cls_data, info=cls_info, unit=unit, years=cls_years)
 
+    @classmethod
+    def meteotoeslag_from_enviras(cls, path, pattern=r'\.dat$', year_extractor=extract_year_from_file_name,
+                                  methods=('empirisch', 'hybride')):
+        """
+        Determine the meteotoeslag directly from multiple envira files. The files are read one at a time, so the
+        multigrid is never held in memory, and all methods are determined from a single read.
+
+        :param str path: The path to the envira files, or to a zip or tar archive with the envira files.
+        :param str pattern: The pattern used to match the envira files.
+        :param function year_extractor: The method used to extract the year from the file name.
+        :param list(str) methods: the methods for selecting the meteorological representative years, defaults to both
+         'empirisch' and 'hybride'.
+        :return: the grid with meteotoeslag for each method.
+        :rtype dict(Grid)
+        """
+
+        if is_envira_archive(path):
+            # Stream the envira files from the archive
+            grids = ((year_extractor(file_path), cls(data=data, info=info, unit=info['eenheid']), file_path)
+                     for file_path, info, data in read_archive_enviras(path, pattern, year_extractor))
+        else:
+            # Get the envira files
+            file_paths = [os.path.join(path, f) for f in os.listdir(path) if re.search(pattern, f)]
+
+            # Read the envira files lazily
+            grids = ((year_extractor(file_path), cls.read_envira(file_path), file_path) for file_path in file_paths)
+
+        return meteotoeslag_from_grids(grids, methods)
+
     def validate(self, exclude=None):
         """
         Validate if the object's data and info are consistent with each other.
@@ -162,35 +469,90 @@ class Grid(object):
         # Create an empty list if exclude is not provided
         exclude = [] if exclude is None else exclude
 
-        if isinstance(self.data, list) and isinstance(self.info, list):
+        # Validate the domain that is present, without converting it
+        data = self._data if self._data is not None else self._energy
+
+        if self.is_multigrid() and hasattr(self, 'info') and isinstance(self.info, list):
             # This is the case for multigrid
 
             # Check if the lists are equal
-            if len(self.data) != len(self.info):
+            if len(data) != len(self.info):
                 raise IndexError('Provided data list and info list should have the same length.')
 
-            # Set the elements to check
-            data = np.array(self.data[0])
-
             # Put all the info in a data frame for easy checking
             info = pd.DataFrame(self.info)
 
             if not info.duplicated(subset=info.columns[~info.columns.isin(exclude)], keep=False).all():
                 raise ValueError('All info in the provided info list should be the same')
 
-        elif isinstance(self.data, list) or (hasattr(self, 'info') and isinstance(self.info, list)):
+        elif self.is_multigrid() or (hasattr(self, 'info') and isinstance(self.info, list)):
             raise TypeError('Supplied data and info for a multigrid should both be lists.')
 
-        elif isinstance(self.data, np.ndarray) and hasattr(self, 'years') and isinstance(self.years, list):
+        elif isinstance(data, np.ndarray) and hasattr(self, 'years') and isinstance(self.years, list):
             # This is the case for a meteotoeslag grid
             pass
         else:
             # This is the case for a normal grid
-            if not (self.shape.y_number, self.shape.x_number) == self.data.shape:
+            if not (self.shape.y_number, self.shape.x_number) == data.shape:
                 raise IndexError('Provided data does not have the same shape as mentioned in the header file.')
 
-    def copy(self):
-        return copy.deepcopy(self)
+    def is_multigrid(self):
+        """
+        Check if this is a multigrid, which holds a three-dimensional array or a list of unequal grids.
+
+        :rtype: bool
+        """
+
+        data = self._data if self._data is not None else self._energy
+        return isinstance(data, list) or (isinstance(data, np.ndarray) and data.ndim == 3)
+
+    def copy(self, deep=True):
+        """
+        Make a copy of the grid.
+
+        A shallow copy is a cheap copy-on-write copy, which shares the noise data with this grid. The shared arrays of
+        both grids are made read-only, so writing to them, e.g. grid.data[0, 0] = 0, raises an error instead of changing
+        the other grid. Operations like scale(), resize() and add() create new arrays for the grid they are applied to.
+        The info, shape and years are copied right away, because they are small and some operations update them in
+        place.
+
+        :param bool deep: copy the noise data right away, defaults to True. Use False for a copy-on-write copy.
+        :return: the copy of this grid.
+        :rtype: Grid
+        """
+
+        if deep:
+            return copy.deepcopy(self)
+
+        # Share the noise data as read-only views in both grids
+        grid = self.shared_copy()
+        self._data, self._energy = read_only(self._data), read_only(self._energy)
+
+        return grid
+
+    def shared_copy(self):
+        """
+        Make a copy of the grid with read-only views of the noise data of this grid, which stays writeable. This is used
+        by the operations that are not applied in place, as they replace the noise data of the copy right away.
+
+        :return: the copy of this grid.
+        :rtype: Grid
+        """
+
+        # Copy the attributes, except for the noise data
+        grid = copy.copy(self)
+        if hasattr(self, 'info'):
+            grid.info = copy.deepcopy(self.info)
+        if hasattr(self, 'shape'):
+            grid.shape = self.shape.copy()
+        if isinstance(getattr(self, 'years', None), list):
+            grid.years = list(self.years)
+
+        # The copy has its own views and splines of the shared noise data
+        grid._data, grid._energy = read_only(self._data), read_only(self._energy)
+        grid._splines = dict(self._splines)
+
+        return grid
 
     def to_envira(self, path):
         """
@@ -204,13 +566,99 @@ class Grid(object):
         # Write the data to the selected path
         return write_envira(path, self.info, self.data)
 
+    def to_enviras(self, directory, pattern='{unit} y{year}.dat', workers=None):
+        """
+        Write each year of a multigrid to an envira file.
+
+        :param str directory: the directory to write the envira files to.
+        :param str pattern: the pattern for the file names, which is formatted with the unit and the year.
+        :param int workers: the number of worker processes used to write the envira files, defaults to writing the files
+         one after another in this process.
+        :return: the paths to the envira files.
+        :rtype: list(str)
+        """
+
+        if not self.is_multigrid():
+            raise TypeError('Only the years of a multigrid can be written to multiple envira files.')
+
+        # Update the info of each year with the current shape, unless each grid has its own shape
+        if not isinstance(self.data, list):
+            for info in self.info:
+                info.update(self.shape.to_dict())
+
+        # Determine the path of each year
+        file_paths = [os.path.join(directory, pattern.format(unit=self.unit, year=year)) for year in self.years]
+
+        # Write the envira files
+        if workers is not None and workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(write_envira, file_paths, self.info, self.data))
+        else:
+            for file_path, info, data in zip(file_paths, self.info, self.data):
+                write_envira(file_path, info, data)
+
+        return file_paths
+
+    def save(self, path, dtype='float64', complevel=5):
+        """
+        Store the grid in a chunked and compressed binary file, which loads much faster than envira files. The file
+        holds the data, info, unit, shape and years. An HDF5 file is written, unless the path ends with '.npz'.
+
+        :param str path: the path to the file, e.g. 'scenario.h5' or 'scenario.npz'.
+        :param str dtype: the storage type of the noise levels, 'float64', 'float32' or 'int16' for noise levels that
+         are quantised to steps of 0.01 dB.
+        :param int complevel: the compression level, from 0 for no compression to 9.
+        :return: the path to the file.
+        :rtype: str
+        """
+
+        if isinstance(self.data, list):
+            raise TypeError('A multigrid with unequal grids cannot be stored in one file.')
+
+        # Collect the attributes of the grid
+        attributes = {
+            'info': getattr(self, 'info', None),
+            'unit': getattr(self, 'unit', None),
+            'shape': self.shape.to_dict() if hasattr(self, 'shape') else None,
+            'years': getattr(self, 'years', None),
+            'dtype': dtype
+        }
+
+        # Write the file
+        write_grid_file(path, quantise_grid(self.data, dtype), attributes, complevel)
+
+        return path
+
+    @classmethod
+    def load(cls, path, years=None, bbox=None):
+        """
+        Create a Grid object from a file that is written with Grid.save(). From HDF5 files, only the chunks of the
+        selected years and window are read.
+
+        :param str path: the path to the file.
+        :param list(int) years: only read these years of a multigrid, defaults to all years.
+        :param tuple(float) bbox: only read the nodes inside the bounding box (x_min, y_min, x_max, y_max). Defaults to
+         None for the full grid.
+        :rtype Grid
+        """
+
+        # Read the data and attributes
+        attributes, data = read_grid_file(path, years, bbox)
+
+        # Restore the noise levels
+        data = dequantise_grid(data, attributes['dtype'])
+
+        # Create the object
+        shape = Shape(attributes['shape']) if attributes['shape'] is not None else None
+        return cls(data=data, info=attributes['info'], shape=shape, years=attributes['years'], unit=attributes['unit'])
+
     def to_shapefile(self, path, level):
 
-        # Extract coordinates from contour and put into correct format for shapefile
-        contours = self.contour_points(level)
+        # Extract the polygons from the contour engine
+        polygons = self.contour_polygons(level)
 
-        # Create polygons with correct data type (and reverse the coordinates to get rid of open holes)
-        flat_list = [contour_coordinates[::-1, :].tolist() for contour_coordinates in contours]
+        # Reverse the rings, because shapefiles use clockwise exterior rings and counter-clockwise holes
+        flat_list = [ring[::-1, :].tolist() for exterior, holes in polygons for ring in [exterior] + holes]
 
         # Create the shapefile
         w = shapefile.Writer(target=path, shapeType=shapefile.POLYGON)
@@ -219,35 +667,79 @@ class Grid(object):
         w.field('SECOND_FLD', 'C', '40')
         w.record('First', 'Polygon')
 
-    def scale(self, factor):
+    def scale(self, factor, inplace=True):
         """
         Apply a scaling factor to the data.
 
         :param float|int factor: the factor to be applied.
+        :param bool inplace: scale this grid, or return a scaled copy and leave this grid unchanged.
+        :rtype: Grid
         """
 
-        if isinstance(self.data, list):
-            self.data = [d + 10 * np.log10(factor) for d in self.data]
-        else:
-            self.data += 10 * np.log10(factor)
+        if not inplace:
+            return self.shared_copy().scale(factor)
+
+        # The splines of the unscaled data are no longer valid
+        self._splines = {}
+
+        if isinstance(self._data, list):
+            self.data = [d + 10 * np.log10(factor) for d in self._data]
+            return self
+
+        # A domain that is derived from the other domain is read-only, and stays read-only when it is scaled. Both domains
+        # are read-only if they are shared with a copy, the noise levels are then scaled as the writeable domain.
+        data, energy = self._data, self._energy
+        derived_data = data is not None and energy is not None and not is_writeable(data) and is_writeable(energy)
+        derived_energy = data is not None and energy is not None and not is_writeable(energy) and not derived_data
+
+        # Scale the domains that are present, this is a single multiply in the energy domain. Read-only data is scaled
+        # into new arrays.
+        if data is not None:
+            if is_writeable(data):
+                data += 10 * np.log10(factor)
+            else:
+                data = data + 10 * np.log10(factor)
+            if derived_data:
+                data = read_only(data)
+        if energy is not None:
+            if is_writeable(energy):
+                energy *= factor
+            else:
+                energy = energy * factor
+            if derived_energy:
+                energy = read_only(energy)
+        self._data, self._energy = data, energy
 
         return self
 
     def contour_points(self, level):
-        # Extract the x and y coordinates
-        x = self.shape.get_x_coordinates()
-        y = self.shape.get_y_coordinates()
+        """
+        Determine the closed rings of the contour at the specified level. Contours that run over the edge of the grid
+        are closed along the boundary of the grid.
+
+        :param float level: the level of the contour in dB.
+        :return: the coordinates of the rings, exterior rings are counter-clockwise and holes are clockwise.
+        :rtype: list(np.ndarray)
+        """
+
+        if self.is_multigrid():
+            raise TypeError('Contours cannot be determined for a multi-contour grid.')
+
+        return contour_rings(self.data, self.shape.get_x_coordinates(), self.shape.get_y_coordinates(), level)
+
+    def contour_polygons(self, level):
+        """
+        Determine the polygons of the area at or above the specified level, including islands and lakes.
+
+        :param float level: the level of the contour in dB.
+        :return: the polygons as a list of exterior rings with a list of the holes in each polygon.
+        :rtype: list((np.ndarray, list(np.ndarray)))
+        """
 
-        # Create a contour using matplotlib without opening a figure
-        figsize = (21 / 2.54, 21 / 2.54)
-        fig = plt.figure(figsize=figsize)
-        ax = plt.Axes(fig, [0., 0., 1., 1.])
-        plt.close(fig)
-        ax.contourf(x, y, self.data, levels=[level, 100], colors='blue')
-        cs = ax.contour(x, y, self.data, levels=[level], colors='green', linewidths=2)
+        if self.is_multigrid():
+            raise TypeError('Contours cannot be determined for a multi-contour grid.')
 
-        # Extract coordinates from the contour
-        return cs.allsegs[0]
+        return contour_polygons(self.data, self.shape.get_x_coordinates(), self.shape.get_y_coordinates(), level)
 
     def hg(self):
         """
@@ -256,11 +748,11 @@ class Grid(object):
         todo: Add support for multigrid.
         """
 
-        if isinstance(self.data, list):
+        if self.is_multigrid():
             raise TypeError('Hoeveelheid Geluid (HG) cannot be calculated for a multi-contour grid.')
 
         # Conversion to "Hindersom" without scaling
-        hs = 10 ** (self.data / 10.)
+        hs = self.energy
 
         # Return total noise level (HG)
         return 10. * np.log10(hs.sum() / np.array(hs.shape).prod())
@@ -310,59 +802,60 @@ class Grid(object):
             raise LookupError(
                 'Expected 32 years for the meteorological surcharge but found {} years'.format(selected_years.sum()))
 
-        # Get the noise levels for all years
-        data = np.array(self.data)
-
-        # Select the maximum noise levels based on the selected years
-        meteorological_surcharge = np.amax(data[selected_years, :, :], axis=0)
+        # Select the maximum noise levels based on the selected years, without copying the selected grids
+        meteorological_surcharge = np.amax(np.asarray(self.data), axis=0, where=selected_years[:, None, None],
+                                           initial=-np.inf)
 
         # Return the grid with meteorological surcharge and the included years
         return meteorological_surcharge, years
 
-    def statistics(self):
+    def statistics(self, percentiles=None):
         """
         Determine the average, standard deviation and the confidence interval for a multigrid.
 
+        :param list(float) percentiles: the percentiles to determine for each grid point, between 0 and 100.
         :return collection of statistics for the current data.
-        :rtype dict(nd.array)
+        :rtype dict(Grid)
         """
 
-        if not isinstance(self.data, list):
+        if not self.is_multigrid():
             raise TypeError('Statistics can only be extracted from multigrids')
 
-        # Convert the data to a multidimensional array
-        data = np.array(self.data)
-
-        # Extract the statistics for each point in the grid
-        mean = 10 * np.log10(np.mean(10 ** (data / 10.), axis=0))
-        standard_deviation = np.std(self.data, axis=0)
-
-        # Calculate the 99.5% confidence interval
-        z = 2.5758
-        upper_bound_confidence_interval = mean + z * standard_deviation
-        lower_bound_confidence_interval = mean - z * standard_deviation
+        # Accumulate the statistics year by year to avoid a full-size copy of the data, the energy is reused if present
+        statistics = GridStatistics(shape=self.shape, unit=self.unit, percentiles=percentiles)
+        for i, year_data in enumerate(self.data):
+            statistics.update(year_data, None if self._energy is None else self._energy[i])
 
-        return {
-            'mean': Grid(data=mean, shape=self.shape, unit=self.unit),
-            'std': Grid(data=standard_deviation, shape=self.shape, unit=self.unit),
-            'dhi': Grid(data=upper_bound_confidence_interval, shape=self.shape, unit=self.unit),
-            'dlo': Grid(data=lower_bound_confidence_interval, shape=self.shape, unit=self.unit),
-        }
+        return statistics.result()
 
     def grid_from_year(self, year):
         """
-        Determine grid for the required year
+        Determine grid for the required year. The data of the returned grid is a view on the data of the multigrid.
         :param year: int
         :return: Grid
         :rtype: Grid object
         """
-        if not isinstance(self.data, list):
+        if not self.is_multigrid():
             raise TypeError('Grid from year can only be extracted from multigrids')
 
         # Get the location of the requested year, select the first match
         index = np.where(np.array(self.years) == year)[0][0]
 
         # Return the object
+        return self.grid_from_index(index)
+
+    def grid_from_index(self, index):
+        """
+        Determine grid for the required position in the multigrid. The data of the returned grid is a view on the data
+        of the multigrid.
+        :param index: int
+        :return: Grid
+        :rtype: Grid object
+        """
+
+        # Take the view in the domain that is present
+        if self._data is None and self._energy is not None:
+            return Grid(energy=self._energy[index], info=self.info[index], unit=self.unit)
         return Grid(data=self.data[index], info=self.info[index], unit=self.unit)
     
     def interpolation_function(self):
@@ -373,22 +866,103 @@ class Grid(object):
         :rtype function
         """
 
-        if isinstance(self.data, list):
+        if self.is_multigrid():
             raise TypeError('Interpolation functions can only be created from single grids.')
 
-        # Extract the coordinates of the current grid
-        x = self.shape.get_x_coordinates()
-        y = self.shape.get_y_coordinates()
+        def create():
+            # Extract the coordinates of the current grid
+            x = self.shape.get_x_coordinates()
+            y = self.shape.get_y_coordinates()
 
-        # Extract the data of the current grid
-        z = self.data
+            # Extract the data of the current grid
+            z = self.data
 
-        # Return the bi-cubic spline interpolation function
-        return RectBivariateSpline(y, x, z)
+            # Return the bi-cubic spline interpolation function
+            return RectBivariateSpline(y, x, z)
 
-    def refine(self, factor):
+        return self.cached_spline('interpolation_function', create)
+
+    def cached_spline(self, name, create):
+        """
+        Get a spline of the grid data from the cache, or create it. The cache is cleared when the data is replaced or
+        scaled, and a spline is created again when the shape changes or when writeable data is requested, see the data
+        property.
+
+        :param str name: the name of the spline.
+        :param function create: the method used to create the spline.
+        :return: the spline.
+        """
+
+        key = (name, self.shape.get_key())
+        if key not in self._splines:
+            self._splines[key] = create()
+        return self._splines[key]
+
+    def spline_coefficients(self):
+        """
+        Determine the coefficients of the bi-cubic interpolating spline, for all years of a multigrid at once. The
+        coefficients are cached, see cached_spline().
+
+        :return: the coefficients, with the same shape as the data.
+        :rtype: np.ndarray
+        """
+
+        if isinstance(self.data, list):
+            raise TypeError('Spline coefficients can only be determined for grids with equal shapes.')
+
+        return self.cached_spline('coefficients', lambda: spline_coefficients(self.data, self.shape))
+
+    def interpolate(self, x, y):
+        """
+        Evaluate the bi-cubic spline of the grid at the provided points, for all years of a multigrid at once. This
+        gives the same values as interpolation_function(), including the clipping of points outside of the grid.
+
+        :param np.ndarray x: the x-coordinates of the points.
+        :param np.ndarray y: the y-coordinates of the points, with the same shape as the x-coordinates.
+        :return: the noise levels, with the shape of the points for a single grid or (years,) + the shape of the points
+         for a multigrid.
+        :rtype: np.ndarray
+        """
+
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+
+        # Evaluate the spline at all points, which is a sparse product with all years at once
+        coefficients = self.spline_coefficients()
+        matrix = spline_evaluation_matrix(self.shape, x.ravel(), y.ravel())
+        if self.is_multigrid():
+            values = (matrix @ coefficients.reshape(coefficients.shape[0], -1).T).T
+            return values.reshape((coefficients.shape[0],) + x.shape)
+        return (matrix @ coefficients.ravel()).reshape(x.shape)
+
+    def interpolate_points(self, point_sets):
+        """
+        Evaluate the bi-cubic spline of the grid at multiple sets of points, e.g. addresses and measurement stations,
+        for all years of a multigrid at once. All sets are evaluated in a single sparse product.
+
+        :param dict|list point_sets: the sets of points as (x, y) tuples, in a dict or a list.
+        :return: the noise levels of each set of points, in the same container as the sets, see interpolate().
+        :rtype: dict|list
+        """
+
+        keys = list(point_sets.keys()) if isinstance(point_sets, dict) else list(range(len(point_sets)))
+        points = [np.broadcast_arrays(np.asarray(point_sets[key][0], dtype=float),
+                                      np.asarray(point_sets[key][1], dtype=float)) for key in keys]
+
+        # Evaluate all points at once
+        values = self.interpolate(np.concatenate([x.ravel() for x, _ in points]),
+                                  np.concatenate([y.ravel() for _, y in points]))
+
+        # Split the noise levels per set of points
+        ends = np.cumsum([x.size for x, _ in points])
+        parts = [part.reshape(values.shape[:-1] + x.shape)
+                 for part, (x, _) in zip(np.split(values, ends[:-1], axis=-1), points)]
+
+        return dict(zip(keys, parts)) if isinstance(point_sets, dict) else parts
+
+    def refine(self, factor, inplace=True):
         """
         Refine the grid with a bi-cubic spline interpolation.
+        :param bool inplace: refine this grid, or return a refined copy and leave this grid unchanged.
         :return refined grid
         :rtype Grid object
         """
@@ -397,24 +971,38 @@ class Grid(object):
         shape = self.shape.copy().refine(factor)
 
         # Return a reference to this object
-        return self.resize(shape)
+        return self.resize(shape, inplace=inplace)
 
-    def resize(self, shape):
+    def resize(self, shape, method='cubic', inplace=True):
         """
-        Reshape the grid based on with a bi-cubic spline interpolation.
+        Reshape the grid based on with a bi-cubic spline interpolation. The interpolation is applied as a precomputed
+        linear operator, which resamples all years of a multigrid at once.
+        :param Shape shape: the new shape.
+        :param str method: the interpolation method, which is either 'cubic' (default) or 'linear'.
+        :param bool inplace: resize this grid, or return a resized copy and leave this grid unchanged.
         :return resized grid
         :rtype Grid object
         """
 
+        if not inplace:
+            return self.shared_copy().resize(shape, method)
+
         if isinstance(self.data, list):
-            # Refine the grids of this multigrid and update the data and info
-            grids = [self.grid_from_year(year).resize(shape) for year in self.years]
-            self.data = [grid.data for grid in grids]
-            self.info = [grid.info for grid in grids]
+            # The grids of a multigrid with unequal grids have their own shape, so they are resized one by one
+            data = np.empty((len(self.years), int(shape.y_number), int(shape.x_number)), dtype=get_dtype())
+            for i in range(len(self.years)):
+                data[i] = resample(self.data[i], Shape(self.info[i]), shape, method)
+                self.info[i].update(shape.to_dict())
+            self.data = data
         else:
-            # Refine the grid and update the data and info
-            self.data = self.interpolation_function()(shape.get_y_coordinates(), shape.get_x_coordinates())
-            if hasattr(self, 'info'):
+            # Resize the grid, or all grids of a multigrid at once
+            self.data = resample(self.data, self.shape, shape, method)
+
+            # Update the info
+            if self.is_multigrid():
+                for info in self.info:
+                    info.update(shape.to_dict())
+            elif hasattr(self, 'info'):
                 self.info.update(shape.to_dict())
 
         # Assign the shape to the object
@@ -422,7 +1010,8 @@ class Grid(object):
 
         return self
 
-    def scale_per_time_interval(self, night_grid, scale_de=1, scale_n=1, apply_lnight_time_correction=True):
+    def scale_per_time_interval(self, night_grid, scale_de=1, scale_n=1, apply_lnight_time_correction=True,
+                                inplace=True):
         """
         Scale the Lden-grid separately for the day- and evening period and the night period.
 
@@ -432,118 +1021,219 @@ class Grid(object):
         :param float scale_de: the scaling factor for day- and evening.
         :param float scale_n: the scaling factor for night.
         :param bool apply_lnight_time_correction: setting for the Lnight time correction, defaults to True.
+        :param bool inplace: scale this grid, or return a scaled copy and leave this grid unchanged.
         :rtype: Grid
         """
 
+        if not inplace:
+            return self.shared_copy().scale_per_time_interval(night_grid, scale_de, scale_n, apply_lnight_time_correction)
+
         if self.unit != "Lden":
             raise TypeError('The supplied base grid to scale should have the unit Lden.')
         if night_grid.unit != "Lnight":
             raise TypeError('The supplied night grid should have the unit Lnight.')
-        if isinstance(self.data, list) or isinstance(night_grid.data, list):
+        if self.is_multigrid() or night_grid.is_multigrid():
             raise TypeError('This method does not support multigrids.')
         if scale_de <= 0 or scale_n <= 0:
             raise ValueError('This method does not support negative scaling factors.')
 
         # Convert Lnight to Ln
-        n_grid = night_grid.copy().scale(10)
+        n_grid = night_grid.shared_copy().scale(10)
 
         # Apply a time correction for Lnight if requested
         if apply_lnight_time_correction:
             n_grid.scale(8 / 24.)
 
         # Scale only the day- and evening
-        self.data = 10 * np.log10((10 ** (self.data / 10.) - 10 ** (n_grid.data / 10.)) * scale_de
-                                  + (10 ** (n_grid.data / 10.) * scale_n))
+        self.energy = (self.energy - n_grid.energy) * scale_de + n_grid.energy * scale_n
 
         # Return itself, the scaled grid
         return self
 
     def get_area_from_contour(self, level):
         """
-        Calculate the area in a contout with specified level.
+        Calculate the area in a contour with specified level. Islands and lakes are accounted for by the orientation of
+        the contour segments.
 
-        :level: The level of the contour in dB'.
-        :rtype: area in km2
-        
-        TO DO - first check on how to deald with islands an lakes seems to work OK. more verification is needed.
+        :param float level: the level of the contour in dB.
+        :return: area in km2
+        :rtype: float
         """
-       
-        # Extract the x and y coordinates
-        x = self.shape.get_x_coordinates()
-        y = self.shape.get_y_coordinates()
-
-        # Create a contour using matplotlib without opening a figure
-        figsize = (21 / 2.54, 21 / 2.54)
-        fig = plt.figure(figsize=figsize)
-        ax = plt.Axes(fig, [0., 0., 1., 1.])
-        plt.close(fig)
-        ax.contourf(x, y, self.data, levels=[level, 100], colors='blue')
-        cs = ax.contour(x, y, self.data, levels=[level], colors='green', linewidths=2)
-
-        ##organizing paths and computing individual areas
-        paths = cs.collections[0].get_paths()
-       
-        # loop over paths and find area
-        area_of_individual_polygons = []
-        for p in paths:
-              sign = -1 ##<-- assures that area of first(outer) polygon will be summed
-              if p.should_simplify:
-                     sign = 1  ##<-- assures that inner polygon will be summed
-        
-              verts = p.vertices
-              area_of_individual_polygons.append(sign*Polygon(verts).area)
 
-        ##computing total area and convert to km2      
-        total_area = np.sum(area_of_individual_polygons)/1000000
-       
-        return total_area
+        if self.is_multigrid():
+            raise TypeError('Contour areas cannot be determined for a multi-contour grid.')
+
+        # Sum the signed areas of the contour segments and convert to km2
+        area = contour_area(self.data, self.shape.get_x_coordinates(), self.shape.get_y_coordinates(), level)
+
+        return area / 1000000
+
+    def contour_areas(self, levels, interpolate=True, workers=None):
+        """
+        Calculate the contour areas for multiple levels, for each year of a multigrid.
+
+        :param list(float) levels: the levels of the contours in dB.
+        :param bool interpolate: use the sub-cell interpolated area of the contours, or else approximate the area as the
+        number of grid nodes at or above each level times the area of a cell. Defaults to True.
+        :param int workers: the number of processes to spread the years over, defaults to None for a serial calculation.
+        :return: the areas in km2, with the years as index and the levels as columns for a multigrid.
+        :rtype: pd.DataFrame|pd.Series
+        """
+
+        levels = list(levels)
+
+        if not self.is_multigrid():
+            x = self.shape.get_x_coordinates()
+            y = self.shape.get_y_coordinates()
+            area = contour_area_levels(self.data, x, y, levels, interpolate)
+            return pd.Series(area / 1000000, index=levels)
+
+        # Collect the data and shape of each year, the grids of a multigrid with unequal grids have their own shape
+        shapes = [Shape(info) for info in self.info] if isinstance(self.data, list) else [self.shape] * len(self.years)
+        x = [shape.get_x_coordinates() for shape in shapes]
+        y = [shape.get_y_coordinates() for shape in shapes]
+        n = len(shapes)
+
+        # Calculate the areas of all years
+        if workers is None:
+            areas = list(map(contour_area_levels, self.data, x, y, [levels] * n, [interpolate] * n))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                areas = list(executor.map(contour_area_levels, self.data, x, y, [levels] * n, [interpolate] * n))
+
+        return pd.DataFrame(np.array(areas) / 1000000, index=self.years, columns=levels)
    
-    def add(self,grid2):
-        
+    def add(self, grid2, inplace=True):
+        """
+        Add another grid energetically.
+
+        :param Grid grid2: the grid to add, which is aligned to the shape and years of this grid, see aligned_energy().
+        :param bool inplace: add to this grid, or return the sum as a new grid and leave this grid unchanged.
+        :rtype: Grid
+        """
+
+        if not inplace:
+            return self.shared_copy().add(grid2)
+
         if self.unit!=grid2.unit:
             raise ValueError("Grids do not have the same unit!")
-         
-        if self.shape!=grid2.shape:
-            #raise ValueError("Grids do not have the same size")
-            print("Grids do not have the same size. The new grid has been resized.")
-            
-            grid2=grid2.resize(self.shape)
-        
-        data_1=10**(self.data/10)
-        data_2=10**(grid2.data/10)
-        
-        data_out=data_1 + data_2
-        
-        data=10*np.log10(data_out)
-        self.data = data
-        
+
+        # Sum the grids in the energy domain, the noise levels are only derived when requested
+        self.energy = as_dtype(self.energy + self.aligned_energy(grid2))
+
         return self
-    
-    def subtract(self,grid2):  
-        
+
+    def subtract(self, grid2, inplace=True):
+        """
+        Subtract another grid energetically. Nodes without remaining energy are set to 0 dB.
+
+        :param Grid grid2: the grid to subtract, which is aligned to the shape and years of this grid, see
+         aligned_energy().
+        :param bool inplace: subtract from this grid, or return the difference as a new grid and leave this grid
+         unchanged.
+        :rtype: Grid
+        """
+
+        if not inplace:
+            return self.shared_copy().subtract(grid2)
+
         if self.unit!=grid2.unit:
             raise ValueError("Grids do not have the same unit!")
-         
-        if self.shape!=grid2.shape:
-            #raise ValueError("Grids do not have the same size")
-            print("Grids do not have the same size. The new grid has been resized.")
-            
-            grid2=grid2.resize(self.shape)
-            
-        data_1=10**(self.data/10)
-        data_2=10**(grid2.data/10)
-        
-        data_out=data_1 - data_2
-        
-        data_out=np.where(data_out<=0, 1, data_out) 
-        
-        data=10*np.log10(data_out)
-        
-        self.data = data
+
+        # Subtract the grids in the energy domain, the noise levels are only derived when requested
+        energy = self.energy - self.aligned_energy(grid2)
+
+        self.energy = as_dtype(np.where(energy<=0, 1, energy))
         return self
-    
+
+    def aligned_energy(self, grid):
+        """
+        Get the energy of another grid, aligned to the shape and years of this grid. The other grid is left unchanged.
+
+        Grids with the same step, whose origins differ by a whole number of steps, are aligned exactly by selecting the
+        coinciding nodes. Nodes outside of the other grid get the value of the nearest edge node, like the resampling
+        does. Grids with another step are resampled to the shape of this grid. The years of a multigrid are aligned with
+        the years of this multigrid, a single grid is applied to all years.
+
+        :param Grid grid: the other grid.
+        :return: the aligned energy.
+        :rtype: np.ndarray
+        """
+
+        # Determine the years of the other grid in the order of this grid
+        order = slice(None)
+        if grid.is_multigrid():
+            if not self.is_multigrid():
+                raise TypeError('A multigrid cannot be combined with a single grid.')
+            years = list(grid.years)
+            missing = [year for year in self.years if year not in years]
+            if missing:
+                raise ValueError('The years {} are missing in the other multigrid.'.format(missing))
+            order = [years.index(year) for year in self.years]
+
+        # Grids with the same shape are already aligned
+        if self.shape.get_key() == grid.shape.get_key():
+            return grid.energy[order]
+
+        # Select the coinciding nodes if the grids have the same step
+        indices = alignment_indices(grid.shape, self.shape)
+        if indices is not None:
+            return grid.energy[order][..., indices[0][:, np.newaxis], indices[1]]
+
+        print("Grids do not have the same size. The new grid has been resized.")
+
+        # Resample the noise levels of the other grid
+        return 10 ** (resample(grid.data[order], grid.shape, self.shape) / 10.)
+
     @classmethod
-    def read_enviras_NAxx(cls, grid_path, pattern='*.dat', conditions_path=None):
+    def energetic_sum(cls, grids, weights=None, workers=None):
+        """
+        Sum component grids energetically, e.g. the grids per runway, aircraft category or period of a scenario. The
+        components are read and added one at a time with compensated summation in double precision, so the memory use
+        is proportional to one grid and the result does not depend on the order of many small contributions.
+
+        The first component defines the shape, years, unit and info of the sum. The other components are aligned to it,
+        see aligned_energy().
+
+        :param list(Grid|str) grids: the component grids, or the paths to their envira files.
+        :param list(float) weights: the weight of each component, which multiplies its energy. Defaults to 1 for each
+         component.
+        :param int workers: the number of worker processes, each summing a part of the components. Defaults to summing
+         the components in this process. This is useful for envira paths, grids in memory are sent to the workers.
+        :rtype: Grid
+        """
+
+        grids = list(grids)
+        weights = np.ones(len(grids)) if weights is None else np.asarray(weights, dtype=float)
+        if len(grids) == 0:
+            raise ValueError('At least one grid is required for an energetic sum.')
+        if len(weights) != len(grids):
+            raise ValueError('The number of weights should be equal to the number of grids.')
+
+        # The first component is the template for the sum
+        first = cls.read_envira(grids[0]) if isinstance(grids[0], str) else grids[0]
+
+        if workers is not None and workers > 1:
+            # Sum parts of the components in parallel and combine the partial sums
+            parts = [part for part in np.array_split(np.arange(len(grids)), workers) if len(part)]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                partial_sums = list(executor.map(energetic_sum_components, [first] * len(parts),
+                                                 [[grids[i] for i in part] for part in parts],
+                                                 [weights[part] for part in parts]))
+            total, compensation = partial_sums[0]
+            for partial_total, partial_compensation in partial_sums[1:]:
+                compensated_add(total, compensation, partial_total)
+                compensation += partial_compensation
+        else:
+            total, compensation = energetic_sum_components(first, [first] + grids[1:], weights)
+
+        # Create the grid from the compensated sum
+        return cls(energy=as_dtype(total + compensation), info=copy.deepcopy(getattr(first, 'info', None)),
+                   shape=first.shape.copy(), years=copy.copy(getattr(first, 'years', None)),
+                   unit=getattr(first, 'unit', None))
+
+    @classmethod
+    def read_enviras_NAxx(cls, grid_path, pattern=r'\.dat$', conditions_path=None):
         """
         Create a Grid object from multiple LAmax envira grids.
 
@@ -602,6 +1292,28 @@ class Grid(object):
         return cls(data=cls_data, info=cls_info, unit=unit, years=cls_years, unequal_grids=True)
 
   
+    def number_above(self, thresholds, weights=None):
+        """
+        Create NAxx grids for multiple thresholds at once from a multigrid of LAmax grids with equal shapes.
+
+        :param list(float) thresholds: the thresholds in dB, e.g. [60, 65, 70].
+        :param list(float)|np.ndarray weights: the weight of each grid in the multigrid, e.g. the number of flights for
+         each flight profile. Defaults to 1 for each grid.
+        :return: the NAxx grid for each threshold.
+        :rtype: dict(Grid)
+        """
+
+        if not self.is_multigrid():
+            raise TypeError('The number above a threshold can only be determined for a multigrid.')
+        if isinstance(self.data, list):
+            raise TypeError('The grids of the multigrid should be resized to the same shape first.')
+
+        # Count all thresholds in a single pass over the grids
+        counts = number_above(self.data, thresholds, weights)
+
+        return {threshold: Grid(data=count, info=copy.deepcopy(self.info[0]), shape=self.shape.copy(), unit='NAxx')
+                for threshold, count in zip(thresholds, counts)}
+
     def create_NAxx(self, number_above_dB, path, reshape_data=None, refinement_factor=1):
         """
         Creates the actual NAxx grid. First it resizes every individual grid to the same 
@@ -649,43 +1361,23 @@ class Grid(object):
         gridshape=Shape(data)
         self.resize(gridshape)
 
-        # Creating an empty array of zeros in preparation of the scaling factors assignment
-        # The multigrid will be multiplied by this, so every layer gets the respective scaling
-        # factor from the flights_scale. 
-        scale=np.zeros(np.shape(self.data))
-        self.scale=scale
-        
-        # Looping through all individual grids to filter for NAxx and assign scaling
-        for i in range(len(self.scale)):
-            
-            # Filter of the datapoints are above the threshold.
-            # If yes, assign a 1, if not, a 0.
-            self.data[i][self.data[i]<number_above_dB]=0        
-            self.data[i][self.data[i]>=number_above_dB]=1
-            
-            # Check if the current grid is in the list of conditions
-            # If yes, assign scaling factors, if not, assign a 0 scaling to
-            # remove the grid completely from the count
-            if self.years[i] in self.flights_scale:
+        # Look up the scaling factor of each grid in the conditions. Grids that are not in the list of conditions get a
+        # scaling factor of 0 to remove them from the count
+        weights = np.zeros(len(self.years))
+        for i, year in enumerate(self.years):
+            if year in self.flights_scale:
                 # Find the correct scaling factor to assign to the respective grid
-                position=np.where(self.flights_scale==self.years[i])[0][0]
-                scale[i,:,:]=float(self.flights_scale[position,1])
-                
-            # if grid name is not in conditions file, remove grid from count    
-            else:
-                scale[i,:,:]=0
-                
-        # Apply the scaling factor matrix to the 0/1 multigrid
-        new_grids=self.data*scale
-        
-        # Sum all values along the 3rd axis to create sum grid
-        self.data=new_grids.sum(axis=0)
-        
-        # Two verification checkt to compare which grids are present, 
-        # and which values are assigned to them. TO enable checking that the correct
+                position = np.where(self.flights_scale == year)[0][0]
+                weights[i] = float(self.flights_scale[position, 1])
+
+        # Count the weighted number of grids at or above the threshold
+        self.data = number_above(self.data, [number_above_dB], weights)[0]
+
+        # Two verification checks to compare which grids are present, 
+        # and which values are assigned to them. To enable checking that the correct
         # ones were set to 0
-        self.years_check=self.years
-        self.scale_check=self.scale[:,0,0]
+        self.years_check = self.years
+        self.scale_check = weights
         
         
         #These are just here to make the object work. Not actually used for anything
@@ -722,11 +1414,12 @@ def relative_den_norm_performance(scale, norm, wbs, den_grid, night_grid=None, s
             scale_n = scale
 
         # Apply the scale per time interval
-        grid = den_grid.copy().scale_per_time_interval(night_grid=night_grid, scale_de=scale_de, scale_n=scale_n,
-                                                       apply_lnight_time_correction=apply_lnight_time_correction)
+        grid = den_grid.scale_per_time_interval(night_grid=night_grid, scale_de=scale_de, scale_n=scale_n,
+                                                apply_lnight_time_correction=apply_lnight_time_correction,
+                                                inplace=False)
     else:
         # Apply the scale
-        grid = den_grid.copy().scale(scale)
+        grid = den_grid.scale(scale, inplace=False)
 
     # Add the Lden data to the wbs
     wbs = wbs.copy().add_noise_from_grid(grid)
@@ -888,10 +1581,439 @@ class Shape(object):
     def to_dict(self):
         return self.__dict__
 
+    def get_key(self):
+        """
+        Get a hashable key for the coordinates of this shape, e.g. to cache results that only depend on the shape.
+        :return: the start, stop and number of coordinates in x and y direction.
+        :rtype: tuple
+        """
+        return self.x_start, self.x_stop, int(self.x_number), self.y_start, self.y_stop, int(self.y_number)
+
     def copy(self):
         return copy.deepcopy(self)
 
 
+class GridStatistics(object):
+    """
+    An online accumulator for the statistics of a multigrid.
+
+    The grids are added year by year or in chunks of years, so the multigrid never has to be stacked. The energetic mean
+    is accumulated as a sum of energy and the standard deviation of the noise levels with the Welford algorithm.
+    Accumulators of different parts of a multigrid, e.g. calculated by different workers, can be merged. Percentiles are
+    optionally determined from the noise levels, which are kept as 16-bit integers in steps of 0.01 dB. This takes a
+    quarter of the memory of the stacked multigrid, and the percentiles deviate at most 0.005 dB from the exact values.
+    """
+
+    # The z-value for the 99.5% confidence interval
+    z = 2.5758
+
+    # The step in dB of the noise levels that are kept for the percentiles
+    resolution = 0.01
+
+    # The number of grid points for which the percentiles are determined at once
+    block_size = 1 << 16
+
+    def __init__(self, shape=None, unit=None, percentiles=None):
+        """
+
+        :param Shape shape: the shape of the grids.
+        :param str unit: the noise level unit of the grids.
+        :param list(float) percentiles: the percentiles to determine, between 0 and 100. Defaults to None for no
+         percentiles.
+        """
+
+        self.shape = shape
+        self.unit = unit
+        self.percentiles = [] if percentiles is None else list(percentiles)
+
+        # The accumulated statistics, which are allocated when the first grid is added
+        self.count = 0
+        self.energy = None
+        self.mean = None
+        self.sum_of_squares = None
+
+        # The quantised noise levels of each chunk of grids, only for the percentiles
+        self.levels = []
+
+    def update(self, data, energy=None):
+        """
+        Add a grid or a chunk of grids to the statistics.
+
+        :param np.ndarray data: the noise levels of a grid with the shape (y, x) or of a chunk with the shape (years, y,
+         x).
+        :param np.ndarray energy: the energy of the grid or chunk, if it is already available.
+        :return: the updated statistics.
+        :rtype: GridStatistics
+        """
+
+        data = np.asarray(data, dtype=float)
+        if data.ndim == 2:
+            data = data[np.newaxis]
+            energy = None if energy is None else energy[np.newaxis]
+
+        # Determine the statistics of the chunk
+        count = data.shape[0]
+        energy = (10 ** (data / 10.) if energy is None else energy).sum(axis=0)
+        mean = data.mean(axis=0)
+        sum_of_squares = ((data - mean) ** 2).sum(axis=0) if count > 1 else np.zeros(mean.shape)
+
+        # Keep the quantised noise levels for the percentiles
+        levels = None
+        if self.percentiles:
+            limits = np.iinfo(np.int16)
+            levels = [np.clip(np.round(data / self.resolution), limits.min, limits.max).astype(np.int16)]
+
+        return self.combine(count, energy, mean, sum_of_squares, levels)
+
+    def merge(self, other):
+        """
+        Merge the statistics of another accumulator into these statistics.
+
+        :param GridStatistics other: the statistics to merge.
+        :return: the merged statistics.
+        :rtype: GridStatistics
+        """
+
+        if other.count == 0:
+            return self
+
+        return self.combine(other.count, other.energy, other.mean, other.sum_of_squares, other.levels or None)
+
+    def combine(self, count, energy, mean, sum_of_squares, levels=None):
+        """
+        Combine the accumulated statistics with the statistics of another set of grids.
+
+        :param int count: the number of grids.
+        :param np.ndarray energy: the summed energy of the grids.
+        :param np.ndarray mean: the mean noise level of the grids.
+        :param np.ndarray sum_of_squares: the sum of squared deviations from the mean noise level.
+        :param list(np.ndarray) levels: the quantised noise levels of the grids in chunks, defaults to None.
+        :return: the combined statistics.
+        :rtype: GridStatistics
+        """
+
+        if self.count == 0:
+            self.count = count
+            self.energy = energy.copy()
+            self.mean = mean.copy()
+            self.sum_of_squares = sum_of_squares.copy()
+            self.levels = [] if levels is None else list(levels)
+            return self
+
+        if mean.shape != self.mean.shape:
+            raise ValueError('All info in the provided info list should be the same')
+
+        # Combine the mean and the sum of squares of both sets with the parallel variant of the Welford algorithm
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * (count / total)
+        self.sum_of_squares += sum_of_squares + delta ** 2 * (self.count * count / total)
+        self.energy += energy
+        self.count = total
+
+        if levels is not None:
+            self.levels.extend(levels)
+
+        return self
+
+    def result(self):
+        """
+        Determine the average, standard deviation and the confidence interval of the accumulated grids.
+
+        :return collection of statistics for the accumulated data, including a grid for each percentile, e.g. 'p95'.
+        :rtype dict(Grid)
+        """
+
+        if self.count == 0:
+            raise ValueError('Statistics can only be extracted after adding grids')
+
+        # Calculate the energetic mean and the standard deviation of the noise levels
+        mean = 10 * np.log10(self.energy / self.count)
+        standard_deviation = np.sqrt(self.sum_of_squares / self.count)
+
+        statistics = {
+            'mean': Grid(data=mean, shape=self.shape, unit=self.unit),
+            'std': Grid(data=standard_deviation, shape=self.shape, unit=self.unit),
+            'dhi': Grid(data=mean + self.z * standard_deviation, shape=self.shape, unit=self.unit),
+            'dlo': Grid(data=mean - self.z * standard_deviation, shape=self.shape, unit=self.unit),
+        }
+
+        # Determine the percentiles from the quantised noise levels, a block of grid points at a time
+        if self.percentiles and self.levels:
+            levels = [chunk.reshape(chunk.shape[0], -1) for chunk in self.levels]
+            data = np.empty((len(self.percentiles), mean.size))
+            for start in range(0, mean.size, self.block_size):
+                block = np.concatenate([chunk[:, start:start + self.block_size] for chunk in levels])
+                data[:, start:start + self.block_size] = np.percentile(block, self.percentiles, axis=0)
+            data = (data * self.resolution).reshape((len(self.percentiles),) + mean.shape)
+            for percentile, percentile_data in zip(self.percentiles, data):
+                statistics['p{:g}'.format(percentile)] = Grid(data=percentile_data, shape=self.shape, unit=self.unit)
+
+        return statistics
+
+
+def spline_knots(coordinates):
+    """
+    Determine the knots of the interpolating cubic spline, which are the same as used by RectBivariateSpline.
+
+    :param np.ndarray coordinates: the coordinates of the data points.
+    :rtype: np.ndarray
+    """
+
+    if coordinates.size < 4:
+        raise ValueError('At least 4 coordinates are required for a cubic spline, but {} are given.'.format(
+            coordinates.size))
+
+    return np.r_[[coordinates[0]] * 4, coordinates[2:-2], [coordinates[-1]] * 4]
+
+
+@lru_cache(maxsize=64)
+def axis_spline_basis(start, stop, number):
+    """
+    Determine the knots of the interpolating cubic spline along a single axis and the inverse of its collocation
+    matrix, which maps the data to the spline coefficients. The results are cached, since they only depend on the
+    coordinates.
+
+    :param float start: the first coordinate.
+    :param float stop: the last coordinate.
+    :param int number: the number of coordinates.
+    :return: the knots and the inverse collocation matrix with shape (number, number).
+    :rtype: tuple(np.ndarray, np.ndarray)
+    """
+
+    coordinates = np.linspace(start, stop, num=int(number))
+    knots = spline_knots(coordinates)
+    inverse = np.linalg.inv(BSpline.design_matrix(coordinates, knots, 3).toarray())
+
+    # Prevent changes to the cached arrays
+    knots.flags.writeable = False
+    inverse.flags.writeable = False
+
+    return knots, inverse
+
+
+@lru_cache(maxsize=64)
+def axis_resampling_operator(start, stop, number, new_start, new_stop, new_number, method='cubic'):
+    """
+    Determine the linear operator that resamples data along a single axis from the old to the new coordinates.
+
+    For the cubic method, the operator evaluates the interpolating cubic spline at the new coordinates. This gives the
+    same result as RectBivariateSpline, including the clipping of coordinates outside of the original range. The
+    operators are cached, since all years of a multigrid and repeated resizes share the same coordinates.
+
+    :param float start: the first old coordinate.
+    :param float stop: the last old coordinate.
+    :param int number: the number of old coordinates.
+    :param float new_start: the first new coordinate.
+    :param float new_stop: the last new coordinate.
+    :param int new_number: the number of new coordinates.
+    :param str method: the interpolation method, which is either 'cubic' or 'linear'.
+    :return: the operator with shape (new_number, number).
+    :rtype: np.ndarray
+    """
+
+    # Get the old and new coordinates, new coordinates are clipped to the range of the old coordinates
+    coordinates = np.linspace(start, stop, num=int(number))
+    new_coordinates = np.clip(np.linspace(new_start, new_stop, num=int(new_number)), start, stop)
+
+    if method == 'cubic':
+        # Combine the solution for the spline coefficients with the evaluation at the new coordinates
+        knots, inverse = axis_spline_basis(start, stop, number)
+        operator = BSpline.design_matrix(new_coordinates, knots, 3) @ inverse
+    elif method == 'linear':
+        # Determine the neighbouring old coordinates and the weight of each
+        index = np.clip(np.searchsorted(coordinates, new_coordinates, side='right') - 1, 0, coordinates.size - 2)
+        weight = (new_coordinates - coordinates[index]) / (coordinates[index + 1] - coordinates[index])
+        operator = np.zeros((new_coordinates.size, coordinates.size))
+        operator[np.arange(new_coordinates.size), index] = 1 - weight
+        operator[np.arange(new_coordinates.size), index + 1] += weight
+    else:
+        raise ValueError('The interpolation method {} is not known. Please use cubic or linear.'.format(method))
+
+    # Prevent changes to the cached operator
+    operator.flags.writeable = False
+
+    return operator
+
+
+def resampling_operator(shape, new_shape, method='cubic'):
+    """
+    Determine the separable linear operator that resamples a grid from the old to the new shape.
+
+    :param Shape shape: the old shape.
+    :param Shape new_shape: the new shape.
+    :param str method: the interpolation method, which is either 'cubic' or 'linear'.
+    :return: the operators for the y-axis and the x-axis.
+    :rtype: tuple(np.ndarray, np.ndarray)
+    """
+
+    y_operator = axis_resampling_operator(shape.y_start, shape.y_stop, int(shape.y_number), new_shape.y_start,
+                                          new_shape.y_stop, int(new_shape.y_number), method)
+    x_operator = axis_resampling_operator(shape.x_start, shape.x_stop, int(shape.x_number), new_shape.x_start,
+                                          new_shape.x_stop, int(new_shape.x_number), method)
+
+    return y_operator, x_operator
+
+
+def compensated_add(total, compensation, values):
+    """
+    Add values to a sum in place with the compensated summation of Neumaier. The rounding errors of the sum are
+    collected in the compensation, so the accurate sum is the sum plus the compensation.
+
+    :param np.ndarray total: the sum, which is updated in place.
+    :param np.ndarray compensation: the compensation, which is updated in place.
+    :param np.ndarray values: the values to add.
+    """
+
+    # Add the values and collect the low-order part that is lost, which depends on the largest of both terms
+    result = total + values
+    compensation += np.where(np.abs(total) >= np.abs(values), (total - result) + values, (values - result) + total)
+    total[...] = result
+
+
+def energetic_sum_components(template, grids, weights):
+    """
+    Sum the weighted energy of component grids that are aligned to a template grid, see Grid.energetic_sum().
+
+    :param Grid template: the grid that defines the shape and years of the sum.
+    :param list(Grid|str) grids: the component grids, or the paths to their envira files.
+    :param list(float) weights: the weight of each component.
+    :return: the sum of the energy and its compensation, see compensated_add().
+    :rtype: tuple(np.ndarray, np.ndarray)
+    """
+
+    total = np.zeros(np.shape(template.data))
+    compensation = np.zeros(total.shape)
+
+    for grid, weight in zip(grids, weights):
+        # Read the component one at a time
+        if isinstance(grid, str):
+            grid = Grid.read_envira(grid)
+        if grid.unit != template.unit:
+            raise ValueError("Grids do not have the same unit!")
+
+        # Add the weighted energy in double precision
+        compensated_add(total, compensation, np.asarray(template.aligned_energy(grid), dtype=float) * weight)
+
+    return total, compensation
+
+
+def alignment_indices(shape, new_shape):
+    """
+    Determine the nodes of a grid that coincide with the nodes of a grid with a new shape. This is only possible if both
+    shapes have the same step and their origins differ by a whole number of steps, e.g. for grids with another extent.
+    Nodes of the new shape outside of the grid get the nearest edge node.
+
+    :param Shape shape: the shape of the grid.
+    :param Shape new_shape: the new shape.
+    :return: the row and column indices in the grid for the new shape, or None if the shapes cannot be aligned without
+     interpolation.
+    :rtype: tuple(np.ndarray, np.ndarray)|None
+    """
+
+    indices = []
+    for start, step, number, new_start, new_step, new_number in [
+            (shape.y_start, shape.y_step, shape.y_number, new_shape.y_start, new_shape.y_step, new_shape.y_number),
+            (shape.x_start, shape.x_step, shape.x_number, new_shape.x_start, new_shape.x_step, new_shape.x_number)]:
+
+        # Check if the step is the same and the offset is a whole number of steps
+        offset = (new_start - start) / step
+        if not np.isclose(new_step, step, rtol=1e-9, atol=0) or not np.isclose(offset, np.round(offset), rtol=0,
+                                                                                 atol=1e-6):
+            return None
+
+        # Select the coinciding nodes, clipped to the edges of the grid
+        indices.append(np.clip(np.arange(int(new_number)) + int(np.round(offset)), 0, int(number) - 1))
+
+    return tuple(indices)
+
+
+def resample(data, shape, new_shape, method='cubic'):
+    """
+    Resample a grid, or a stack of grids, from the old to the new shape.
+
+    :param np.ndarray data: the grid data with shape (y, x), or a stack of grids with shape (years, y, x).
+    :param Shape shape: the old shape.
+    :param Shape new_shape: the new shape.
+    :param str method: the interpolation method, which is either 'cubic' or 'linear'.
+    :return: the resampled data.
+    :rtype: np.ndarray
+    """
+
+    return apply_separable_operator(data, *resampling_operator(shape, new_shape, method))
+
+
+def apply_separable_operator(data, y_operator, x_operator):
+    """
+    Apply a linear operator to the y- and x-axis of a grid, or a stack of grids.
+
+    :param np.ndarray data: the grid data with shape (y, x), or a stack of grids with shape (years, y, x).
+    :param np.ndarray y_operator: the operator for the y-axis.
+    :param np.ndarray x_operator: the operator for the x-axis.
+    :rtype: np.ndarray
+    """
+
+    # Apply the operators in the floating point type of the package
+    data, y_operator, x_operator = as_dtype(data), as_dtype(y_operator), as_dtype(x_operator)
+
+    # Apply the operator along the y-axis for all years in a single matrix product
+    moved = np.moveaxis(data, -2, 0)
+    resampled = np.dot(y_operator, moved.reshape(moved.shape[0], -1))
+    resampled = np.ascontiguousarray(np.moveaxis(resampled.reshape((y_operator.shape[0],) + moved.shape[1:]), 0, -2))
+
+    # Apply the operator along the x-axis for all rows of all years in a single matrix product, which directly gives
+    # the final layout
+    return np.dot(resampled.reshape(-1, resampled.shape[-1]), x_operator.T).reshape(
+        resampled.shape[:-1] + (x_operator.shape[0],))
+
+
+def spline_coefficients(data, shape):
+    """
+    Determine the coefficients of the bi-cubic interpolating spline of a grid, or a stack of grids. These are the same
+    coefficients as used by RectBivariateSpline.
+
+    :param np.ndarray data: the grid data with shape (y, x), or a stack of grids with shape (years, y, x).
+    :param Shape shape: the shape of the grid.
+    :return: the coefficients, with the same shape as the data.
+    :rtype: np.ndarray
+    """
+
+    _, y_inverse = axis_spline_basis(shape.y_start, shape.y_stop, int(shape.y_number))
+    _, x_inverse = axis_spline_basis(shape.x_start, shape.x_stop, int(shape.x_number))
+
+    return apply_separable_operator(data, y_inverse, x_inverse)
+
+
+def spline_evaluation_matrix(shape, x, y):
+    """
+    Determine the sparse matrix that evaluates the bi-cubic spline of a grid at the provided points. Each point only
+    depends on 4x4 spline coefficients, so the matrix has 16 non-zero values per point. Multiplying the matrix with the
+    flattened coefficients of spline_coefficients() gives the same values as RectBivariateSpline, including the clipping
+    of points outside of the grid, within a tolerance of 1e-9 dB.
+
+    :param Shape shape: the shape of the grid.
+    :param np.ndarray x: the x-coordinates of the points.
+    :param np.ndarray y: the y-coordinates of the points.
+    :return: the sparse matrix with shape (points, y * x).
+    :rtype: csr_matrix
+    """
+
+    y_knots, _ = axis_spline_basis(shape.y_start, shape.y_stop, int(shape.y_number))
+    x_knots, _ = axis_spline_basis(shape.x_start, shape.x_stop, int(shape.x_number))
+
+    # Evaluate the B-spline basis for each axis, points are clipped to the grid like RectBivariateSpline does
+    y_basis = BSpline.design_matrix(np.clip(np.asarray(y, dtype=float), shape.y_start, shape.y_stop), y_knots, 3)
+    x_basis = BSpline.design_matrix(np.clip(np.asarray(x, dtype=float), shape.x_start, shape.x_stop), x_knots, 3)
+
+    # Each row of the design matrices holds the 4 basis functions of a point, combine these to the 4x4 coefficients
+    x_number = int(shape.x_number)
+    rows = np.repeat(np.arange(y_basis.shape[0]), 16)
+    columns = (y_basis.indices.reshape(-1, 4, 1) * x_number + x_basis.indices.reshape(-1, 1, 4)).ravel()
+    values = as_dtype((y_basis.data.reshape(-1, 4, 1) * x_basis.data.reshape(-1, 1, 4)).ravel())
+
+    return csr_matrix((values, (rows, columns)), shape=(y_basis.shape[0], int(shape.y_number) * x_number))
+
+
 def hdr_val(string, type):
     """
     Read value from header line
@@ -900,106 +2022,1068 @@ def hdr_val(string, type):
     return type(val)
 
 
-def read_envira(file_path):
+def enable_envira_cache(directory=None):
+    """
+    Enable the binary cache for envira files. Once an envira file is parsed, its header and data are stored in a binary
+    format. Subsequent reads of the same, unchanged file are loaded as a memory-map instead of parsing the text again.
+
+    :param str directory: the directory to store the cache files in. If not provided, the cache files are stored as
+     sidecar files next to the envira files.
+    """
+
+    # Create the cache directory if it does not exist yet
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+
+    envira_cache['enabled'] = True
+    envira_cache['directory'] = directory
+
+
+def disable_envira_cache():
+    """
+    Disable the binary cache for envira files. Existing cache files are left untouched.
+    """
+
+    envira_cache['enabled'] = False
+    envira_cache['directory'] = None
+
+
+def envira_cache_paths(file_path, directory=None):
+    """
+    Determine the paths of the cache files that belong to an envira file.
+
+    :param str file_path: the path to the envira file.
+    :param str directory: the cache directory, use None for sidecar files next to the envira file.
+    :return: the path to the cached header and the path to the cached data.
+    :rtype: tuple(str, str)
+    """
+
+    if directory is None:
+        base = file_path
+    else:
+        # Use a hash of the absolute path to avoid collisions between files with the same name
+        base = os.path.join(directory, hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest())
+
+    return base + '.cache.json', base + '.cache.npy'
+
+
+def read_envira_cache(file_path, directory=None):
+    """
+    Read an envira file from the binary cache.
+
+    :param str file_path: the path to the envira file.
+    :param str directory: the cache directory, use None for sidecar files next to the envira file.
+    :return: the header and data if the cache is valid, otherwise None.
+    :rtype: tuple(dict, np.ndarray)|None
+    """
+
+    header_path, data_path = envira_cache_paths(file_path, directory)
+
+    try:
+        with open(header_path, 'r') as f:
+            cache = json.load(f)
+
+        # The cache is only valid if the envira file has not changed since it was cached
+        stat = os.stat(file_path)
+        if cache['key'] != [os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns]:
+            return None
+
+        # Use a copy-on-write memory-map, so the data can be modified without changing the cache
+        data = np.load(data_path, mmap_mode='c')
+    except (OSError, ValueError, KeyError):
+        return None
+
+    return cache['header'], data
+
+
+def write_envira_cache(file_path, header, data, directory=None):
+    """
+    Write the parsed header and data of an envira file to the binary cache.
+
+    :param str file_path: the path to the envira file.
+    :param dict header: the parsed header.
+    :param np.ndarray data: the parsed data.
+    :param str directory: the cache directory, use None for sidecar files next to the envira file.
+    """
+
+    header_path, data_path = envira_cache_paths(file_path, directory)
+
+    # The cache is keyed on the path, size and modification time of the envira file
+    stat = os.stat(file_path)
+    cache = {'key': [os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns], 'header': header}
+
+    try:
+        # Write to temporary files first, so concurrent readers never see an incomplete cache
+        with open(data_path + '.tmp', 'wb') as f:
+            np.save(f, np.ascontiguousarray(data))
+        with open(header_path + '.tmp', 'w') as f:
+            json.dump(cache, f)
+
+        # The header is replaced last, since it validates the data
+        os.replace(data_path + '.tmp', data_path)
+        os.replace(header_path + '.tmp', header_path)
+    except OSError:
+        # A read-only location should not prevent reading the envira file
+        pass
+
+
+def read_envira_header(file):
+    """
+    Read the header of an NLR grid-file from an opened file. After reading, the file is positioned at the start of the
+    noise data.
+
+    :param file: the opened envira file.
+    :return: the header.
+    :rtype: dict
+    """
+
+    # Create an empty dict for the header
+    header = dict()
+
+    header['tekst1'] = file.readline().strip()
+    header['tekst2'] = file.readline().strip()
+    header['tekst3'] = file.readline().strip()
+
+    header['datum'], header['tijd'] = file.readline().split()
+
+    header['eenheid'] = hdr_val(file.readline(), str)
+    header['grondinvloed'] = hdr_val(file.readline(), str)
+
+    # skip, following line, because it is not used anymore
+    # hdr['tellingen'] = hdr_val(data.readline(), int)
+    file.readline()
+
+    header['demping_landing'] = hdr_val(file.readline(), float)
+    header['demping_start'] = hdr_val(file.readline(), float)
+    header['mindba'] = hdr_val(file.readline(), float)
+    header['tijdstap'] = hdr_val(file.readline(), float)
+    header['x_start'] = hdr_val(file.readline(), int)
+    header['x_stop'] = hdr_val(file.readline(), int)
+    header['x_step'] = hdr_val(file.readline(), int)
+    header['x_number'] = hdr_val(file.readline(), int)
+    header['y_start'] = hdr_val(file.readline(), int)
+    header['y_stop'] = hdr_val(file.readline(), int)
+    header['y_step'] = hdr_val(file.readline(), int)
+    header['y_number'] = hdr_val(file.readline(), int)
+    header['nvlb'] = hdr_val(file.readline(), int)
+    header['neff'] = hdr_val(file.readline(), float)
+    header['nlos'] = hdr_val(file.readline(), int)
+    header['nweg'] = hdr_val(file.readline(), int)
+
+    # Overwrite unreliable values
+    header['x_stop'] = header['x_start'] + (header['x_number'] - 1) * header['x_step']
+    header['y_stop'] = header['y_start'] + (header['y_number'] - 1) * header['y_step']
+
+    return header
+
+
+def read_envira_info(file_path):
+    """
+    Read only the header of an envira file, without parsing the noise data.
+
+    :param str file_path: the path to the envira file.
+    :return: the header.
+    :rtype: dict
+    """
+
+    with open(file_path, 'r') as file:
+        return read_envira_header(file)
+
+
+def envira_hash(file_path):
+    """
+    Determine the content hash of an envira file.
+
+    :param str file_path: the path to the envira file.
+    :return: the SHA-1 hash of the file contents.
+    :rtype: str
+    """
+
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            sha1.update(chunk)
+
+    return sha1.hexdigest()
+
+
+# The columns of the envira index, the first columns are used to check if an entry is still valid
+envira_index_columns = ['path', 'size', 'mtime_ns', 'unit', 'year', 'x_start', 'x_stop', 'x_step', 'x_number',
+                        'y_start', 'y_stop', 'y_step', 'y_number', 'nvlb', 'hash']
+
+
+def index_enviras(path, pattern=r'\.dat$', year_extractor=extract_year_from_file_name, directory=None):
+    """
+    Create or update a persistent index of the envira files in a directory. Only the headers of new or changed files are
+    read, so selecting files by unit, year or shape does not require parsing the noise data. The index is stored as a
+    SQLite database in the cache directory. Without a cache directory, or if the database cannot be opened or written,
+    the index is kept in memory and all headers are read again on the next call. The content hash of a file is only
+    determined for a persisted index, so an index in memory only reads the headers and the file status.
+
+    :param str path: The path to the envira files.
+    :param str pattern: The pattern used to match the envira files.
+    :param function year_extractor: The method used to extract the year from the file name.
+    :param str directory: the directory to store the index in, defaults to the directory of enable_envira_cache() or
+     else an index in memory.
+    :return: the unit, year, shape, nvlb and content hash of each envira file, in the order of the directory listing.
+     The hash is None for an index in memory.
+    :rtype: pd.DataFrame
+    """
+
+    # Get the envira files
+    file_paths = [os.path.join(path, f) for f in os.listdir(path) if re.search(pattern, f)]
+
+    # Use the cache directory, or keep the index in memory without a cache directory
+    directory = envira_cache['directory'] if directory is None else directory
+    index_path = ':memory:' if directory is None else os.path.join(directory, 'envira_index.sqlite')
+
+    # Keep the index in memory if the database cannot be opened, e.g. in a missing or read-only directory
+    try:
+        connection = sqlite3.connect(index_path)
+    except sqlite3.Error:
+        index_path = ':memory:'
+        connection = sqlite3.connect(index_path)
+
+    with closing(connection) as connection:
+        try:
+            connection.execute('CREATE TABLE IF NOT EXISTS enviras ({}, PRIMARY KEY (path))'.format(
+                ', '.join(envira_index_columns)))
+            rows = connection.execute('SELECT {} FROM enviras'.format(', '.join(envira_index_columns))).fetchall()
+        except sqlite3.Error:
+            index_path = ':memory:'
+            rows = []
+        index = {row[0]: row for row in rows}
+
+        # Only hash the file contents for an index that is persisted
+        persisted = index_path != ':memory:'
+
+        # Read the headers of the files that are new or have changed since they were indexed
+        updates = []
+        for file_path in file_paths:
+            key = os.path.abspath(file_path)
+            stat = os.stat(file_path)
+            if key not in index or tuple(index[key][1:3]) != (stat.st_size, stat.st_mtime_ns):
+                header = read_envira_info(file_path)
+                index[key] = (key, stat.st_size, stat.st_mtime_ns, header['eenheid'], year_extractor(file_path)) + \
+                    tuple(header[c] for c in envira_index_columns[5:-1]) + \
+                    (envira_hash(file_path) if persisted else None,)
+                updates.append(index[key])
+
+        # Store the updated entries, a read-only location should not prevent using the index
+        if updates and persisted:
+            try:
+                with connection:
+                    connection.executemany('INSERT OR REPLACE INTO enviras VALUES ({})'.format(
+                        ', '.join('?' * len(envira_index_columns))), updates)
+            except sqlite3.Error:
+                pass
+
+    # Collect the entries of the envira files, the years are extracted again to follow the provided year extractor
+    result = pd.DataFrame([index[os.path.abspath(file_path)] for file_path in file_paths], columns=envira_index_columns)
+    result['path'] = file_paths
+    result['year'] = [year_extractor(file_path) for file_path in file_paths]
+
+    return result
+
+
+def select_enviras(path, pattern=r'\.dat$', year_extractor=extract_year_from_file_name, unit=None, years=None,
+                   shape=None, directory=None):
+    """
+    Select envira files in a directory by unit, year and shape, using the envira index.
+
+    :param str path: The path to the envira files.
+    :param str pattern: The pattern used to match the envira files.
+    :param function year_extractor: The method used to extract the year from the file name.
+    :param str unit: the noise level unit to select, e.g. 'Lden'.
+    :param list(int) years: the years to select.
+    :param Shape shape: the grid shape to select.
+    :param str directory: the directory of the index, see index_enviras().
+    :return: the paths to the selected envira files.
+    :rtype: list(str)
+    """
+
+    index = index_enviras(path, pattern, year_extractor, directory)
+
+    # Apply the selections
+    selected = np.ones(len(index), dtype=bool)
+    if unit is not None:
+        selected &= index['unit'] == unit
+    if years is not None:
+        selected &= index['year'].isin(list(years))
+    if shape is not None:
+        selected &= pd.Series([Shape(row).get_key() == shape.get_key() for row in index.to_dict('records')],
+                              index=index.index)
+
+    return index.loc[selected, 'path'].tolist()
+
+
+def envira_window(header, bbox):
+    """
+    Determine the grid nodes of an envira file that are inside a bounding box.
+
+    :param dict header: the header of the envira file.
+    :param tuple(float) bbox: the bounding box as (x_min, y_min, x_max, y_max).
+    :return: the first and last row and the first and last column inside the bounding box, and the header of the
+     cropped grid.
+    :rtype: tuple(int, int, int, int, dict)
+    """
+
+    x_min, y_min, x_max, y_max = bbox
+
+    # Determine the nodes inside the bounding box
+    j0 = max(0, int(np.ceil((x_min - header['x_start']) / header['x_step'])))
+    j1 = min(header['x_number'] - 1, int(np.floor((x_max - header['x_start']) / header['x_step'])))
+    i0 = max(0, int(np.ceil((y_min - header['y_start']) / header['y_step'])))
+    i1 = min(header['y_number'] - 1, int(np.floor((y_max - header['y_start']) / header['y_step'])))
+
+    if j1 < j0 or i1 < i0:
+        raise ValueError('The bounding box does not contain any nodes of the envira file.')
+
+    # Update the shape in the header
+    window = dict(header)
+    window['x_start'] = header['x_start'] + j0 * header['x_step']
+    window['x_number'] = j1 - j0 + 1
+    window['x_stop'] = window['x_start'] + (window['x_number'] - 1) * header['x_step']
+    window['y_start'] = header['y_start'] + i0 * header['y_step']
+    window['y_number'] = i1 - i0 + 1
+    window['y_stop'] = window['y_start'] + (window['y_number'] - 1) * header['y_step']
+
+    return i0, i1, j0, j1, window
+
+
+def envira_line_index(file_path, cache=None, directory=None):
+    """
+    Create or reuse the line-offset index of an envira file. The index holds the byte offset of each line of the noise
+    data and the number of values before each line, which locates any value without parsing the data. The indices of
+    the most recent files are kept in memory and, if the binary envira cache is used, stored next to the cache files.
+
+    :param str file_path: the path to the envira file.
+    :param bool cache: see read_envira().
+    :param str directory: see read_envira().
+    :return: the header, the byte offsets of the lines including the end of the file, and the number of values before
+     each of these offsets.
+    :rtype: tuple(dict, np.ndarray, np.ndarray)
+    """
+
+    # Use the global cache settings if not provided
+    cache = envira_cache['enabled'] if cache is None else cache
+    directory = envira_cache['directory'] if directory is None else directory
+
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    index_path = envira_cache_paths(file_path, directory)[0][:-len('.cache.json')] + '.lines.npz'
+
+    # Reuse the index from memory or from the cache if the file has not changed
+    index = envira_line_indices.pop(key, None)
+    stored = False
+    if cache:
+        try:
+            with np.load(index_path) as stored_index:
+                stored = stored_index['key'].tolist() == [str(k) for k in key]
+                if stored and index is None:
+                    index = (json.loads(str(stored_index['header'])), stored_index['offsets'], stored_index['values'])
+        except (OSError, ValueError, KeyError):
+            pass
+    if index is None:
+        index = envira_line_offsets(file_path)
+
+    # Keep the index as the most recent one in memory, and remove the oldest indices
+    envira_line_indices[key] = index
+    while len(envira_line_indices) > envira_line_indices_size:
+        envira_line_indices.popitem(last=False)
+
+    # Store the index next to the cache files
+    if cache and not stored:
+        try:
+            np.savez(index_path, key=[str(k) for k in key], header=json.dumps(index[0]), offsets=index[1],
+                     values=index[2])
+        except OSError:
+            pass
+
+    return index
+
+
+def envira_line_offsets(file_path):
+    """
+    Locate the lines of the noise data in an envira file and count the values before each line.
+
+    :param str file_path: the path to the envira file.
+    :return: the header, the byte offsets of the lines including the end of the file, and the number of values before
+     each of these offsets.
+    :rtype: tuple(dict, np.ndarray, np.ndarray)
+    """
+
+    with open(file_path, 'rb') as file:
+        # Read the header, which has a fixed number of lines
+        header = read_envira_header(io.StringIO(b''.join(file.readline() for _ in range(23)).decode()))
+        start = file.tell()
+        body = np.frombuffer(file.read(), dtype=np.uint8)
+
+    # Locate the lines and the start of each value, values are separated by whitespace
+    offsets = np.concatenate(([0], np.flatnonzero(body == ord('\n')) + 1, [body.size]))
+    whitespace = body <= ord(' ')
+    value_starts = np.concatenate(([0], np.cumsum(~whitespace & np.concatenate(([True], whitespace[:-1])))))
+
+    return header, offsets + start, value_starts[offsets]
+
+
+def read_envira_window(file_path, bbox, cache=None, directory=None):
+    """
+    Read only the noise data inside a bounding box from an envira file. Only the lines of the data that contain values
+    inside the bounding box are read and parsed, based on the line-offset index of the file.
+
+    :param str file_path: the path to the envira file.
+    :param tuple(float) bbox: the bounding box as (x_min, y_min, x_max, y_max).
+    :param bool cache: see read_envira().
+    :param str directory: see read_envira().
+    :return: the header and data of the cropped grid.
+    :rtype: tuple(dict, np.ndarray)
+    """
+
+    header, offsets, values = envira_line_index(file_path, cache, directory)
+    i0, i1, j0, j1, window = envira_window(header, bbox)
+    nx, ny = header['x_number'], header['y_number']
+
+    # Check if the provided header and data are compatible
+    if values[-1] != ny * nx:
+        raise ValueError('The header of the envira file is not consistent with its data.')
+
+    # The rows are stored from top to bottom, determine the first and last value of each row inside the window
+    rows = np.arange(ny - 1 - i1, ny - i0)
+    first = rows * nx + j0
+    last = rows * nx + j1
+
+    # Find the lines that contain these values
+    first_line = np.searchsorted(values, first, side='right') - 1
+    last_line = np.searchsorted(values, last, side='right') - 1
+
+    # Read the lines of each row and parse them at once
+    with open(file_path, 'rb') as file:
+        chunks = []
+        for a, b in zip(offsets[first_line], offsets[last_line + 1]):
+            file.seek(a)
+            chunks.append(file.read(b - a))
+    parsed = np.fromstring(b' '.join(chunks).decode(), sep=' ')
+
+    # Select the values inside the window from the parsed lines
+    line_values = values[last_line + 1] - values[first_line]
+    chunk_starts = np.concatenate(([0], np.cumsum(line_values)[:-1]))
+    positions = (chunk_starts + first - values[first_line])[:, np.newaxis] + np.arange(j1 - j0 + 1)
+    data = parsed[positions]
+
+    return window, np.flipud(data)
+
+
+def reshape_envira(header, data):
+    """
+    Check the noise data of an envira file against its header and reshape it to a grid.
+
+    :param dict header: the header of the envira file.
+    :param np.ndarray data: the noise data as read from the file.
+    :return: the noise data with the first row at y_start, i.e. the rows of the file in reversed order.
+    :rtype: np.ndarray
+    """
+
+    # Check if the provided header and data are compatible
+    if data.shape[0] != header['y_number'] * header['x_number']:
+        raise ValueError('The header of the envira file is not consistent with its data.')
+
+    # Reshape the data
+    return np.flipud(np.resize(data, (header['y_number'], header['x_number'])))
+
+
+def parse_envira(content):
+    """
+    Parse an envira file that is read into memory, e.g. a member of an archive.
+
+    :param bytes content: the content of the envira file.
+    :return: the header and data.
+    :rtype: tuple(dict, np.ndarray)
+    """
+
+    # Decode the content like a file opened in text mode
+    file = io.TextIOWrapper(io.BytesIO(content))
+
+    # Read the header and the noise data from the remaining lines
+    header = read_envira_header(file)
+    data = reshape_envira(header, np.fromstring(file.read(), sep=" "))
+
+    return header, data
+
+
+def is_envira_archive(path):
+    """
+    Check if a path is a zip or tar archive. Tar archives can be compressed, e.g. with gzip.
+
+    :param str path: the path to check.
+    :rtype: bool
+    """
+    return os.path.isfile(path) and (zipfile.is_zipfile(path) or tarfile.is_tarfile(path))
+
+
+def split_envira_archive(file_path):
+    """
+    Split the path to an envira file in an archive, e.g. 'scenario.zip/Lden y1971.dat', into the path to the archive
+    and the name of the member. Archives are treated like directories.
+
+    :param str file_path: the path to the envira file.
+    :return: the path to the archive and the name of the member, or None and None if the file is not in an archive.
+    :rtype: tuple(str, str)
+    """
+
+    # Files on disk are never in an archive
+    if os.path.exists(file_path):
+        return None, None
+
+    # Walk up the path until an existing file is found
+    archive_path, member = os.path.split(file_path)
+    while archive_path and not os.path.exists(archive_path):
+        archive_path, parent = os.path.split(archive_path)
+        member = parent + '/' + member
+
+    if is_envira_archive(archive_path):
+        return archive_path, member
+    return None, None
+
+
+def archive_members(archive_path, select):
+    """
+    Decompress the selected members of a zip or tar archive, one after another in the order of the archive. Tar
+    archives are read as a stream, so a compressed tar archive is decompressed only once.
+
+    :param str archive_path: the path to the archive.
+    :param function select: the method used to select a member by its name.
+    :return: the paths to the members, as the path to the archive joined with the member name, and their content.
+    :rtype: generator(tuple(str, bytes))
+    """
+
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and select(info.filename):
+                    yield os.path.join(archive_path, info.filename), archive.read(info)
+    else:
+        with tarfile.open(archive_path, 'r:*') as archive:
+            for info in archive:
+                if info.isfile() and select(info.name):
+                    yield os.path.join(archive_path, info.name), archive.extractfile(info).read()
+
+
+def prefetch(iterable, buffer_size=2):
+    """
+    Iterate in a background thread, so producing the next items overlaps with processing the current one. This is used
+    to decompress the next envira file while the current one is parsed, zlib releases the GIL while decompressing.
+
+    :param iterable: the items to produce in the background.
+    :param int buffer_size: the number of items that are produced ahead.
+    :rtype: generator
+    """
+
+    items = queue.Queue(maxsize=buffer_size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        # Wait for space in the buffer, unless the consumer has stopped
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not put((item, None)):
+                    break
+            else:
+                put((done, None))
+        except Exception as error:
+            put((done, error))
+        finally:
+            # Close the iterator in this thread, e.g. to close the archive
+            if hasattr(iterator, 'close'):
+                iterator.close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def read_archive_enviras(archive_path, pattern=r'\.dat$', year_extractor=extract_year_from_file_name, unit=None,
+                         years=None, shape=None):
+    """
+    Read the envira files in a zip or tar archive. The next envira file is decompressed while the current one is
+    parsed.
+
+    :param str archive_path: the path to the archive.
+    :param str pattern: The pattern used to match the file names of the envira files.
+    :param function year_extractor: The method used to extract the year from the file path.
+    :param str unit: only read the envira files with this noise level unit, e.g. 'Lden'.
+    :param list(int) years: only read the envira files of these years.
+    :param Shape shape: only read the envira files with this grid shape.
+    :return: the paths to the envira files, as the path to the archive joined with the member name, their headers and
+     their data.
+    :rtype: generator(tuple(str, dict, np.ndarray))
+    """
+
+    def select(name):
+        # Select the members by file name and year, before they are decompressed
+        return re.search(pattern, os.path.basename(name)) is not None and (
+                years is None or year_extractor(os.path.join(archive_path, name)) in years)
+
+    for file_path, content in prefetch(archive_members(archive_path, select)):
+        # Select the envira files by unit and shape, before the noise data is parsed
+        file = io.TextIOWrapper(io.BytesIO(content))
+        header = read_envira_header(file)
+        if unit is not None and header['eenheid'] != unit:
+            continue
+        if shape is not None and Shape(header).get_key() != shape.get_key():
+            continue
+
+        yield file_path, header, as_dtype(reshape_envira(header, np.fromstring(file.read(), sep=" ")))
+
+
+def read_envira(file_path, cache=None, directory=None, bbox=None):
     """
     Read NLR grid-file and return header and noise data
 
+    :param str file_path: the path to the envira file. This can be a gzip compressed file ending with '.gz', a member
+     of a zip or tar archive, e.g. 'scenario.tar.gz/Lden y1971.dat', or an archive with a single file. These files are
+     read without the cache.
+    :param bool cache: use the binary envira cache, defaults to the setting of enable_envira_cache().
+    :param str directory: the cache directory, defaults to the setting of enable_envira_cache() or sidecar files.
+    :param tuple(float) bbox: only read the nodes inside the bounding box (x_min, y_min, x_max, y_max), e.g. the
+     window of a GridPlot as (xlim[0], ylim[0], xlim[1], ylim[1]). Defaults to None for the full grid.
+    :return: the header and data, in the floating point type of set_dtype().
+    :rtype: tuple(dict, np.ndarray)
+
     todo: create a dict or specification for the header
     """
 
+    # Read envira files in a zip or tar archive, or gzip compressed envira files, from memory without the cache. The
+    # archives are checked first, as a compressed tar archive also ends with '.gz'.
+    archive_path, member = split_envira_archive(file_path)
+    if archive_path is None and is_envira_archive(file_path):
+        archive_path = file_path
+    if archive_path is not None or file_path.endswith('.gz'):
+        if archive_path is not None:
+            members = archive_members(archive_path, lambda name: member is None or name == member)
+            try:
+                content = next((content for _, content in members), None)
+
+                # An archive without a member name should contain a single file
+                if member is None and next(members, None) is not None:
+                    raise ValueError('The archive {} has multiple files, use e.g. {} to read one of them.'.format(
+                        archive_path, os.path.join(archive_path, 'member.dat')))
+            finally:
+                members.close()
+            if content is None:
+                raise FileNotFoundError('The archive {} has no member {}.'.format(archive_path, member))
+        else:
+            with gzip.open(file_path, 'rb') as file:
+                content = file.read()
+        header, data = parse_envira(content)
+
+        # Crop the data to the window
+        if bbox is not None:
+            i0, i1, j0, j1, header = envira_window(header, bbox)
+            data = data[i0:i1 + 1, j0:j1 + 1]
+        return header, as_dtype(data)
+
+    # Use the global cache settings if not provided
+    cache = envira_cache['enabled'] if cache is None else cache
+    directory = envira_cache['directory'] if directory is None else directory
+
+    # Try to load the file from the cache first
+    if cache:
+        cached = read_envira_cache(file_path, directory)
+        if cached is not None and bbox is not None:
+            # Crop the cached data
+            i0, i1, j0, j1, window = envira_window(cached[0], bbox)
+            return window, as_dtype(cached[1][i0:i1 + 1, j0:j1 + 1])
+        if cached is not None:
+            return cached[0], as_dtype(cached[1])
+
+    # Only parse the data inside the window
+    if bbox is not None:
+        window, data = read_envira_window(file_path, bbox, cache, directory)
+        return window, as_dtype(data)
+
     with open(file_path, "r") as file:
-        # Create an empty dict for the header
-        header = dict()
-
-        header['tekst1'] = file.readline().strip()
-        header['tekst2'] = file.readline().strip()
-        header['tekst3'] = file.readline().strip()
-
-        header['datum'], header['tijd'] = file.readline().split()
-
-        header['eenheid'] = hdr_val(file.readline(), str)
-        header['grondinvloed'] = hdr_val(file.readline(), str)
-
-        # skip, following line, because it is not used anymore
-        # hdr['tellingen'] = hdr_val(data.readline(), int)
-        file.readline()
-
-        header['demping_landing'] = hdr_val(file.readline(), float)
-        header['demping_start'] = hdr_val(file.readline(), float)
-        header['mindba'] = hdr_val(file.readline(), float)
-        header['tijdstap'] = hdr_val(file.readline(), float)
-        header['x_start'] = hdr_val(file.readline(), int)
-        header['x_stop'] = hdr_val(file.readline(), int)
-        header['x_step'] = hdr_val(file.readline(), int)
-        header['x_number'] = hdr_val(file.readline(), int)
-        header['y_start'] = hdr_val(file.readline(), int)
-        header['y_stop'] = hdr_val(file.readline(), int)
-        header['y_step'] = hdr_val(file.readline(), int)
-        header['y_number'] = hdr_val(file.readline(), int)
-        header['nvlb'] = hdr_val(file.readline(), int)
-        header['neff'] = hdr_val(file.readline(), float)
-        header['nlos'] = hdr_val(file.readline(), int)
-        header['nweg'] = hdr_val(file.readline(), int)
-
-        # Overwrite unreliable values
-        header['x_stop'] = header['x_start'] + (header['x_number'] - 1) * header['x_step']
-        header['y_stop'] = header['y_start'] + (header['y_number'] - 1) * header['y_step']
+        # Read the header
+        header = read_envira_header(file)
 
         # Extract the noise data from the remaining lines
-        data = np.fromfile(file, sep=" ")
+        data = reshape_envira(header, np.fromfile(file, sep=" "))
 
-        # Check if the provided header and data are compatible
-        if data.shape[0] != header['y_number'] * header['x_number']:
-            raise ValueError('The header of the envira file is not consistent with its data.')
+    # Store the parsed file in the cache
+    if cache:
+        write_envira_cache(file_path, header, data, directory)
 
-        # Reshape the data
-        data = np.flipud(np.resize(data, (header['y_number'], header['x_number'])))
+    return header, as_dtype(data)
 
-    return header, data
+
+def read_envira_shared(file_path, memory_name, dtype, cache=None, directory=None):
+    """
+    Read an envira file and put its noise data in a shared memory block. This is used by read_enviras_parallel() to
+    hand the data back from a worker process without pickling it.
+
+    :param str file_path: the path to the envira file.
+    :param str memory_name: the name of the shared memory block, which should fit the data.
+    :param np.dtype dtype: the floating point type of the shared memory block, see get_dtype().
+    :param bool cache: see read_envira().
+    :param str directory: see read_envira().
+    :return: the header.
+    :rtype: dict
+    """
+
+    # Read the envira file
+    header, data = read_envira(file_path, cache=cache, directory=directory)
+
+    # Copy the data to the shared memory block
+    memory = shared_memory.SharedMemory(name=memory_name)
+    try:
+        np.ndarray(data.shape, dtype=dtype, buffer=memory.buf)[:] = data
+    finally:
+        memory.close()
+
+    return header
+
+
+def read_enviras_parallel(file_paths, workers):
+    """
+    Read multiple envira files in parallel using a pool of worker processes. The noise data is passed from the workers
+    through shared memory blocks.
+
+    :param list(str) file_paths: the paths to the envira files.
+    :param int workers: the number of worker processes.
+    :return: the headers and the stacked data of the envira files, in the same order as the provided paths.
+    :rtype: tuple(list(dict), np.ndarray)
+    """
+
+    # Read the shapes from the headers, all grids should have the same shape to be stacked
+    shapes = []
+    for file_path in file_paths:
+        header = read_envira_info(file_path)
+        shapes.append((header['y_number'], header['x_number']))
+        if shapes[-1] != shapes[0]:
+            raise ValueError('The shape {} of {} differs from the shape {} of {}'.format(
+                shapes[-1], file_path, shapes[0], file_paths[0]))
+
+    # Create a shared memory block for each file in the floating point type of the package. The blocks are owned by
+    # this process, so they remain available until the data is collected.
+    dtype = get_dtype()
+    memories = []
+    try:
+        for shape in shapes:
+            memories.append(shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize)))
+
+        # Parse the files in the worker processes, the global dtype and cache settings are passed explicitly
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            headers = list(executor.map(read_envira_shared, file_paths, [m.name for m in memories],
+                                        [dtype] * len(file_paths), [envira_cache['enabled']] * len(file_paths),
+                                        [envira_cache['directory']] * len(file_paths)))
+
+        # Copy the data out of the shared memory blocks into one contiguous stack
+        data = np.empty((len(file_paths),) + shapes[0], dtype=dtype)
+        for i, (shape, memory) in enumerate(zip(shapes, memories)):
+            data[i] = np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+    finally:
+        for memory in memories:
+            memory.close()
+            memory.unlink()
+
+    return headers, data
 
 
 def write_envira(file_path, hdr, dat):
     """
-    Write NLR grid-file with header and noise data
+    Write NLR grid-file with header and noise data. Each row of the grid is wrapped over lines of at most 131
+    characters.
+
+    :param str file_path: the path to the envira file.
+    :param dict hdr: the header.
+    :param np.ndarray dat: the noise data.
     """
 
-    with open(file_path, 'w') as f:
+    with open(file_path, 'w', buffering=1 << 20) as f:
         # Write the header
-        f.write('{:s}\n'.format(hdr['tekst1']))
-        f.write('{:s}\n'.format(hdr['tekst2']))
-        f.write('{:s}\n'.format(hdr['tekst3']))
-        f.write('{:s} {:s}\n'.format(hdr['datum'], hdr['tijd']))
-        f.write('EENHEID {:s}\n'.format(hdr['eenheid']))
-        f.write('GRONDINVLOED {:s}\n'.format(hdr['grondinvloed']))
-        f.write('TELLINGEN\n')
-        f.write('DEMPING-LANDING {:6.2f}\n'.format(hdr['demping_landing']))
-        f.write('DEMPING-START {:6.2f}\n'.format(hdr['demping_start']))
-        f.write('MINDBA {:6.2f}\n'.format(hdr['mindba']))
-        f.write('TIJDSTAP {:6.2f}\n'.format(hdr['tijdstap']))
-        f.write('X-ONDER {:9.0f}\n'.format(hdr['x_start']))
-        f.write('X-BOVEN {:9.0f}\n'.format(hdr['x_stop']))
-        f.write('X-STAP {:9.0f}\n'.format(hdr['x_step']))
-        f.write('NX{:6.0f}\n'.format(hdr['x_number']))
-        f.write('Y-ONDER {:9.0f}\n'.format(hdr['y_start']))
-        f.write('Y-BOVEN {:9.0f}\n'.format(hdr['y_stop']))
-        f.write('Y-STAP {:9.0f}\n'.format(hdr['y_step']))
-        f.write('NY{:6.0f}\n'.format(hdr['y_number']))
-        f.write('NVLB {:9.0f}\n'.format(hdr['nvlb']))
-        f.write('NEFF {:9.0f}\n'.format(hdr['neff']))
-        f.write('NLOS {:9.0f}\n'.format(hdr['nlos']))
-        f.write('NWEG {:9.0f}'.format(hdr['nweg']))
-
-        # Create an in-memory stream for text I/O to capture the numpy data as a string
-        z = io.StringIO()
-        np.savetxt(z, np.flipud(dat), fmt='%12.6E')
-        x = z.getvalue()
-        z.close()
-
-        # Extract the individual lines except the last line which is empty
-        s = x.split('\n')[:-1]
-
-        # Create a line wrapper
-        wrapper = textwrap.TextWrapper(initial_indent=' ', subsequent_indent=' ', width=131)
-
-        # Write each line to the data file
-        [f.write('\n' + '\n'.join(wrapper.wrap(p))) for p in s]
+        f.write(envira_header_text(hdr))
+
+        # Non-finite values are padded by the number format, which only the line wrapper handles correctly
+        if not np.all(np.isfinite(dat)):
+            write_envira_wrapped(f, dat)
+            return
+
+        # Write the rows in chunks, formatted in bulk
+        rows = np.flipud(np.asarray(dat))
+        for start in range(0, rows.shape[0], 256):
+            f.write(format_envira_rows(rows[start:start + 256]))
+
+
+def envira_header_text(hdr):
+    """
+    Format the header of an NLR grid-file.
+
+    :param dict hdr: the header.
+    :return: the header lines, without a line break after the last line.
+    :rtype: str
+    """
+
+    return ''.join([
+        '{:s}\n'.format(hdr['tekst1']),
+        '{:s}\n'.format(hdr['tekst2']),
+        '{:s}\n'.format(hdr['tekst3']),
+        '{:s} {:s}\n'.format(hdr['datum'], hdr['tijd']),
+        'EENHEID {:s}\n'.format(hdr['eenheid']),
+        'GRONDINVLOED {:s}\n'.format(hdr['grondinvloed']),
+        'TELLINGEN\n',
+        'DEMPING-LANDING {:6.2f}\n'.format(hdr['demping_landing']),
+        'DEMPING-START {:6.2f}\n'.format(hdr['demping_start']),
+        'MINDBA {:6.2f}\n'.format(hdr['mindba']),
+        'TIJDSTAP {:6.2f}\n'.format(hdr['tijdstap']),
+        'X-ONDER {:9.0f}\n'.format(hdr['x_start']),
+        'X-BOVEN {:9.0f}\n'.format(hdr['x_stop']),
+        'X-STAP {:9.0f}\n'.format(hdr['x_step']),
+        'NX{:6.0f}\n'.format(hdr['x_number']),
+        'Y-ONDER {:9.0f}\n'.format(hdr['y_start']),
+        'Y-BOVEN {:9.0f}\n'.format(hdr['y_stop']),
+        'Y-STAP {:9.0f}\n'.format(hdr['y_step']),
+        'NY{:6.0f}\n'.format(hdr['y_number']),
+        'NVLB {:9.0f}\n'.format(hdr['nvlb']),
+        'NEFF {:9.0f}\n'.format(hdr['neff']),
+        'NLOS {:9.0f}\n'.format(hdr['nlos']),
+        'NWEG {:9.0f}'.format(hdr['nweg']),
+    ])
+
+
+def format_envira_rows(rows):
+    """
+    Format rows of finite noise data as the wrapped lines of an NLR grid-file. Each row starts on a new line and is
+    wrapped greedily like textwrap.TextWrapper with a width of 131 and an indent of one space, which gives ten values
+    per line for the common twelve character values.
+
+    :param np.ndarray rows: the rows of noise data, in the order of the file.
+    :return: the formatted rows, each preceded by a line break.
+    :rtype: str
+    """
+
+    rows = np.asarray(rows, dtype=float)
+    width = 131
+
+    # The number format has a fixed length of twelve characters for positive values with a two-digit exponent
+    values = rows.ravel()
+    fixed = np.all(~np.signbit(values) & ((values == 0) | ((values >= 1e-99) & (values < 9e99))))
+
+    if fixed:
+        # Format all rows at once with a template of the wrapped lines of a row
+        per_line = width // 13
+        lines = [per_line] * (rows.shape[1] // per_line)
+        if rows.shape[1] % per_line:
+            lines.append(rows.shape[1] % per_line)
+        template = ''.join('\n ' + ' '.join(['%12.6E'] * n) for n in lines)
+        return (template * rows.shape[0]) % tuple(values.tolist())
+
+    # Wrap each row greedily based on the length of the formatted values
+    text = []
+    for row in rows:
+        words = ['%12.6E' % v for v in row.tolist()]
+        line = []
+        length = 1
+        for word in words:
+            if line and length + 1 + len(word) > width:
+                text.append('\n ' + ' '.join(line))
+                line = []
+                length = 1
+            length += len(word) + (1 if line else 0)
+            line.append(word)
+        text.append('\n ' + ' '.join(line))
+
+    return ''.join(text)
+
+
+def write_envira_wrapped(f, dat):
+    """
+    Write the noise data of an NLR grid-file with a line wrapper. This handles any value, including the padded
+    formatting of non-finite values.
+
+    :param f: the opened envira file, positioned after the header.
+    :param np.ndarray dat: the noise data.
+    """
+
+    # Create an in-memory stream for text I/O to capture the numpy data as a string
+    z = io.StringIO()
+    np.savetxt(z, np.flipud(dat), fmt='%12.6E')
+    x = z.getvalue()
+    z.close()
+
+    # Extract the individual lines except the last line which is empty
+    s = x.split('\n')[:-1]
+
+    # Create a line wrapper
+    wrapper = textwrap.TextWrapper(initial_indent=' ', subsequent_indent=' ', width=131)
+
+    # Write each line to the data file
+    [f.write('\n' + '\n'.join(wrapper.wrap(p))) for p in s]
+
+
+# The types for storing noise levels with Grid.save(), with the step of the quantised noise levels
+grid_storage_types = {'float64': None, 'float32': None, 'int16': 0.01}
+
+
+def quantise_grid(data, dtype):
+    """
+    Convert noise levels to the type in which they are stored. Quantised noise levels are stored as integer multiples
+    of the step, NaN is stored as the smallest integer.
+
+    :param np.ndarray data: the noise levels.
+    :param str dtype: the storage type, see grid_storage_types.
+    :return: the noise levels to store.
+    :rtype: np.ndarray
+    """
+
+    if dtype not in grid_storage_types:
+        raise ValueError('The storage type should be one of {}.'.format(', '.join(grid_storage_types)))
+
+    # Store floating point noise levels as they are
+    step = grid_storage_types[dtype]
+    if step is None:
+        return data.astype(dtype, copy=False)
+
+    # Quantise the noise levels
+    quantised = np.round(data / step)
+    missing = np.isnan(quantised)
+    if np.any(np.abs(quantised[~missing]) > np.iinfo(dtype).max):
+        raise ValueError('The noise levels are out of range for storage as {}.'.format(dtype))
+
+    return np.where(missing, np.iinfo(dtype).min, quantised).astype(dtype)
+
+
+def dequantise_grid(data, dtype):
+    """
+    Restore noise levels from the type in which they are stored.
+
+    :param np.ndarray data: the stored noise levels.
+    :param str dtype: the storage type, see grid_storage_types.
+    :return: the noise levels.
+    :rtype: np.ndarray
+    """
+
+    # Floating point noise levels are restored in the floating point type of the package
+    step = grid_storage_types[dtype]
+    if step is None:
+        return as_dtype(data)
+
+    # Restore the quantised noise levels and the missing values
+    return as_dtype(np.where(data == np.iinfo(dtype).min, np.nan, data * step))
+
+
+def json_default(value):
+    """
+    Convert NumPy scalars and arrays for JSON, e.g. the years of a grid.
+    """
+    return value.tolist()
+
+
+def write_grid_file(path, data, attributes, complevel=5):
+    """
+    Write grid data and attributes to an HDF5 file, or to an npz file if the path ends with '.npz'. The HDF5 data is
+    chunked per year and in tiles, so years and windows can be read separately.
+
+    :param str path: the path to the file.
+    :param np.ndarray data: the grid data.
+    :param dict attributes: the attributes of the grid, which should be JSON serializable.
+    :param int complevel: the compression level, from 0 for no compression to 9.
+    """
+
+    # The attributes are stored as JSON, which can be larger than an HDF5 attribute
+    text = json.dumps(attributes, default=json_default)
+
+    if path.endswith('.npz'):
+        save = np.savez_compressed if complevel else np.savez
+        save(path, data=data, attributes=np.array(text))
+    else:
+        filters = tables.Filters(complevel=complevel, complib='blosc:zstd', shuffle=True) if complevel else None
+        chunkshape = (1,) * (data.ndim - 2) + tuple(min(n, 256) for n in data.shape[-2:])
+        with tables.open_file(path, 'w') as file:
+            file.create_carray('/', 'data', obj=data, filters=filters, chunkshape=chunkshape)
+            file.create_array('/', 'attributes', obj=np.frombuffer(text.encode(), dtype=np.uint8))
+
+
+def read_grid_file(path, years=None, bbox=None):
+    """
+    Read grid data and attributes from a file that is written with write_grid_file(). The attributes are updated for
+    the selected years and window.
+
+    :param str path: the path to the file.
+    :param list(int) years: only read these years of a multigrid, defaults to all years.
+    :param tuple(float) bbox: only read the nodes inside the bounding box (x_min, y_min, x_max, y_max). Defaults to
+     None for the full grid.
+    :return: the attributes and data.
+    :rtype: tuple(dict, np.ndarray)
+    """
+
+    if path.endswith('.npz'):
+        file = np.load(path)
+        attributes = json.loads(str(file['attributes']))
+        node = file['data']
+    else:
+        file = tables.open_file(path, 'r')
+        attributes = json.loads(file.root.attributes.read().tobytes().decode())
+        node = file.root.data
+
+    with closing(file):
+        # Determine the years to read
+        indices = None
+        if years is not None:
+            if len(node.shape) != 3:
+                raise TypeError('Years can only be selected from a multigrid.')
+            stored_years = list(attributes['years'])
+            missing = [year for year in years if year not in stored_years]
+            if missing:
+                raise LookupError('The years {} are not in the file.'.format(missing))
+            indices = [stored_years.index(year) for year in years]
+
+        # Determine the window to read
+        rows, columns = slice(None), slice(None)
+        if bbox is not None:
+            i0, i1, j0, j1, window = envira_window(attributes['shape'], bbox)
+            rows, columns = slice(i0, i1 + 1), slice(j0, j1 + 1)
+
+        # Read the selected chunks
+        if len(node.shape) == 2:
+            data = node[rows, columns]
+        elif indices is None:
+            data = node[:, rows, columns]
+        else:
+            data = np.stack([node[index, rows, columns] for index in indices])
+
+    # Update the attributes for the selected years
+    if indices is not None:
+        attributes['years'] = [attributes['years'][index] for index in indices]
+        attributes['info'] = [attributes['info'][index] for index in indices] if attributes['info'] else None
+
+    # Update the attributes for the window
+    if bbox is not None:
+        attributes['shape'] = window
+        if isinstance(attributes['info'], dict):
+            attributes['info'].update(window)
+        elif attributes['info'] is not None:
+            for info in attributes['info']:
+                info.update(window)
+
+    return attributes, data
@@ -0,0 +1,271 @@
+import copy
+import hashlib
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from ssdtools.grid import Grid, read_only
+from ssdtools.utils.dtype import as_dtype
+
+# The weights of the movements in the day, evening and night period for Lden. The early morning (EM), i.e. the hour
+# from 6:00 that TrafficAggregate.get_denem_distribution() separates from the night, is part of the night.
+lden_weights = {'D': 1., 'E': np.sqrt(10.), 'N': 10., 'EM': 10.}
+
+# The weights of the movements for Lnight, for unit grids that are normalised to the night period
+lnight_weights = {'D': 0., 'E': 0., 'N': 1., 'EM': 1.}
+
+
+class GridLibrary(object):
+    """
+    A GridLibrary object contains unit grids, i.e. the noise grid of a single movement, for each key. A key is e.g. the
+    operation and runway (d_lt, d_runway) of the movement.
+
+    The energy of all unit grids is held as one matrix with a row per key. A scenario grid follows from a usage table,
+    i.e. the number of movements per key, as one weighted matrix product in the energy domain. A new usage is evaluated
+    without running the noise model again.
+    """
+
+    def __init__(self, keys, energy, shape, info=None, unit=None, cache_size=4):
+        """
+
+        :param list keys: the key of each unit grid.
+        :param np.ndarray energy: the energy of the unit grids, with shape (keys, y * x).
+        :param Shape shape: the shape of the unit grids.
+        :param dict info: the grid information of the unit grids, which is used for the scenario grids.
+        :param str unit: the unit of the scenario grids, e.g. 'Lden'.
+        :param int cache_size: the number of contractions to keep in the cache, see contract().
+        """
+
+        if len(keys) != energy.shape[0]:
+            raise ValueError('The number of keys should be equal to the number of unit grids.')
+        if len(set(keys)) != len(keys):
+            raise ValueError('The keys of the unit grids should be unique.')
+
+        self.keys = list(keys)
+        self.energy = energy
+        self.shape = shape
+        self.info = shape.to_dict() if info is None else info
+        self.unit = unit
+
+        # The position of each key in the energy matrix
+        self.positions = {key: i for i, key in enumerate(self.keys)}
+
+        # The most recent contractions, keyed on the weights
+        self.cache = {}
+        self.cache_size = cache_size
+
+    @classmethod
+    def from_grids(cls, grids):
+        """
+        Create a GridLibrary object from unit grids. The unit grids are aligned to the first grid, see
+        Grid.aligned_energy().
+
+        :param dict(object, Grid) grids: the unit grid for each key.
+        :rtype: GridLibrary
+        """
+
+        return cls.from_items(grids.items())
+
+    @classmethod
+    def read_enviras(cls, path, key_extractor, pattern=r'\.dat$'):
+        """
+        Create a GridLibrary object from the envira files of unit grids. The files are read one at a time.
+
+        :param str path: The path to the envira files.
+        :param function key_extractor: The method used to extract the key from the file name, e.g. ('L', '18R'). Files
+         without a key, i.e. None, are skipped.
+        :param str pattern: The pattern used to match the envira files.
+        :rtype: GridLibrary
+        """
+
+        # Get the envira files
+        file_paths = [os.path.join(path, f) for f in os.listdir(path) if re.search(pattern, f)]
+
+        # Read the envira files with a key lazily
+        items = ((key_extractor(file_path), file_path) for file_path in file_paths)
+        return cls.from_items((key, Grid.read_envira(file_path)) for key, file_path in items if key is not None)
+
+    @classmethod
+    def from_items(cls, items):
+        """
+        Create a GridLibrary object from (key, unit grid) pairs, which are stacked one at a time.
+
+        :param iterable items: the key and unit grid pairs.
+        :rtype: GridLibrary
+        """
+
+        keys, rows, template = [], [], None
+        for key, grid in items:
+            if grid.is_multigrid():
+                raise TypeError('The unit grids should be single grids.')
+
+            # The first unit grid defines the shape of the library
+            if template is None:
+                template = grid
+
+            keys.append(key)
+            rows.append(np.ravel(np.asarray(template.aligned_energy(grid), dtype=float)))
+
+        if template is None:
+            raise ValueError('At least one unit grid is required for a grid library.')
+
+        return cls(keys, np.stack(rows), template.shape.copy(), copy.deepcopy(getattr(template, 'info', None)),
+                   getattr(template, 'unit', None))
+
+    def weights(self, usage):
+        """
+        Convert a usage table to a weight for each unit grid of the library.
+
+        :param pd.Series|pd.DataFrame usage: the number of movements per key, as a Series with the keys as index for a
+         single scenario, or a DataFrame with the keys as index and a column per year for a multigrid. Keys without
+         movements are ignored.
+        :return: the weights, with shape (scenarios, keys), and the years of the columns or None for a single scenario.
+        :rtype: tuple(np.ndarray, list|None)
+        """
+
+        # Put the usage of a single scenario in a table
+        table = usage.to_frame() if isinstance(usage, pd.Series) else usage
+        table = table.fillna(0)
+        table = table[(table != 0).any(axis=1)]
+
+        # Check if the library has a unit grid for each key with movements
+        missing = [key for key in table.index if key not in self.positions]
+        if missing:
+            raise KeyError('The library has no unit grids for {}.'.format(missing))
+
+        # Put the usage at the positions of the keys, the usage of duplicate keys is summed
+        weights = np.zeros((table.shape[1], len(self.keys)))
+        np.add.at(weights.T, [self.positions[key] for key in table.index], table.values.astype(float))
+
+        return weights, None if isinstance(usage, pd.Series) else list(table.columns)
+
+    def scenario(self, usage, unit=None):
+        """
+        Determine the scenario grid for a usage table. All scenarios, e.g. the meteorological years of a multigrid, are
+        determined in a single weighted matrix product of the usage and the energy of the unit grids.
+
+        For an Lden grid, the movements in the evening and night should be weighted with their penalties.
+
+        :param pd.Series|pd.DataFrame usage: the number of movements per key, see weights().
+        :param str unit: the unit of the scenario grid, e.g. 'Lden'. Defaults to the unit of the library.
+        :return: the scenario grid, or a multigrid for a usage table with a column per year.
+        :rtype: Grid
+        """
+
+        weights, years = self.weights(usage)
+
+        # Sum the weighted energy of the unit grids for all scenarios at once
+        return self.grid(self.contract(weights), years, self.unit if unit is None else unit)
+
+    def fleet_mix(self, aggregate, keys=('d_ac_cat', 'd_proc'), period_weights=None, per_year=False):
+        """
+        Determine the scenario grids of a fleet mix, e.g. for a library with a unit grid per aircraft category and
+        procedure. The movements of the traffic aggregate are counted per key and weighted per period of the day for
+        each unit. All units and years are determined in a single tensor contraction.
+
+        :param TrafficAggregate aggregate: the traffic aggregate, e.g. of type 'daisy.mean'.
+        :param tuple(str) keys: the columns of the keys in the traffic aggregate.
+        :param dict(str, dict) period_weights: the weight of each period of the day for each unit. Defaults to
+         lden_weights for Lden and lnight_weights for Lnight. Use a night weight of 3 for Lnight with unit grids that
+         are normalised to 24 hours.
+        :param bool per_year: count the movements per meteorological year in the column d_myear, for multigrids.
+        :return: the scenario grid for each unit.
+        :rtype: dict(str, Grid)
+        """
+
+        period_weights = {'Lden': lden_weights, 'Lnight': lnight_weights} if period_weights is None else period_weights
+        units = list(period_weights)
+
+        # Count the weighted movements for each unit, with the same years for all units
+        tables = [usage_table(aggregate, keys, per_year=per_year, den_weights=period_weights[unit]) for unit in units]
+        if per_year:
+            years = sorted(set().union(*[table.columns for table in tables]))
+            tables = [table.reindex(columns=years, fill_value=0) for table in tables]
+
+        # Stack the weights of all units to a tensor with shape (units, scenarios, keys)
+        weights = [self.weights(table) for table in tables]
+        energy = self.contract(np.stack([w for w, _ in weights]))
+
+        return {unit: self.grid(energy[i], weights[i][1], unit) for i, unit in enumerate(units)}
+
+    def contract(self, weights):
+        """
+        Contract weights with the energy of the unit grids, i.e. the weighted sum of the unit grids. The most recent
+        contractions are cached, so switching between what-if scenarios does not repeat the contraction.
+
+        :param np.ndarray weights: the weights, with the keys as last axis.
+        :return: the energy, with shape weights.shape[:-1] + (y * x,), as a read-only array.
+        :rtype: np.ndarray
+        """
+
+        weights = np.ascontiguousarray(weights, dtype=float)
+        key = (weights.shape, hashlib.sha1(weights.tobytes()).hexdigest())
+
+        if key in self.cache:
+            return self.cache[key]
+
+        # Sum the weighted energy over the keys, the result is read-only as it is shared through the cache
+        energy = read_only(np.tensordot(weights, self.energy, axes=1))
+
+        # Replace the oldest contraction in the cache
+        if self.cache_size > 0:
+            if len(self.cache) >= self.cache_size:
+                self.cache.pop(next(iter(self.cache)))
+            self.cache[key] = energy
+
+        return energy
+
+    def grid(self, energy, years=None, unit=None):
+        """
+        Create a scenario grid from the contracted energy. The grid holds a read-only view of the cached energy, so
+        writing to it raises an error instead of changing the cache. Operations like Grid.scale() and Grid.add() create
+        new arrays.
+
+        :param np.ndarray energy: the energy, with shape (scenarios, y * x).
+        :param list years: the years of a multigrid, or None for a single grid.
+        :param str unit: the unit of the grid.
+        :rtype: Grid
+        """
+
+        ny, nx = int(self.shape.y_number), int(self.shape.x_number)
+
+        # Create the grid, or a multigrid with the years
+        if years is None:
+            return Grid(energy=read_only(as_dtype(energy[0].reshape(ny, nx))), info=copy.deepcopy(self.info),
+                        shape=self.shape.copy(), unit=unit)
+        return Grid(energy=read_only(as_dtype(energy.reshape(len(years), ny, nx))),
+                    info=[copy.deepcopy(self.info) for _ in years], shape=self.shape.copy(), years=years, unit=unit)
+
+
+def usage_table(aggregate, keys=('d_lt', 'd_runway'), period='D|E|N|EM', per_year=False, den_weights=None):
+    """
+    Count the movements of a traffic aggregate per key, as a usage table for GridLibrary.scenario().
+
+    :param TrafficAggregate aggregate: the traffic aggregate, e.g. of type 'daisy.meteoyear' or 'daisy.mean'.
+    :param tuple(str) keys: the columns of the keys, e.g. the operation and runway.
+    :param str period: a regular expression that should match the whole period, e.g. 'N' or 'D|E|N|EM'.
+    :param bool per_year: count the movements per meteorological year in the column d_myear, for a multigrid.
+    :param dict(str, float) den_weights: the weight of the movements in each period of the column d_den, e.g.
+     lden_weights. Each period in the selection should have a weight. Defaults to counting all movements in the
+     period.
+    :return: the number of movements per key, with a column per year if per_year is set.
+    :rtype: pd.Series|pd.DataFrame
+    """
+
+    # Match the whole period, so e.g. 'E' does not select the early morning 'EM'
+    data = aggregate.data[aggregate.data['d_den'].str.fullmatch(period)]
+
+    # Weight the number of flights per period, movements should not be dropped silently
+    total = data['total']
+    if den_weights is not None:
+        missing = sorted(set(data['d_den']) - set(den_weights))
+        if missing:
+            raise KeyError('The periods {} have no weight.'.format(missing))
+        total = total * data['d_den'].map(den_weights).astype(float)
+
+    # Sum the number of flights for each key, and for each year if requested
+    if per_year:
+        return total.groupby([data[key] for key in keys] + [data['d_myear']]).sum().unstack('d_myear', fill_value=0)
+    return total.groupby([data[key] for key in keys]).sum()
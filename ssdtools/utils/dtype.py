@@ -0,0 +1,45 @@
+import numpy as np
+
+# The floating point type of the noise data in grids, which is float64 by default
+dtype_policy = {'dtype': np.dtype(np.float64)}
+
+
+def set_dtype(dtype):
+    """
+    Set the floating point type of the noise data for the whole package. The envira readers, the grid arithmetic, the
+    resize operators, the NAxx counts and the WBS interpolation produce data of this type.
+
+    Using float32 halves the memory footprint of grids, e.g. when refining a multigrid for NAxx. The relative rounding
+    error of float32 is 6e-8, which is at most 1e-5 dB for noise levels up to 150 dB. Interpolating and resizing sums
+    16 spline terms, so interpolated noise levels deviate at most about 1e-4 dB from the float64 results. The GWC
+    counts therefore only differ by the homes and people of residences with a noise level within 1e-4 dB of a threshold.
+    Apart from these residences, the dose-effect sums have a relative deviation of about 1e-6. For 40 years of the
+    H_500_00_doc29 test scenario at 200000 random residences, the noise levels deviated at most 4.3e-5 dB.
+
+    :param str|np.dtype dtype: the floating point type, either 'float64' or 'float32'.
+    """
+
+    dtype = np.dtype(dtype)
+    if dtype not in (np.float64, np.float32):
+        raise ValueError('The dtype should be either float64 or float32.')
+
+    dtype_policy['dtype'] = dtype
+
+
+def get_dtype():
+    """
+    Get the floating point type of the noise data, see set_dtype().
+
+    :rtype: np.dtype
+    """
+    return dtype_policy['dtype']
+
+
+def as_dtype(data):
+    """
+    Convert noise data to the floating point type of the package, without copying data of the right type.
+
+    :param np.ndarray data: the noise data.
+    :rtype: np.ndarray
+    """
+    return np.asanyarray(data).astype(dtype_policy['dtype'], copy=False)
@@ -2,8 +2,9 @@ import copy
 import numpy as np
 import pandas as pd
 
+from scipy.optimize import brentq
 from warnings import warn
-from ssdtools.grid import Grid
+from ssdtools.grid import Grid, spline_evaluation_matrix
 
 
 class WBS(object):
@@ -21,6 +22,9 @@ class WBS(object):
         if data is not None:
             self.data = data
 
+        # The interpolation matrices for the addresses, for each grid shape
+        self.interpolation_matrices = {}
+
     @classmethod
     def read_file(cls, path):
         """
@@ -39,12 +43,59 @@ class WBS(object):
 
     def copy(self):
         """
-        Make a deep copy of this WBS object.
+        Make a deep copy of this WBS object. The interpolation matrices are shared with the copy, since they only depend
+        on the addresses.
 
         :return: a copy of this WBS object.
         :rtype: WBS
         """
-        return copy.deepcopy(self)
+        return copy.deepcopy(self, {id(self.interpolation_matrices): self.interpolation_matrices})
+
+    def interpolation_matrix(self, shape):
+        """
+        Get the sparse matrix that interpolates the bi-cubic spline of a grid with the provided shape at each residence.
+        The matrix is cached for each shape, so the coordinates of the residences should not be changed afterwards.
+
+        :param Shape shape: the shape of the grid.
+        :return: the interpolation matrix with shape (residences, y * x).
+        :rtype: scipy.sparse.csr_matrix
+        """
+
+        # Get the cached matrix for this shape
+        key = shape.get_key()
+        matrix = self.interpolation_matrices.get(key)
+
+        # Create the matrix if it is not available or if residences are added or removed
+        if matrix is None or matrix.shape[0] != self.data.shape[0]:
+            matrix = spline_evaluation_matrix(shape, self.data['x'].values, self.data['y'].values)
+            self.interpolation_matrices[key] = matrix
+
+        return matrix
+
+    def noise_from_grid(self, grid):
+        """
+        Calculate the noise levels for each residence by interpolating the grid results. For a multigrid, the noise
+        levels are calculated for all years at once.
+
+        :param Grid grid: the grid data to interpolate.
+        :return: the noise levels, with shape (residences,) for a single grid or (years, residences) for a multigrid.
+        :rtype: np.ndarray
+        """
+
+        if isinstance(grid.data, list):
+            raise TypeError('Noise levels can only be interpolated from grids with equal shapes.')
+
+        # Get the cached spline coefficients of the grid, or of each year of the multigrid
+        coefficients = grid.spline_coefficients()
+
+        # Evaluate the spline at the residences, which is a sparse product with all years at once. The matrix is cast if
+        # it is cached with another floating point type.
+        matrix = self.interpolation_matrix(grid.shape)
+        if matrix.dtype != coefficients.dtype:
+            matrix = matrix.astype(coefficients.dtype)
+        if grid.is_multigrid():
+            return (matrix @ coefficients.reshape(coefficients.shape[0], -1).T).T
+        return matrix @ coefficients.ravel()
 
     def add_noise_from_grid(self, grid):
         """
@@ -55,11 +106,11 @@ class WBS(object):
         :rtype: WBS
         """
 
-        # Get the interpolation function
-        interpolation = grid.interpolation_function()
+        if grid.is_multigrid():
+            raise TypeError('Noise levels can only be added from single grids, use noise_from_grid() for multigrids.')
 
         # Set the interpolated noise levels for each wbs location
-        self.data[grid.unit] = interpolation(self.data['y'], self.data['x'], grid=False)
+        self.data[grid.unit] = self.noise_from_grid(grid)
 
         return self
 
@@ -142,23 +193,8 @@ class WBS(object):
     def gwc(self, lden_grid, lnight_grid, **kwargs):
 
         # Check if a multigrid is provided
-        if isinstance(lden_grid.data, list):
-            df = pd.DataFrame(index=lden_grid.years, columns=['w58den', 'w48n', 'eh48den', 'sv40n'], dtype=float)
-
-            for year in lden_grid.years:
-                # Add the Lden and Lnight noise levels
-                self.add_noise_from_grid(lden_grid.grid_from_year(year))
-                self.add_noise_from_grid(lnight_grid.grid_from_year(year))
-
-                # Calculate the number of houses with >58dBA Lden and >48dBA Lnight
-                df.at[year, 'w58den'] = self.count_homes_above(58, 'Lden')
-                df.at[year, 'w48n'] = self.count_homes_above(48, 'Lnight')
-
-                # Calculate the number of annoyed and sleep disturbed people
-                df.at[year, 'eh48den'] = self.count_annoyed_people(48, **kwargs)
-                df.at[year, 'sv40n'] = self.count_sleep_disturbed_people(40, **kwargs)
-
-            return df
+        if lden_grid.is_multigrid():
+            return self.gwc_multigrid(lden_grid, lnight_grid, **kwargs)
         else:
 
             # Add the Lden and Lnight noise levels
@@ -180,58 +216,190 @@ class WBS(object):
                 'sv40n': sv40n
             })
         
-    def get_inpasbaarvolume(self,lden_grid,lnight_grid,gwc):
+    def gwc_multigrid(self, lden_grid, lnight_grid, **kwargs):
+        """
+        Calculate the gelijkwaardigheidscriteria (GWC) for all years of a multigrid at once. The noise levels of all
+        years are interpolated in a single step and the criteria are reduced per year, without changing the Lden and
+        Lnight columns of the WBS data.
+
+        :param Grid lden_grid: the Lden multigrid.
+        :param Grid lnight_grid: the Lnight multigrid, with the same years as the Lden multigrid in any order.
+        :param kwargs: additional keyworded arguments for annoyance() and sleep_disturbance().
+        :return: the number of homes and people for each year.
+        :rtype: pd.DataFrame
+        """
+
+        if sorted(lden_grid.years) != sorted(lnight_grid.years):
+            raise ValueError('The Lden and Lnight multigrids should contain the same years.')
+
+        # Interpolate the noise levels for all years, with shape (years, residences)
+        lden = self.noise_from_grid(lden_grid)
+        lnight = self.noise_from_grid(lnight_grid)
+
+        # Put the Lnight years in the same order as the Lden years
+        lnight = lnight[[list(lnight_grid.years).index(year) for year in lden_grid.years]]
+
+        # Get the number of homes and people for each residence
+        homes = self.data['woningen'].values
+        people = self.data['personen'].values
+
+        # Calculate the number of houses with >58dBA Lden and >48dBA Lnight
+        w58den = (lden >= 58) @ homes
+        w48n = (lnight >= 48) @ homes
+
+        # Calculate the number of annoyed and sleep disturbed people
+        eh48den = np.where(lden >= 48, annoyance(lden, **kwargs), 0) @ people
+        sv40n = np.where(lnight >= 40, sleep_disturbance(lnight, **kwargs), 0) @ people
+
+        return pd.DataFrame({'w58den': w58den, 'w48n': w48n, 'eh48den': eh48den, 'sv40n': sv40n},
+                            index=lden_grid.years, dtype=float)
+
+    def get_inpasbaarvolume(self, lden_grid, lnight_grid, gwc, **kwargs):
         """
         Find scaling factor for inpasbaar volume, relative to a set of limitic criteria
 
-        :param grid object lden_grid: grid object Lden grid, does not support multigrids
+        :param Grid lden_grid: grid object Lden grid, does not support multigrids
+        :param Grid lnight_grid: grid object Lnight grid, does not support multigrids
+        :param list gwc: the limits for w58den, eh48den, w48n and sv40n, e.g. ssdtools.grid.gwc['doc29_2018'].
+        :param kwargs: additional keyworded arguments for annoyance() and sleep_disturbance().
         :return: scaling factor
         :rtype: float
         """
-        
+
+        return self.get_max_scale(lden_grid, lnight_grid, gwc, **kwargs)[0]
+
+    def get_max_scale(self, lden_grid, lnight_grid, gwc, **kwargs):
+        """
+        Determine the maximum scaling factor of the traffic volume for which all four gelijkwaardigheidscriteria are
+        met, i.e. w58den < gwc[0], eh48den < gwc[1], w48n < gwc[2] and sv40n < gwc[3].
+
+        A uniform scaling factor f shifts the noise level at every residence by 10 * log10(f). Therefore, the noise
+        levels are only interpolated once. The counts of homes follow from the sorted noise levels and cumulative sums,
+        and the numbers of annoyed and sleep disturbed people are solved exactly within the range where the included
+        residences do not change. The criteria are strict, so the returned factor is the supremum: every smaller factor
+        meets all criteria.
+
+        :param Grid lden_grid: the Lden grid, does not support multigrids.
+        :param Grid lnight_grid: the Lnight grid, does not support multigrids.
+        :param list gwc: the limits for w58den, eh48den, w48n and sv40n, e.g. ssdtools.grid.gwc['doc29_2018'].
+        :param kwargs: additional keyworded arguments for annoyance() and sleep_disturbance().
+        :return: the maximum scaling factor and the name of the binding criterion.
+        :rtype: tuple(float, str)
+        """
+
         # check if multigrid
-        if isinstance(lden_grid.data, list):
-            raise ValueError('get_inpasbaarvolume does not support multigrids')
-            
-        # Find scale factor for inpasbaar volume
-        i_max =6
-        d = 3
-        volume_high = 700000
-        volume_low = 450000
-        verkeer = 496000
-        
-        i = 0
-        while i<i_max:
-            # initiate
-            check = True
-            step = int((volume_high-volume_low)/d) 
-            volume = volume_low
-        
-            while check == True:
-                # compute new scaling factor
-                scale = volume/verkeer
-
-                # scale grids, use copy to make sure that scaling is not done on already scaled grids
-                lden = lden_grid.copy().scale(scale)
-                lnight = lnight_grid.copy().scale(scale)
-                
-                # Calculate the GWC
-                score = self.gwc(lden,lnight)
-
-                # check
-                check = (gwc[0]>score['w58den']) & (gwc[1]>score['eh48den']) & (gwc[2]>score['w48n']) & (gwc[3]>score['sv40n'])
-                
-                # increase volume
-                volume = volume + step
-
-            # set new begin values
-            volume_high = volume-step
-            volume_low = volume-step-step
-            scale = volume_low/verkeer
-            
-            print('Schaalfactor = '+str(round(scale,3)))
-            i+=1
-        return scale
+        if lden_grid.is_multigrid() or lnight_grid.is_multigrid():
+            raise ValueError('get_max_scale does not support multigrids')
+
+        # Interpolate the noise levels
+        lden = self.noise_from_grid(lden_grid)
+        lnight = self.noise_from_grid(lnight_grid)
+
+        # Get the number of homes and people for each residence
+        homes = self.data['woningen'].values
+        people = self.data['personen'].values
+
+        # Determine the maximum shift in dB for each criterion
+        shifts = pd.Series({
+            'w58den': max_shift_count(lden, homes, 58, gwc[0]),
+            'eh48den': max_shift_dose_effect(lden, people, 48, gwc[1], lambda x: annoyance(x, **kwargs)),
+            'w48n': max_shift_count(lnight, homes, 48, gwc[2]),
+            'sv40n': max_shift_dose_effect(lnight, people, 40, gwc[3], lambda x: sleep_disturbance(x, **kwargs))
+        })
+
+        # The criterion with the smallest shift is binding
+        criterion = shifts.idxmin()
+
+        return 10 ** (shifts[criterion] / 10.), criterion
+
+
+def max_shift_count(noise_levels, weights, threshold, limit):
+    """
+    Determine the supremum of the shift d in dB for which the sum of the weights of the noise levels with
+    noise_levels + d >= threshold stays below the limit.
+
+    :param np.ndarray noise_levels: the noise levels.
+    :param np.ndarray weights: the weight of each noise level, e.g. the number of homes.
+    :param float threshold: the noise level threshold.
+    :param float limit: the limit for the sum of the weights.
+    :rtype: float
+    """
+
+    # Sort the noise levels from high to low and accumulate the weights
+    order = np.argsort(-noise_levels, kind='stable')
+    cumulative_weights = np.cumsum(weights[order])
+
+    # Find the first residence that would exceed the limit when it is included
+    k = np.searchsorted(cumulative_weights, limit, side='left')
+
+    # The limit is never reached
+    if k >= cumulative_weights.size:
+        return np.inf
+
+    # This residence should stay below the threshold
+    return threshold - noise_levels[order[k]]
+
+
+def max_shift_dose_effect(noise_levels, weights, threshold, limit, dose_effect):
+    """
+    Determine the supremum of the shift d in dB for which the sum of weights * dose_effect(noise_levels + d) over the
+    noise levels with noise_levels + d >= threshold stays below the limit. The dose-effect relationship should be
+    non-decreasing.
+
+    :param np.ndarray noise_levels: the noise levels.
+    :param np.ndarray weights: the weight of each noise level, e.g. the number of people.
+    :param float threshold: the noise level threshold.
+    :param float limit: the limit for the weighted sum.
+    :param function dose_effect: the dose-effect relationship, e.g. annoyance().
+    :rtype: float
+    """
+
+    # Sort the noise levels from high to low
+    order = np.argsort(-noise_levels, kind='stable')
+    levels = noise_levels[order]
+    weights = weights[order]
+
+    def total(shift, n):
+        # The weighted sum of the n highest noise levels
+        return weights[:n] @ dose_effect(levels[:n] + shift)
+
+    def included(k):
+        # The number of residences that are included when the k-th highest noise level reaches the threshold
+        return np.searchsorted(-levels, -levels[k], side='right')
+
+    # Find the last residence that can reach the threshold without exceeding the limit, the weighted sum at these
+    # breakpoints is non-decreasing in k
+    low, high = 0, levels.size
+    while low < high:
+        middle = (low + high) // 2
+        if total(threshold - levels[middle], included(middle)) < limit:
+            low = middle + 1
+        else:
+            high = middle
+
+    # Even the highest noise level exceeds the limit as soon as it reaches the threshold
+    if low == 0:
+        return threshold - levels[0]
+
+    # Within this range the included residences do not change, so the weighted sum is continuous in the shift
+    n = included(low - 1)
+    lower = threshold - levels[low - 1]
+    upper = threshold - levels[n] if n < levels.size else np.inf
+
+    # The limit is only exceeded by including the next residence
+    if np.isfinite(upper) and total(upper, n) < limit:
+        return upper
+
+    # The limit is never reached, since the dose-effect relationship is bounded
+    if not np.isfinite(upper):
+        upper = lower + 10.
+        while total(upper, n) < limit:
+            if upper - lower > 1000.:
+                return np.inf
+            upper = lower + 2 * (upper - lower)
+
+    # Solve the shift for which the weighted sum equals the limit
+    return brentq(lambda shift: total(shift, n) - limit, lower, upper, xtol=1e-12)
 
 
 def annoyance(noise_levels, de='doc29', max_noise_level=None):
@@ -255,8 +423,7 @@ def annoyance(noise_levels, de='doc29', max_noise_level=None):
 
     # Apply a cut-off at max_db if provided
     if max_noise_level is not None:
-        noise_levels = noise_levels.copy()
-        noise_levels.loc[noise_levels > max_noise_level] = max_noise_level
+        noise_levels = np.minimum(noise_levels, max_noise_level)
 
     # Apply the dose-effect relationship
     if de == 'ges2002':
@@ -291,8 +458,7 @@ def sleep_disturbance(noise_levels, de='doc29', max_noise_level=None):
 
     # Apply a cut-off at max_db if provided
     if max_noise_level is not None:
-        noise_levels = noise_levels.copy()
-        noise_levels.loc[noise_levels > max_noise_level] = max_noise_level
+        noise_levels = np.minimum(noise_levels, max_noise_level)
 
     # Apply the dose-effect relationship
     if de == 'ges2002':
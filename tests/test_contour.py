@@ -0,0 +1,88 @@
+import os
+
+import numpy as np
+from shapely.geometry import Polygon
+
+from ssdtools.contour import contour_area, contour_polygons, contour_rings, ring_area
+from ssdtools.grid import Grid
+
+
+def abs_path(rel_path):
+    return os.path.join(os.path.dirname(__file__), rel_path)
+
+
+def cone(x, y, x0, y0):
+    # Create a grid with the distance to a point
+    return np.hypot(*np.meshgrid(x - x0, y - y0))
+
+
+def test_contour_area_boundary():
+    # Create a grid that increases linearly in the x direction
+    x = np.linspace(0, 10, 51)
+    y = np.linspace(0, 20, 101)
+    data = np.meshgrid(x, y)[0]
+
+    # The contour is closed along the boundary of the grid
+    np.testing.assert_allclose(contour_area(data, x, y, 4), 6 * 20)
+
+    # A mirrored grid should give the same area
+    np.testing.assert_allclose(contour_area(data[::-1], x, y[::-1], 4), 6 * 20)
+
+
+def test_contour_polygons_hole():
+    # Create a ring shaped area with a radius between 2 and 4
+    x = np.linspace(0, 10, 101)
+    y = np.linspace(0, 20, 201)
+    data = -(cone(x, y, 5, 10) - 3) ** 2
+
+    # Determine the polygons
+    polygons = contour_polygons(data, x, y, -1)
+
+    assert len(polygons) == 1
+    assert len(polygons[0][1]) == 1
+    assert ring_area(polygons[0][0]) > 0
+    assert ring_area(polygons[0][1][0]) < 0
+    np.testing.assert_allclose(Polygon(*polygons[0]).area, np.pi * (4 ** 2 - 2 ** 2), rtol=1e-2)
+    np.testing.assert_allclose(Polygon(*polygons[0]).area, contour_area(data, x, y, -1))
+
+
+def test_contour_polygons_island():
+    # Create an island in the hole of a ring shaped area
+    x = np.linspace(0, 10, 101)
+    y = np.linspace(0, 20, 201)
+    r = cone(x, y, 5, 10)
+    data = np.maximum(-(r - 3) ** 2, 5 - 10 * r)
+
+    # Determine the polygons
+    polygons = contour_polygons(data, x, y, -1)
+
+    assert sorted(len(holes) for exterior, holes in polygons) == [0, 1]
+
+
+def test_contour_rings_nan():
+    # Create a grid with a missing value
+    x = np.arange(5.)
+    y = np.arange(5.)
+    data = np.ones((5, 5))
+    data[2, 2] = np.nan
+
+    # The missing value is treated as a value below the level
+    rings = contour_rings(data, x, y, 0.5)
+
+    assert len(rings) == 2
+    np.testing.assert_allclose(sum(ring_area(ring) for ring in rings), 16 - 2)
+
+
+def test_get_area_from_contour():
+    # Get the path to the Envira file
+    file_path = abs_path('data/GP2018 - Lnight y2016.dat')
+
+    # Create a grid object from the data file
+    grid = Grid.read_envira(file_path)
+
+    # The area should match the area of the polygons
+    for level in [40, 48, 60]:
+        polygons = grid.contour_polygons(level)
+        area = sum(Polygon(exterior, holes).area for exterior, holes in polygons) / 1000000
+        np.testing.assert_allclose(grid.get_area_from_contour(level), area)
+        assert all(Polygon(exterior, holes).is_valid for exterior, holes in polygons)
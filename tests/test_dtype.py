@@ -0,0 +1,68 @@
+import os
+
+import numpy as np
+import pandas as pd
+from nose.tools import raises
+
+from ssdtools.grid import Grid, number_above
+from ssdtools.utils.dtype import set_dtype, get_dtype
+from ssdtools.wbs import WBS
+
+
+def test_set_dtype():
+    # Get the path to the Envira file
+    file_path = abs_path('data/GP2018 - Lnight y2016.dat')
+
+    # Read the grid in double precision
+    desired = Grid.read_envira(file_path)
+
+    set_dtype('float32')
+    try:
+        assert get_dtype() == np.float32
+
+        # The reader, the resize operators and the arithmetic should keep the data in single precision
+        grid = Grid.read_envira(file_path)
+        assert grid.data.dtype == np.float32
+        np.testing.assert_allclose(grid.data, desired.data, atol=1e-5)
+        assert grid.copy().refine(2).data.dtype == np.float32
+        assert grid.copy().add(grid).data.dtype == np.float32
+        assert number_above([grid.data, grid.data], [40, 50]).dtype == np.float32
+
+        # The parallel reader should return the same type as the serial reader
+        parallel = Grid.read_enviras(abs_path('data/MINIMER2015'), r'[\w\d\s]+\.dat', workers=2)
+        assert parallel.data.dtype == np.float32
+    finally:
+        set_dtype('float64')
+
+    assert Grid.read_envira(file_path).data.dtype == np.float64
+
+
+def test_set_dtype_wbs():
+    # Create a wbs object with random residences
+    random = np.random.RandomState(0)
+    wbs = WBS(pd.DataFrame({'x': random.uniform(80000, 160000, 1000), 'y': random.uniform(450000, 530000, 1000)}))
+
+    # Get the path to the Envira file
+    file_path = abs_path('data/GP2018 - Lnight y2016.dat')
+
+    # Interpolate the noise levels in double precision, which also caches the interpolation matrix
+    desired = wbs.noise_from_grid(Grid.read_envira(file_path))
+
+    set_dtype('float32')
+    try:
+        # Interpolate the noise levels in single precision
+        noise = wbs.noise_from_grid(Grid.read_envira(file_path))
+    finally:
+        set_dtype('float64')
+
+    assert noise.dtype == np.float32
+    np.testing.assert_allclose(noise, desired, atol=1e-4)
+
+
+@raises(ValueError)
+def test_set_dtype_invalid():
+    set_dtype('int16')
+
+
+def abs_path(rel_path):
+    return os.path.join(os.path.dirname(__file__), rel_path)
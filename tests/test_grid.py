@@ -1,11 +1,21 @@
+import gzip
+import io
 import os
 import re
+import shutil
+import tarfile
+import tempfile
+import zipfile
 
 import numpy as np
 from nose.tools import raises
 from scipy.interpolate import RectBivariateSpline
 
-from ssdtools.grid import Grid, read_envira, meteotoeslag_years, extract_year_from_file_name
+from ssdtools import grid as grid_module
+from ssdtools.grid import Grid, read_envira, meteotoeslag_years, meteotoeslag_from_grids, extract_year_from_file_name, \
+    enable_envira_cache, disable_envira_cache, envira_cache_paths, resample, axis_resampling_operator, GridStatistics, \
+    read_envira_info, index_enviras, format_envira_rows, write_envira_wrapped, read_enviras_parallel, \
+    number_above
 
 
 def test_read_envira():
@@ -57,10 +67,264 @@ def test_read_enviras():
     grid = Grid.read_enviras(file_paths, pattern)
 
     # Check if the data is stored correctly
-    assert isinstance(grid.data, list) and len(grid.data) == 2
+    assert isinstance(grid.data, np.ndarray) and grid.data.shape[0] == 2 and grid.data.flags['C_CONTIGUOUS']
     assert isinstance(grid.info, list) and len(grid.data) == 2
 
 
+def test_read_envira_bbox():
+    # Get the path to the Envira file
+    file_path = abs_path('data/GP2018 - Lnight y2016.dat')
+
+    # Read a window and the full grid
+    grid = Grid.read_envira(file_path, bbox=(100000, 460000, 130000, 500250))
+    desired = Grid.read_envira(file_path)
+
+    assert grid.data.shape == (81, 61)
+    assert (grid.shape.x_start, grid.shape.x_stop, grid.shape.y_start, grid.shape.y_stop) == \
+        (100000, 130000, 460000, 500000)
+    np.testing.assert_equal(grid.data, desired.data[10:91, 32:93])
+
+
+def test_read_envira_bbox_cache():
+    # Get the path to the Envira file
+    file_path = abs_path('data/GP2018 - Lnight y2016.dat')
+    bbox = (84000, 455000, 100000, 470000)
+
+    with tempfile.TemporaryDirectory() as directory:
+        # The line-offset index is stored in the cache directory
+        window = read_envira(file_path, cache=True, directory=directory, bbox=bbox)
+        assert any(f.endswith('.lines.npz') for f in os.listdir(directory))
+
+        # Crop the cached data once the file is cached
+        read_envira(file_path, cache=True, directory=directory)
+        cached = read_envira(file_path, cache=True, directory=directory, bbox=bbox)
+
+    assert window[0] == cached[0]
+    np.testing.assert_equal(window[1], cached[1])
+
+
+def test_read_envira_bbox_line_indices():
+    # Get the paths to the Envira files
+    directory = abs_path('data/H_500_00_doc29')
+    file_paths = [os.path.join(directory, f) for f in sorted(os.listdir(directory))[:5]]
+
+    # Read windows of more files than the number of line-offset indices that are kept in memory
+    size = grid_module.envira_line_indices_size
+    grid_module.envira_line_indices_size = 2
+    try:
+        for file_path in file_paths:
+            Grid.read_envira(file_path, bbox=(100000, 460000, 130000, 500000))
+
+        # Only the indices of the most recent files should be kept
+        assert [key[0] for key in grid_module.envira_line_indices] == [os.path.abspath(f) for f in file_paths[-2:]]
+    finally:
+        grid_module.envira_line_indices_size = size
+
+
+@raises(ValueError)
+def test_read_envira_bbox_outside():
+    # Get the path to the Envira file
+    file_path = abs_path('data/GP2018 - Lnight y2016.dat')
+
+    # The window is outside the grid
+    Grid.read_envira(file_path, bbox=(0, 0, 1000, 1000))
+
+
+def test_read_envira_info():
+    # Get the path to the Envira file
+    file_path = abs_path('data/GP2018 - Lnight y2016.dat')
+
+    # The header should be the same as the header of the full read
+    assert read_envira_info(file_path) == read_envira(file_path)[0]
+
+
+def test_index_enviras():
+    # Get the path to the Envira files
+    file_paths = abs_path('data/H_500_00_doc29')
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Create the index and check if it is persisted
+        index = index_enviras(file_paths, directory=directory)
+        assert os.path.isfile(os.path.join(directory, 'envira_index.sqlite'))
+        assert len(index) == 80
+        assert set(index['unit']) == {'Lden', 'Lnight'}
+        assert index['x_number'].eq(285).all()
+
+        # Reuse the index
+        reused = index_enviras(file_paths, directory=directory)
+        assert reused.equals(index)
+
+        # A directory that cannot be written should keep the index in memory, without hashing the file contents
+        unwritable = index_enviras(file_paths, directory=os.path.join(directory, 'missing'))
+        assert not os.path.exists(os.path.join(directory, 'missing'))
+        assert unwritable.drop(columns='hash').equals(index.drop(columns='hash'))
+        assert unwritable['hash'].isnull().all() and index['hash'].notnull().all()
+
+
+def test_read_enviras_select_without_cache():
+    # Get the path to the Envira files
+    file_paths = abs_path('data/H_500_00_doc29')
+
+    # Select the files without a cache directory, which should not write an index to the data directory
+    grid = Grid.read_enviras(file_paths, unit='Lnight', years=[1971, 1972])
+    assert grid.years == [1971, 1972]
+    assert not os.path.exists(os.path.join(file_paths, 'envira_index.sqlite'))
+
+
+def test_read_enviras_select():
+    # Get the path to the Envira files
+    file_paths = abs_path('data/H_500_00_doc29')
+
+    with tempfile.TemporaryDirectory() as directory:
+        enable_envira_cache(directory)
+        try:
+            # Select the Lnight files of three years from the index
+            grid = Grid.read_enviras(file_paths, unit='Lnight', years=[1971, 1972, 1999])
+        finally:
+            disable_envira_cache()
+
+    # The selection should match the pattern based selection
+    desired = Grid.read_enviras(file_paths, r'Lnight y(1971|1972|1999)')
+    assert grid.unit == 'Lnight'
+    assert sorted(grid.years) == [1971, 1972, 1999]
+    for year in grid.years:
+        np.testing.assert_equal(grid.grid_from_year(year).data, desired.grid_from_year(year).data)
+
+
+def test_read_enviras_archive():
+    # Get the path to the Envira files
+    file_paths = abs_path('data/MINIMER2015')
+    file_names = [f for f in os.listdir(file_paths) if f.endswith('.dat')]
+
+    desired = Grid.read_enviras(file_paths)
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Bundle the envira files in a zip and a compressed tar archive
+        zip_path = os.path.join(directory, 'scenario.zip')
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for file_name in file_names:
+                archive.write(os.path.join(file_paths, file_name), 'grids/' + file_name)
+        tar_path = os.path.join(directory, 'scenario.tar.gz')
+        with tarfile.open(tar_path, 'w:gz') as archive:
+            for file_name in file_names:
+                archive.add(os.path.join(file_paths, file_name), file_name)
+
+        for archive_path in [zip_path, tar_path]:
+            # Read the grids from the archive
+            grid = Grid.read_enviras(archive_path)
+
+            assert sorted(grid.years) == sorted(desired.years)
+            for year in grid.years:
+                np.testing.assert_equal(grid.grid_from_year(year).data, desired.grid_from_year(year).data)
+
+        # Select a few years from the archive
+        grid = Grid.read_enviras(zip_path, years=[1971, 1972], unit='Lden')
+        assert sorted(grid.years) == [1971, 1972]
+
+
+def test_read_envira_compressed():
+    # Get the path to the Envira file
+    file_path = abs_path('data/GP2018 - Lnight y2016.dat')
+
+    header, data = read_envira(file_path)
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Compress the envira file with gzip
+        gzip_path = os.path.join(directory, 'Lnight y2016.dat.gz')
+        with open(file_path, 'rb') as source, gzip.open(gzip_path, 'wb') as target:
+            shutil.copyfileobj(source, target)
+
+        # Put the envira file in a zip archive
+        zip_path = os.path.join(directory, 'scenario.zip')
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.write(file_path, 'grids/Lnight y2016.dat')
+
+        # Put the envira file in a compressed tar archive, alone and together with another file
+        tar_path = os.path.join(directory, 'scenario.tar.gz')
+        single_tar_path = os.path.join(directory, 'Lnight y2016.tar.gz')
+        with tarfile.open(tar_path, 'w:gz') as archive:
+            archive.add(file_path, 'grids/Lnight y2016.dat')
+            archive.add(abs_path('data/GP2018 - Lnight y2017.dat'), 'grids/Lnight y2017.dat')
+        with tarfile.open(single_tar_path, 'w:gz') as archive:
+            archive.add(file_path, 'Lnight y2016.dat')
+
+        for compressed_path in [gzip_path, os.path.join(zip_path, 'grids', 'Lnight y2016.dat'),
+                                os.path.join(tar_path, 'grids', 'Lnight y2016.dat'), single_tar_path]:
+            # Read the compressed envira file
+            compressed_header, compressed_data = read_envira(compressed_path)
+
+            assert compressed_header == header
+            np.testing.assert_equal(compressed_data, data)
+
+        # An archive with multiple files requires the name of the member
+        try:
+            read_envira(tar_path)
+            raise AssertionError('A ValueError should be raised')
+        except ValueError as error:
+            assert 'multiple files' in str(error)
+
+
+def test_read_enviras_workers():
+    # Get the path to the Envira files
+    file_paths = abs_path('data/MINIMER2015')
+
+    # Set the pattern
+    pattern = r'[\w\d\s]+\.dat'
+
+    # Read the grids one after another and in parallel
+    grid_serial = Grid.read_enviras(file_paths, pattern)
+    grid_parallel = Grid.read_enviras(file_paths, pattern, workers=2)
+
+    # The result should be identical
+    assert grid_parallel.years == grid_serial.years
+    assert grid_parallel.info == grid_serial.info
+    np.testing.assert_equal(np.array(grid_parallel.data), np.array(grid_serial.data))
+
+
+@raises(ValueError)
+def test_read_enviras_workers_row_missing():
+    # Get the path to the Envira files
+    file_paths = abs_path('data/')
+
+    # Set the pattern
+    pattern = r'GP2018 - Lnight y2016r?.dat'
+
+    # The inconsistent file should raise the same error as in the serial path
+    Grid.read_enviras(file_paths, pattern, workers=2)
+
+
+@raises(ValueError)
+def test_read_enviras_parallel_shape():
+    # Get the paths to two Envira files with a different shape
+    file_paths = [abs_path('data/GP2018 - Lnight y2016.dat'),
+                  abs_path('data/H_500_00_doc29/MER2015 - Doc29 - Lden y1971.dat')]
+
+    # The different shapes should be found in the headers, before the files are parsed
+    read_enviras_parallel(file_paths, 2)
+
+
+def test_read_enviras_list():
+    # Get the path to the Envira files
+    file_paths = abs_path('data/')
+
+    # Set the pattern
+    pattern = r'GP2018 - Lnight y201[67].dat'
+
+    # Get the envira files
+    file_names = [f for f in os.listdir(file_paths) if re.search(pattern, f)]
+
+    # Read the envira files
+    cls_info, cls_data = zip(*[read_envira(os.path.join(file_paths, file_name)) for file_name in file_names])
+
+    # Add the data to a Grid object
+    grid = Grid(data=list(cls_data), info=list(cls_info), unit='Lnight')
+
+    # A list of equal grids should be stacked
+    assert grid.is_multigrid()
+    assert grid.data.shape == (2, grid.shape.y_number, grid.shape.x_number)
+    np.testing.assert_equal(grid.data[1], cls_data[1])
+
+
 def test_read_enviras_inconsistent_info():
     # Get the path to the Envira files
     file_paths = abs_path('data/')
@@ -169,6 +433,63 @@ def test_read_enviras_inconsistent_list_size():
         assert file_names == ['GP2018 - Lnight y2016.dat', 'GP2018 - Lnight y2017.dat']
 
 
+def test_read_envira_cache():
+    # Get the path to the Envira file
+    file_path = abs_path('data/GP2018 - Lnight y2016.dat')
+
+    with tempfile.TemporaryDirectory() as cache_directory:
+        # Read the file once without and twice with the cache
+        info, data = read_envira(file_path)
+        info_cold, data_cold = read_envira(file_path, cache=True, directory=cache_directory)
+        info_warm, data_warm = read_envira(file_path, cache=True, directory=cache_directory)
+
+        # The warm read should be a memory-map of the cached data
+        assert isinstance(data_warm, np.memmap)
+        assert info_warm == info_cold == info
+        np.testing.assert_equal(data_warm, data)
+
+
+def test_read_envira_cache_invalidation():
+    with tempfile.TemporaryDirectory() as directory:
+        # Copy the Envira file, so its modification time can be changed
+        file_path = os.path.join(directory, 'GP2018 - Lnight y2016.dat')
+        with open(abs_path('data/GP2018 - Lnight y2016.dat'), 'r') as f_in, open(file_path, 'w') as f_out:
+            f_out.write(f_in.read())
+
+        # Fill the sidecar cache
+        read_envira(file_path, cache=True)
+        assert all(os.path.exists(p) for p in envira_cache_paths(file_path))
+
+        # Change the modification time of the Envira file
+        stat = os.stat(file_path)
+        os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+        # The changed file should be parsed again instead of loaded from the cache
+        info, data = read_envira(file_path, cache=True)
+        assert not isinstance(data, np.memmap)
+
+
+def test_read_enviras_cache():
+    # Get the path to the Envira files
+    file_paths = abs_path('data/MINIMER2015')
+
+    # Set the pattern
+    pattern = r'[\w\d\s]+\.dat'
+
+    with tempfile.TemporaryDirectory() as cache_directory:
+        enable_envira_cache(cache_directory)
+        try:
+            # Read the multigrid twice, the second time from the cache
+            grid_cold = Grid.read_enviras(file_paths, pattern)
+            grid_warm = Grid.read_enviras(file_paths, pattern)
+        finally:
+            disable_envira_cache()
+
+    assert grid_warm.years == grid_cold.years
+    assert grid_warm.info == grid_cold.info
+    np.testing.assert_equal(np.array(grid_warm.data), np.array(grid_cold.data))
+
+
 def test_to_envira():
     # Get the path from the original Envira file
     original_file_path = abs_path('data/GP2018 - Lnight y2016.dat')
@@ -192,6 +513,100 @@ def test_to_envira():
     np.testing.assert_equal(grid_new.data, grid.data)
 
 
+def test_write_envira_wrapped():
+    # Get the path from the original Envira file
+    header, data = read_envira(abs_path('data/GP2018 - Lnight y2016.dat'))
+
+    # Include negative values and values with three-digit exponents, which do not fit ten values on a line
+    random_state = np.random.RandomState(0)
+    data = data * random_state.choice([-1., 1., 1e-110, 1e110], size=data.shape)
+
+    # The formatted rows should be the same as the output of the line wrapper
+    desired = io.StringIO()
+    write_envira_wrapped(desired, data)
+    assert format_envira_rows(np.flipud(data)) == desired.getvalue()
+
+
+def test_to_enviras():
+    # Get the path to the Envira files
+    file_paths = abs_path('data/MINIMER2015')
+
+    # Create a grid object from the data file
+    grid = Grid.read_enviras(file_paths, r'[\w\d\s]+\.dat')
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Export the grid in parallel
+        paths = grid.to_enviras(directory, workers=2)
+
+        # Check if the data is still correct
+        grid_new = Grid.read_enviras(directory, r'[\w\d\s]+\.dat')
+        assert len(paths) == len(grid.years)
+        for year in grid.years:
+            np.testing.assert_equal(grid_new.grid_from_year(year).data, grid.grid_from_year(year).data)
+            assert grid_new.grid_from_year(year).info == grid.grid_from_year(year).info
+
+        # The files should be the same as the files written one by one
+        with open(paths[0], 'rb') as f:
+            parallel = f.read()
+        grid.to_enviras(directory)
+        with open(paths[0], 'rb') as f:
+            assert f.read() == parallel
+
+
+def test_save_load():
+    # Get the path to the Envira files
+    file_paths = abs_path('data/MINIMER2015')
+
+    # Create a grid object from the data files
+    grid = Grid.read_enviras(file_paths, r'[\w\d\s]+\.dat')
+
+    with tempfile.TemporaryDirectory() as directory:
+        for file_name in ['grid.h5', 'grid.npz']:
+            # Store and load the multigrid
+            path = grid.save(os.path.join(directory, file_name))
+            grid_new = Grid.load(path)
+
+            np.testing.assert_equal(grid_new.data, grid.data)
+            assert grid_new.info == grid.info
+            assert grid_new.years == grid.years
+            assert grid_new.unit == grid.unit
+            assert grid_new.shape.get_key() == grid.shape.get_key()
+
+
+def test_save_load_partial():
+    # Get the path to the Envira files
+    file_paths = abs_path('data/H_500_00_doc29')
+    bbox = (100000, 460000, 130000, 500250)
+
+    # Create a grid object from the data files
+    grid = Grid.read_enviras(file_paths, r'Lnight y(1971|1972|1999)\.dat')
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Store the multigrid with quantised noise levels and read two years inside the window
+        path = grid.save(os.path.join(directory, 'grid.h5'), dtype='int16')
+        grid_new = Grid.load(path, years=[1999, 1971], bbox=bbox)
+
+    # The window should match a window read from the envira file
+    desired = Grid.read_envira(os.path.join(file_paths, 'MER2015 - Doc29 - Lnight y1999.dat'), bbox=bbox)
+    assert grid_new.years == [1999, 1971]
+    assert grid_new.info[0] == desired.info
+    assert grid_new.shape.get_key() == desired.shape.get_key()
+    np.testing.assert_allclose(grid_new.data[0], desired.data, atol=0.005)
+
+
+@raises(LookupError)
+def test_load_missing_year():
+    # Get the path to the Envira files
+    file_paths = abs_path('data/MINIMER2015')
+
+    # Create a grid object from the data files
+    grid = Grid.read_enviras(file_paths, r'[\w\d\s]+\.dat')
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Try to load a year that is not stored
+        Grid.load(grid.save(os.path.join(directory, 'grid.npz')), years=[2100])
+
+
 def test_to_shapefile():
     # Get the path to the Envira file
     file_path = abs_path('data/GP2018 - Lnight y2016.dat')
@@ -203,6 +618,92 @@ def test_to_shapefile():
     grid.refine(20).to_shapefile(abs_path('data/GP2018 - Lnight y2016.shp'), 48)
 
 
+def test_contour_areas():
+    # Get the path to the Envira files
+    file_paths = abs_path('data/H_500_00_doc29')
+
+    # Create a grid object from the Lden data files
+    grid = Grid.read_enviras(file_paths, r'[\w\d\s]+Lden[\w\d\s]+\.dat')
+
+    # Calculate the area table
+    areas = grid.contour_areas([48, 58])
+
+    assert areas.shape == (len(grid.years), 2)
+    assert list(areas.index) == list(grid.years)
+    for i, year in enumerate(grid.years):
+        np.testing.assert_allclose(areas.loc[year, 58], grid.grid_from_index(i).get_area_from_contour(58))
+
+    # A process pool should give the same table
+    np.testing.assert_allclose(grid.contour_areas([48, 58], workers=2), areas)
+
+
+def test_contour_areas_cells():
+    # Get the path to the Envira file
+    file_path = abs_path('data/GP2018 - Lnight y2016.dat')
+
+    # Create a grid object from the data file
+    grid = Grid.read_envira(file_path)
+
+    # Count the cells at or above the level
+    areas = grid.contour_areas([40, 48], interpolate=False)
+
+    np.testing.assert_allclose(areas.values, [(grid.data >= 40).sum() * 0.25, (grid.data >= 48).sum() * 0.25])
+
+
+def test_number_above():
+    # Get the path to the Envira files
+    file_paths = abs_path('data/H_500_00_doc29')
+
+    # Create a grid object from the Lnight data files
+    grid = Grid.read_enviras(file_paths, r'[\w\d\s]+Lnight[\w\d\s]+\.dat')
+    weights = np.arange(len(grid.years)) + 1.
+
+    # Count the weighted number of grids above multiple thresholds at once
+    number_above_grids = grid.number_above([45, 35, 40], weights)
+
+    for threshold in [35, 40, 45]:
+        desired = np.tensordot(weights, grid.data >= threshold, axes=1)
+        np.testing.assert_allclose(number_above_grids[threshold].data, desired)
+        assert number_above_grids[threshold].unit == 'NAxx'
+
+    # The output grids should not share their info
+    number_above_grids[35].info['eenheid'] = 'NA35'
+    assert number_above_grids[40].info['eenheid'] != 'NA35'
+
+
+def test_number_above_nan():
+    # Create two grids with a missing value in the second grid
+    data = np.array([[[50., 30.]], [[60., np.nan]]])
+
+    # A grid point with a missing value should have an unknown count
+    counts = number_above(data, [40, 55], [2., 3.])
+    np.testing.assert_equal(counts, [[[5., np.nan]], [[3., np.nan]]])
+
+
+def test_create_NAxx():
+    # Get the path to the Envira files
+    file_paths = abs_path('data/H_500_00_doc29')
+
+    # Create a grid object from the Lnight data files
+    grid = Grid.read_enviras_NAxx(file_paths, r'Lnight')
+    desired = Grid.read_enviras_NAxx(file_paths, r'Lnight')
+
+    # Create a conditions file for the first 30 grids
+    with tempfile.TemporaryDirectory() as directory:
+        conditions_path = os.path.join(directory, 'conditions.csv')
+        with open(conditions_path, 'w') as f:
+            f.write('name,scale\n')
+            for i, name in enumerate(grid.years[:30]):
+                f.write('{},{}\n'.format(name, i + 1))
+
+        grid.create_NAxx(40, conditions_path)
+
+    # The other grids should not be counted
+    desired.resize(grid.shape)
+    np.testing.assert_allclose(grid.data, sum((desired.data[i] >= 40) * (i + 1.) for i in range(30)))
+    np.testing.assert_equal(grid.scale_check, np.r_[np.arange(30) + 1., np.zeros(len(desired.years) - 30)])
+
+
 def test_meteotoeslag_years_empirisch_lden():
     # Determine the years to include for empirical Lden
     actual = meteotoeslag_years('empirisch', 'Lden')
@@ -294,6 +795,74 @@ def test_meteotoeslag_from_method():
     assert np.all(grid.data[0] <= meteotoeslag)
 
 
+def test_meteotoeslag_from_enviras():
+    # Get the path to the Envira files
+    file_paths = abs_path('data/MINIMER2015')
+
+    # Set the pattern
+    pattern = r'[\w\d\s]+\.dat'
+
+    # Calculate the meteotoeslag for both methods in a single pass
+    meteotoeslag = Grid.meteotoeslag_from_enviras(file_paths, pattern)
+
+    # The result should be the same as for the multigrid
+    grid = Grid.read_enviras(file_paths, pattern)
+    for method in ['empirisch', 'hybride']:
+        desired, meteo_years = grid.meteotoeslag_from_method(method)
+        np.testing.assert_equal(meteotoeslag[method].data, desired)
+        np.testing.assert_equal(meteotoeslag[method].years, meteo_years)
+        assert meteotoeslag[method].unit == grid.unit
+
+
+def test_meteotoeslag_from_grids_without_info():
+    # Get the path to the Envira files
+    file_paths = abs_path('data/MINIMER2015')
+
+    # Create a grid object from the data file
+    grid = Grid.read_enviras(file_paths, r'[\w\d\s]+\.dat')
+
+    # Stream grids that are created without info
+    grids = ((year, Grid(data=grid.data[i], shape=grid.shape, unit=grid.unit)) for i, year in enumerate(grid.years))
+    meteotoeslag = meteotoeslag_from_grids(grids)
+
+    # The meteotoeslag should have the shape of the grids
+    assert meteotoeslag['hybride'].shape.get_key() == grid.shape.get_key()
+    np.testing.assert_equal(meteotoeslag['hybride'].data, grid.meteotoeslag_grid_from_method('hybride').data)
+
+
+@raises(LookupError)
+def test_meteotoeslag_from_grids_missing_years():
+    # Get the path to the Envira files
+    file_paths = abs_path('data/MINIMER2015')
+
+    # Create a grid object from the data file
+    grid = Grid.read_enviras(file_paths, r'[\w\d\s]+\.dat')
+
+    # Stream only the first 30 years
+    meteotoeslag_from_grids((grid.years[i], grid.grid_from_index(i)) for i in range(30))
+
+
+
+def test_meteotoeslag_from_grids_shape():
+    # Get the path to the Envira files
+    file_paths = abs_path('data/MINIMER2015')
+
+    # Create a grid object from the data file
+    grid = Grid.read_enviras(file_paths, r'[\w\d\s]+\.dat')
+
+    # Double the width of the grid of the second year
+    grids = [(year, grid.grid_from_index(i), 'grid {}.dat'.format(year)) for i, year in enumerate(grid.years)]
+    grids[1][1].data = np.hstack([grids[1][1].data, grids[1][1].data])
+
+    # The error should name the file and both shapes
+    try:
+        meteotoeslag_from_grids(grids)
+        raise AssertionError('A ValueError should be raised')
+    except ValueError as error:
+        assert 'grid {}.dat'.format(grid.years[1]) in str(error)
+        assert str(grids[1][1].data.shape) in str(error)
+
+
 @raises(LookupError)
 def test_meteotoeslag_from_years():
     # Get the path to the Envira files
@@ -339,6 +908,46 @@ def test_meteotoeslag_from_years_doubles():
     grid.meteotoeslag_from_years(np.ones((32,), dtype=int) * 1981)
 
 
+def test_grid_from_year():
+    # Get the path to the Envira files
+    file_paths = abs_path('data/MINIMER2015')
+
+    # Set the pattern
+    pattern = r'[\w\d\s]+\.dat'
+
+    # Create a grid object from the data file
+    grid = Grid.read_enviras(file_paths, pattern)
+
+    # Get a single year
+    year_grid = grid.grid_from_year(1981)
+
+    # The data of the year should be a view on the multigrid data
+    assert not year_grid.is_multigrid()
+    assert np.shares_memory(year_grid.data, grid.data)
+    np.testing.assert_equal(year_grid.data, grid.data[grid.years.index(1981)])
+
+
+def test_resize_multigrid():
+    # Get the path to the Envira files
+    file_paths = abs_path('data/H_500_00_doc29')
+
+    # Set the pattern
+    pattern = r'[\w\d\s]+Lden[\w\d\s]+\.dat'
+
+    # Create a grid object from the data file
+    grid = Grid.read_enviras(file_paths, pattern)
+
+    # Resize a single year for comparison
+    year_grid = grid.grid_from_year(1981).copy().refine(2)
+
+    # Resize the multigrid
+    grid.refine(2)
+
+    assert grid.data.shape == (40,) + year_grid.data.shape
+    assert all(info['x_number'] == year_grid.shape.x_number for info in grid.info)
+    np.testing.assert_allclose(grid.grid_from_year(1981).data, year_grid.data, atol=1e-10)
+
+
 def test_hg():
     # Get the path to the Envira file
     file_path = abs_path('data/GP2018 - Lnight y2016.dat')
@@ -383,6 +992,201 @@ def test_scale():
     np.testing.assert_equal(grid.data, d + 10 * np.log10(2))
 
 
+def test_energy():
+    # Get the path to the Envira file
+    file_path = abs_path('data/GP2018 - Lnight y2016.dat')
+
+    # Create a grid object from the data file
+    grid = Grid.read_envira(file_path)
+
+    # Copy the data
+    d = grid.data.copy()
+
+    # The energy is derived from the noise levels
+    np.testing.assert_allclose(grid.energy, 10 ** (d / 10.))
+
+    # Scale the grid in both domains
+    grid.scale(2.)
+    np.testing.assert_allclose(grid.energy, 2 * 10 ** (d / 10.))
+    np.testing.assert_equal(grid.data, d + 10 * np.log10(2))
+
+    # Setting the noise levels invalidates the energy
+    grid.data = d
+    np.testing.assert_allclose(grid.energy, 10 ** (d / 10.))
+
+    # Writing to the noise levels in place should also invalidate the energy
+    grid.data[0, 0] = 0
+    assert grid.energy[0, 0] == 1
+
+    # The derived energy should be read-only
+    try:
+        grid.energy[0, 0] = 2
+        raise AssertionError('A ValueError should be raised')
+    except ValueError:
+        pass
+
+
+def test_copy():
+    # Get the path to the Envira file
+    file_path = abs_path('data/GP2018 - Lnight y2016.dat')
+
+    # Create a grid object from the data file
+    grid = Grid.read_envira(file_path)
+    desired = grid.data.copy()
+
+    # A copy should not share the noise data
+    grid_copy = grid.copy()
+    grid_copy.data[0, 0] = 999
+    np.testing.assert_equal(grid.data, desired)
+
+    # A shallow copy should share the noise data, but not the info, shape and splines
+    grid_copy = grid.copy(deep=False)
+    assert np.shares_memory(grid_copy.data, grid.data)
+    assert grid_copy.info is not grid.info and grid_copy.shape is not grid.shape
+    assert grid_copy._splines is not grid._splines
+
+    # Writing to the shared data should fail for both grids
+    for shared in [grid, grid_copy]:
+        try:
+            shared.data[0, 0] = 999
+            raise AssertionError('A ValueError should be raised')
+        except ValueError:
+            pass
+
+    # Scaling either grid should not change the other
+    grid_copy.scale(2)
+    np.testing.assert_equal(grid.data, desired)
+    grid.scale(0.5)
+    np.testing.assert_allclose(grid_copy.data, desired + 10 * np.log10(2))
+
+    # Operations that return a new grid should leave the grid unchanged
+    grid = Grid.read_envira(file_path)
+    refined = grid.refine(2, inplace=False)
+    assert refined.data.shape == (2 * grid.data.shape[0] - 1, 2 * grid.data.shape[1] - 1)
+    assert grid.info['x_number'] == desired.shape[1]
+    np.testing.assert_allclose(grid.scale(2, inplace=False).data, desired + 10 * np.log10(2))
+    np.testing.assert_allclose(grid.add(grid, inplace=False).data, desired + 10 * np.log10(2))
+    np.testing.assert_equal(grid.data, desired)
+
+    # These operations should not make the data of the grid read-only
+    grid.data[0, 0] = desired[0, 0]
+
+
+def test_add_aligned():
+    # Get the path to the Envira file
+    file_path = abs_path('data/GP2018 - Lnight y2016.dat')
+
+    # Create a grid and a grid with a smaller extent and the same step
+    grid = Grid.read_envira(file_path)
+    window = Grid.read_envira(file_path, bbox=(100000, 460000, 130000, 500250))
+
+    # The window should be added to the coinciding nodes without interpolation
+    total = grid.add(window, inplace=False)
+    np.testing.assert_allclose(total.data[10:91, 32:93], grid.data[10:91, 32:93] + 10 * np.log10(2), atol=1e-12)
+    assert total.data.shape == grid.data.shape
+
+    # The other way around, the grid should be cropped to the window
+    difference = window.add(grid, inplace=False).subtract(grid)
+    np.testing.assert_allclose(difference.data, window.data, atol=1e-9)
+
+
+def test_add_multigrid_years():
+    # Get the path to the Envira files
+    file_paths = abs_path('data/H_500_00_doc29')
+
+    # Create two multigrids with the same years in another order
+    grid = Grid.read_enviras(file_paths, r'Lden y(1971|1972|1999)\.dat')
+    other = Grid(data=grid.data[::-1].copy(), info=grid.info[::-1], unit=grid.unit, years=grid.years[::-1])
+
+    # The years should be aligned
+    total = grid.add(other, inplace=False)
+    np.testing.assert_allclose(total.data, grid.data + 10 * np.log10(2))
+
+
+@raises(ValueError)
+def test_add_multigrid_missing_years():
+    # Get the path to the Envira files
+    file_paths = abs_path('data/H_500_00_doc29')
+
+    # Create two multigrids with other years
+    grid = Grid.read_enviras(file_paths, r'Lden y(1971|1972)\.dat')
+    other = Grid.read_enviras(file_paths, r'Lden y(1971|1999)\.dat')
+
+    grid.add(other)
+
+
+def test_energetic_sum():
+    # Get the paths to the Envira files
+    file_paths = abs_path('data/H_500_00_doc29')
+    paths = [os.path.join(file_paths, 'MER2015 - Doc29 - Lden y{}.dat'.format(year)) for year in range(1971, 1977)]
+    weights = [0.5, 1, 2, 1, 0.25, 3]
+
+    # Sum the grids from the paths, one after another and in parallel
+    total = Grid.energetic_sum(paths, weights)
+    total_parallel = Grid.energetic_sum(paths, weights, workers=2)
+
+    # Compare with repeated additions of the scaled grids
+    desired = Grid.read_envira(paths[0]).scale(weights[0])
+    for path, weight in zip(paths[1:], weights[1:]):
+        desired.add(Grid.read_envira(path).scale(weight))
+
+    assert total.unit == 'Lden'
+    np.testing.assert_allclose(total.data, desired.data, atol=1e-9)
+    np.testing.assert_allclose(total_parallel.data, total.data, atol=1e-12)
+
+
+def test_energetic_sum_compensated():
+    # Create a large grid and many small grids
+    info = {'x_start': 0, 'x_stop': 3, 'x_step': 1, 'x_number': 4, 'y_start': 0, 'y_stop': 3, 'y_step': 1,
+            'y_number': 4}
+    grids = [Grid(data=np.full((4, 4), 160.), info=info, unit='Lden')]
+    grids += [Grid(data=np.full((4, 4), 0.), info=info, unit='Lden') for _ in range(1000)]
+
+    # The small contributions should not be lost
+    total = Grid.energetic_sum(grids)
+    np.testing.assert_allclose(total.energy, 1e16 + 1000, rtol=0, atol=1)
+
+
+@raises(ValueError)
+def test_energetic_sum_weights():
+    # Get the path to the Envira file
+    file_path = abs_path('data/GP2018 - Lnight y2016.dat')
+
+    Grid.energetic_sum([file_path, file_path], [1])
+
+
+def test_energy_chain():
+    # Get the path to the Envira file
+    file_path = abs_path('data/GP2018 - Lnight y2016.dat')
+
+    # Create two grid objects from the data file
+    grid = Grid.read_envira(file_path)
+    d = grid.data.copy()
+
+    # Chain the energetic operations, which should not convert the data back to dB in between
+    grid.add(Grid.read_envira(file_path)).scale(0.5).add(Grid.read_envira(file_path))
+    assert grid._data is None
+
+    np.testing.assert_allclose(grid.data, d + 10 * np.log10(2), atol=1e-10)
+
+
+def test_energy_grid():
+    # Get the path to the Envira file
+    file_path = abs_path('data/GP2018 - Lnight y2016.dat')
+
+    # Create a grid object in the energy domain
+    grid = Grid.read_envira(file_path)
+    energy_grid = Grid(energy=grid.energy.copy(), info=grid.info, unit=grid.unit)
+
+    np.testing.assert_allclose(energy_grid.data, grid.data, atol=1e-10)
+    np.testing.assert_allclose(energy_grid.hg(), grid.hg())
+
+
+@raises(AttributeError)
+def test_energy_empty():
+    Grid().data
+
+
 def test_scale_multigrid():
     # Get the path to the Envira files
     file_paths = abs_path('data/MINIMER2015')
@@ -446,6 +1250,62 @@ def test_statistics_multigrid():
     assert isinstance(stats, dict)
 
 
+def test_statistics_values():
+    # Get the path to the Envira files
+    file_paths = abs_path('data/MINIMER2015')
+
+    # Create a grid object from the data file
+    grid = Grid.read_enviras(file_paths, r'[\w\d\s]+\.dat')
+    stats = grid.statistics()
+
+    # Compare with the statistics of the stacked data
+    data = np.asarray(grid.data)
+    np.testing.assert_allclose(stats['mean'].data, 10 * np.log10(np.mean(10 ** (data / 10.), axis=0)))
+    np.testing.assert_allclose(stats['std'].data, np.std(data, axis=0), atol=1e-12)
+    np.testing.assert_allclose(stats['dhi'].data, stats['mean'].data + 2.5758 * stats['std'].data)
+    np.testing.assert_allclose(stats['dlo'].data, stats['mean'].data - 2.5758 * stats['std'].data)
+
+
+def test_statistics_merge():
+    # Get the path to the Envira files
+    file_paths = abs_path('data/MINIMER2015')
+
+    # Create a grid object from the data file
+    grid = Grid.read_enviras(file_paths, r'[\w\d\s]+\.dat')
+    data = np.asarray(grid.data)
+
+    # Accumulate the first years as a chunk and the other years one by one
+    statistics = GridStatistics(shape=grid.shape, unit=grid.unit, percentiles=[50]).update(data[:15])
+    other = GridStatistics(shape=grid.shape, unit=grid.unit, percentiles=[50])
+    for year_data in data[15:]:
+        other.update(year_data)
+    merged = statistics.merge(other).result()
+
+    # The merged statistics should be the same as the statistics of the multigrid
+    stats = grid.statistics(percentiles=[50])
+    for key in ['mean', 'std', 'dhi', 'dlo', 'p50']:
+        np.testing.assert_allclose(merged[key].data, stats[key].data, atol=1e-12)
+
+
+def test_statistics_percentiles():
+    # Get the path to the Envira files
+    file_paths = abs_path('data/MINIMER2015')
+
+    # Create a grid object from the data file
+    grid = Grid.read_enviras(file_paths, r'[\w\d\s]+\.dat')
+    stats = grid.statistics(percentiles=[5, 95])
+
+    # The percentiles should be within the quantisation step of the exact percentiles
+    data = np.asarray(grid.data)
+    for percentile in [5, 95]:
+        np.testing.assert_allclose(stats['p{}'.format(percentile)].data, np.percentile(data, percentile, axis=0),
+                                   atol=0.005 + 1e-9)
+
+    # The kept noise levels should take a quarter of the memory of the stacked data
+    statistics = GridStatistics(shape=grid.shape, unit=grid.unit, percentiles=[5]).update(data)
+    assert sum(chunk.nbytes for chunk in statistics.levels) == data.astype(np.float64).nbytes // 4
+
+
 @raises(TypeError)
 def test_statistics_type():
     # Get the path to the Envira files
@@ -515,6 +1375,47 @@ def test_interpolation_function_nan():
     grid.interpolation_function()
 
 
+def test_interpolation_function_cache():
+    # Get the path to the Envira file
+    file_path = abs_path('data/GP2018 - Lnight y2016.dat')
+
+    # Create a grid object from the data file
+    grid = Grid.read_envira(file_path)
+
+    # The spline should be reused until the data changes
+    interpolation = grid.interpolation_function()
+    assert grid.interpolation_function() is interpolation
+    grid.scale(2)
+    assert grid.interpolation_function() is not interpolation
+    np.testing.assert_allclose(grid.interpolation_function()(470000, 100000),
+                               interpolation(470000, 100000) + 10 * np.log10(2))
+
+
+def test_interpolate_points():
+    # Get the path to the Envira files
+    file_paths = abs_path('data/H_500_00_doc29')
+
+    # Create a grid object from the data files
+    grid = Grid.read_enviras(file_paths, r'Lden y(1971|1972|1999)\.dat')
+
+    # Create two sets of points
+    random = np.random.RandomState(0)
+    addresses = (random.uniform(100000, 130000, 50), random.uniform(470000, 500000, 50))
+    stations = (np.array([[110000., 115000.]]), np.array([[480000., 485000.]]))
+
+    # Interpolate all years at both sets of points at once
+    noise = grid.interpolate_points({'addresses': addresses, 'stations': stations})
+
+    assert noise['addresses'].shape == (len(grid.years), 50)
+    assert noise['stations'].shape == (len(grid.years), 1, 2)
+    for i in [0, len(grid.years) - 1]:
+        interpolation = grid.grid_from_index(i).interpolation_function()
+        np.testing.assert_allclose(noise['addresses'][i], interpolation(addresses[1], addresses[0], grid=False),
+                                   atol=1e-9)
+        np.testing.assert_allclose(noise['stations'][i].ravel(),
+                                   interpolation(stations[1].ravel(), stations[0].ravel(), grid=False), atol=1e-9)
+
+
 def test_refine():
     """
     Test various use cases for consistency
@@ -602,6 +1503,80 @@ def test_resize():
     assert isinstance(grid.info, dict)
 
 
+def test_resize_spline():
+    # Get the path to the Envira file
+    file_path = abs_path('data/GP2018 - Lnight y2016.dat')
+
+    # Create a grid object from the data file
+    grid = Grid.read_envira(file_path)
+
+    # Create an alternative shape, which partly lies outside of the original shape
+    shape = grid.shape.copy()
+    shape.x_start -= 2000
+    shape.set_x_number(201)
+    shape.set_y_number(79)
+
+    # Evaluate the bi-cubic spline directly
+    desired = grid.interpolation_function()(np.linspace(shape.y_start, shape.y_stop, 79),
+                                            np.linspace(shape.x_start, shape.x_stop, 201))
+
+    # The resampling operator should give the same result
+    np.testing.assert_allclose(grid.resize(shape).data, desired, atol=1e-10)
+
+
+def test_resize_linear():
+    # Get the path to the Envira file
+    file_path = abs_path('data/GP2018 - Lnight y2016.dat')
+
+    # Create a grid object from the data file
+    grid = Grid.read_envira(file_path)
+
+    # Refine with a factor 2, so every other point is an original point and the others are in between
+    refined = grid.copy().resize(grid.shape.copy().refine(2), method='linear')
+
+    np.testing.assert_allclose(refined.data[::2, ::2], grid.data, atol=1e-10)
+    np.testing.assert_allclose(refined.data[1::2, ::2], (grid.data[:-1, :] + grid.data[1:, :]) / 2, atol=1e-10)
+
+
+@raises(ValueError)
+def test_resize_method():
+    # Get the path to the Envira file
+    file_path = abs_path('data/GP2018 - Lnight y2016.dat')
+
+    # Create a grid object from the data file
+    grid = Grid.read_envira(file_path)
+
+    # Use an unknown interpolation method
+    grid.resize(grid.shape.copy().refine(2), method='quintic')
+
+
+def test_resample_multigrid():
+    # Get the path to the Envira files
+    file_paths = abs_path('data/H_500_00_doc29')
+
+    # Set the pattern
+    pattern = r'[\w\d\s]+Lden[\w\d\s]+\.dat'
+
+    # Create a grid object from the data file
+    grid = Grid.read_enviras(file_paths, pattern)
+
+    # Resample the stack of grids at once
+    shape = grid.shape.copy().refine(3)
+    axis_resampling_operator.cache_clear()
+    data = resample(grid.data, grid.shape, shape)
+
+    # The operators for the y- and x-axis should be reused when resampling again
+    resample(grid.data, grid.shape, shape)
+    assert axis_resampling_operator.cache_info().hits == 2
+
+    # Compare each year with the bi-cubic spline of that year
+    for i in [0, 17, 39]:
+        desired = grid.grid_from_index(i).interpolation_function()(
+            np.linspace(shape.y_start, shape.y_stop, int(shape.y_number)),
+            np.linspace(shape.x_start, shape.x_stop, int(shape.x_number)))
+        np.testing.assert_allclose(data[i], desired, atol=1e-10)
+
+
 def test_scale_per_time_interval():
     # Get the path to the Envira files
     file_paths = abs_path('data/H_500_00_doc29')
@@ -846,9 +1821,8 @@ def test_scale_per_time_interval_apply_night_time_correction():
                                                                                         scale_de=1.021)
 
     # Scale the meteotoeslag 2.1% without lnight time correction
-    meteotoeslag_lden_scaled_without = meteotoeslag['Lden'].copy().scale_per_time_interval(meteotoeslag['Lnight'],
-                                                                                           scale_de=1.021,
-                                                                                           apply_lnight_time_correction=False)
+    meteotoeslag_lden_scaled_without = meteotoeslag['Lden'].copy().scale_per_time_interval(
+        meteotoeslag['Lnight'], scale_de=1.021, apply_lnight_time_correction=False)
 
     # Without lnight time correction, the scaled data Lden should be lower
     assert (meteotoeslag_lden_scaled_with.data > meteotoeslag_lden_scaled_without.data).all()
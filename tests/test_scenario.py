@@ -0,0 +1,142 @@
+import os
+
+import numpy as np
+import pandas as pd
+from nose.tools import raises
+
+from ssdtools.grid import Grid
+from ssdtools.scenario import GridLibrary, usage_table, lden_weights
+from ssdtools.traffic import Traffic
+
+
+def test_scenario():
+    # Create a library of unit grids
+    grids = unit_grids()
+    library = GridLibrary.from_grids(grids)
+
+    # Determine the scenario grid for a runway usage
+    usage = pd.Series({('L', '18R'): 100., ('T', '24'): 50., ('T', '36L'): 0.})
+    grid = library.scenario(usage, unit='Lden')
+
+    # Compare with the energetic sum of the unit grids
+    desired = Grid.energetic_sum([grids[('L', '18R')], grids[('T', '24')]], [100., 50.])
+    assert grid.unit == 'Lden'
+    assert grid.shape.get_key() == desired.shape.get_key()
+    np.testing.assert_allclose(grid.data, desired.data, atol=1e-9)
+
+
+def test_scenario_multigrid():
+    # Create a library of unit grids
+    grids = unit_grids()
+    library = GridLibrary.from_grids(grids)
+
+    # Determine the scenario grid for the runway usage of each year
+    usage = pd.DataFrame({1971: [100., 50.], 1972: [80., 70.]},
+                         index=pd.MultiIndex.from_tuples([('L', '18R'), ('T', '24')]))
+    grid = library.scenario(usage)
+
+    assert grid.is_multigrid()
+    assert grid.years == [1971, 1972]
+    np.testing.assert_allclose(grid.grid_from_year(1972).data,
+                               library.scenario(usage[1972]).data, atol=1e-9)
+
+
+@raises(KeyError)
+def test_scenario_missing_key():
+    # Create a library of unit grids
+    library = GridLibrary.from_grids(unit_grids())
+
+    # Try a runway without a unit grid
+    library.scenario(pd.Series({('L', '06'): 10.}))
+
+
+def test_usage_table():
+    # Get the path to the traffic file
+    file_path = abs_path('data/traffic 1971-2016 - years.txt')
+
+    # Create a traffic aggregate from the file
+    aggregate = Traffic.read_daisy_meteoyear_file(file_path)
+
+    # The usage table should contain the number of flights for each operation and runway
+    usage = usage_table(aggregate, period='D|E|N')
+    assert usage[('L', '18R')] == aggregate.data.loc[(aggregate.data['d_lt'] == 'L') &
+                                                     (aggregate.data['d_runway'] == '18R'), 'total'].sum()
+
+    # The usage per year should sum to the same usage
+    usage_per_year = usage_table(aggregate, period='N', per_year=True)
+    assert 1971 in usage_per_year.columns
+    pd.testing.assert_series_equal(usage_per_year.sum(axis=1), usage_table(aggregate, period='N'), check_names=False)
+
+
+def test_usage_table_early_morning():
+    # Create a traffic aggregate with the early morning as a separate period
+    aggregate = Traffic.read_daisy_mean_file(abs_path('data/traffic 1971-2016 - mean.txt'))
+    aggregate.get_denem_distribution()
+    data = aggregate.data
+    assert (data['d_den'] == 'EM').any()
+
+    # The evening should not include the early morning
+    np.testing.assert_allclose(usage_table(aggregate, period='E').sum(), data.loc[data['d_den'] == 'E', 'total'].sum())
+
+    # The early morning should be weighted as night for Lden
+    usage = usage_table(aggregate, den_weights=lden_weights)
+    desired = (data['total'] * data['d_den'].map({'D': 1., 'E': np.sqrt(10.), 'N': 10., 'EM': 10.})).sum()
+    np.testing.assert_allclose(usage.sum(), desired)
+
+
+@raises(KeyError)
+def test_usage_table_missing_weight():
+    # Create a traffic aggregate with the early morning as a separate period
+    aggregate = Traffic.read_daisy_mean_file(abs_path('data/traffic 1971-2016 - mean.txt'))
+    aggregate.get_denem_distribution()
+
+    # The early morning has no weight
+    usage_table(aggregate, den_weights={'D': 1., 'E': np.sqrt(10.), 'N': 10.})
+
+
+def test_fleet_mix():
+    # Create a library of unit grids for a few aircraft categories and procedures
+    grids = unit_grids([('2/3', 0), ('2/3', 600), ('2/3', 1000)])
+    library = GridLibrary.from_grids(grids)
+
+    # Get the traffic of these aircraft categories and procedures
+    aggregate = Traffic.read_daisy_mean_file(abs_path('data/traffic 1971-2016 - mean.txt'))
+    keys = list(zip(aggregate.data['d_ac_cat'], aggregate.data['d_proc']))
+    aggregate.data = aggregate.data[[key in grids for key in keys]]
+
+    # Determine the Lden and Lnight grids of the fleet mix
+    scenario = library.fleet_mix(aggregate)
+    assert sorted(scenario) == ['Lden', 'Lnight']
+    assert scenario['Lden'].unit == 'Lden'
+
+    # Compare with the energetic sum of the unit grids, weighted with the movements per period
+    data = aggregate.data.assign(key=[key for key in keys if key in grids])
+    for unit, weights in [('Lden', lden_weights), ('Lnight', {'D': 0., 'E': 0., 'N': 1.})]:
+        totals = (data['total'] * data['d_den'].map(weights).fillna(0)).groupby(data['key']).sum()
+        desired = Grid.energetic_sum(list(grids.values()), [totals.get(key, 0.) for key in grids])
+        np.testing.assert_allclose(scenario[unit].data, desired.data, atol=1e-9)
+
+    # A repeated fleet mix should use the cached contraction, without sharing the grid data
+    assert len(library.cache) == 1
+    grid = library.fleet_mix(aggregate)['Lden'].scale(2)
+    assert len(library.cache) == 1
+    np.testing.assert_allclose(library.fleet_mix(aggregate)['Lden'].data, scenario['Lden'].data)
+    assert not np.allclose(grid.data, scenario['Lden'].data)
+
+    # Writing to the energy of a scenario grid should not change the cache
+    try:
+        scenario['Lden'].energy[0, 0] = 0
+        raise AssertionError('A ValueError should be raised')
+    except ValueError:
+        pass
+
+
+def unit_grids(keys=(('L', '18R'), ('T', '24'), ('T', '36L'))):
+    # Use a few grids of the test scenario as unit grids
+    file_paths = abs_path('data/H_500_00_doc29')
+    return {key: Grid.read_envira(os.path.join(file_paths, 'MER2015 - Doc29 - Lden y{}.dat'.format(year))).scale(1e-4)
+            for key, year in zip(keys, [1971, 1972, 1973])}
+
+
+def abs_path(rel_path):
+    return os.path.join(os.path.dirname(__file__), rel_path)
@@ -57,6 +57,117 @@ def test_add_noise_from_grid_lden_lnight():
     wbs.add_noise_from_grid(grid)
 
 
+def test_noise_from_grid():
+    # Create a wbs object with random residences, partly outside of the grid
+    wbs = random_wbs()
+
+    # Get the path to the Envira file
+    file_path = abs_path('data/GP2018 - Lnight y2016.dat')
+
+    # Create a grid object from the data file
+    grid = Grid.read_envira(file_path)
+
+    # Interpolate the noise levels with the sparse interpolation matrix
+    noise = wbs.noise_from_grid(grid)
+
+    # Interpolate the noise levels with the bi-cubic spline
+    desired = grid.interpolation_function()(wbs.data['y'], wbs.data['x'], grid=False)
+
+    np.testing.assert_allclose(noise, desired, atol=1e-9)
+
+
+def test_noise_from_grid_multigrid():
+    # Create a wbs object with random residences
+    wbs = random_wbs()
+
+    # Get the path to the Envira files
+    file_paths = abs_path('data/H_500_00_doc29')
+
+    # Create a grid object from the data files
+    grid = Grid.read_enviras(file_paths, r'[\w\d\s]+Lden[\w\d\s]+\.dat')
+
+    # Interpolate the noise levels for all years at once
+    noise = wbs.noise_from_grid(grid)
+
+    assert noise.shape == (len(grid.years), wbs.data.shape[0])
+    for i in [0, 39]:
+        np.testing.assert_allclose(noise[i], wbs.noise_from_grid(grid.grid_from_index(i)), atol=1e-9)
+
+
+def test_interpolation_matrix_cache():
+    # Create a wbs object with random residences
+    wbs = random_wbs()
+
+    # Get the path to the Envira file
+    file_path = abs_path('data/GP2018 - Lnight y2016.dat')
+
+    # Create a grid object from the data file
+    grid = Grid.read_envira(file_path)
+
+    # The interpolation matrix should be reused for the same shape and by copies of the wbs
+    matrix = wbs.interpolation_matrix(grid.shape)
+    assert wbs.interpolation_matrix(grid.shape.copy()) is matrix
+    assert wbs.copy().interpolation_matrix(grid.shape) is matrix
+
+    # A different shape should have a different matrix
+    assert wbs.interpolation_matrix(grid.shape.copy().refine(2)) is not matrix
+
+
+def test_gwc_multigrid():
+    # Create a wbs object with random residences
+    wbs = random_wbs()
+
+    # Get the path to the Envira files
+    file_paths = abs_path('data/H_500_00_doc29')
+
+    # Create the Lden and Lnight grid objects from the data files
+    lden_grid = Grid.read_enviras(file_paths, r'[\w\d\s]+Lden[\w\d\s]+\.dat')
+    lnight_grid = Grid.read_enviras(file_paths, r'[\w\d\s]+Lnight[\w\d\s]+\.dat')
+
+    for de_kwargs in [dict(), dict(de='ges2002', max_noise_level=65)]:
+        # Calculate the gelijkwaardigheidscriteria (GWC) for all years at once
+        gwc = wbs.gwc(lden_grid, lnight_grid, **de_kwargs)
+
+        assert list(gwc.index) == list(lden_grid.years)
+
+        # Compare with the GWC of each individual year
+        for year in [1971, 1994, 2010]:
+            desired = wbs.gwc(lden_grid.grid_from_year(year), lnight_grid.grid_from_year(year), **de_kwargs)
+            pd.testing.assert_series_equal(gwc.loc[year, desired.index], desired, check_names=False)
+
+
+def test_get_max_scale():
+    # Create a wbs object with random residences
+    wbs = random_wbs(n=5000)
+
+    # Get the path to the Envira files
+    file_paths = abs_path('data/H_500_00_doc29')
+
+    # Create the Lden and Lnight meteotoeslag grids
+    lden_grid = Grid.read_enviras(file_paths, r'[\w\d\s]+Lden[\w\d\s]+\.dat').meteotoeslag_grid_from_method('hybride')
+    lnight_grid = Grid.read_enviras(file_paths, r'[\w\d\s]+Lnight[\w\d\s]+\.dat').meteotoeslag_grid_from_method(
+        'hybride')
+
+    # Use the current GWC with some room as limits, such that each criterion is binding once
+    score = wbs.gwc(lden_grid, lnight_grid)
+    columns = ['w58den', 'eh48den', 'w48n', 'sv40n']
+    for binding in columns:
+        limits = [score[column] * (1.2 if column == binding else 2.) for column in columns]
+
+        # Determine the maximum scale
+        scale, criterion = wbs.get_max_scale(lden_grid, lnight_grid, limits)
+        assert criterion == binding
+
+        # All criteria should be met just below the maximum scale, and the binding criterion not just above it
+        below = wbs.gwc(lden_grid.copy().scale(scale * (1 - 1e-9)), lnight_grid.copy().scale(scale * (1 - 1e-9)))
+        above = wbs.gwc(lden_grid.copy().scale(scale * (1 + 1e-6)), lnight_grid.copy().scale(scale * (1 + 1e-6)))
+        assert all(below[column] < limit for column, limit in zip(columns, limits))
+        assert above[binding] >= limits[columns.index(binding)]
+
+        # The inpasbaar volume should use the same scale
+        assert wbs.get_inpasbaarvolume(lden_grid, lnight_grid, limits) == scale
+
+
 def test_select_above():
     # Get the path to the WBS file
     file_path = abs_path('../data/wbs2005.h5')
@@ -250,5 +361,16 @@ def test_gwc():
     pd.testing.assert_series_equal(gwc['sv40n'].sort_index(), gwc_verification['sv40n'], check_names=False)  # error
 
 
+def random_wbs(n=1000, seed=0):
+    # Create random residences around Schiphol
+    random = np.random.RandomState(seed)
+    data = pd.DataFrame({'x': random.uniform(80000, 160000, n),
+                         'y': random.uniform(450000, 530000, n),
+                         'woningen': random.randint(1, 10, n).astype(float),
+                         'personen': random.uniform(1, 25, n)})
+
+    return WBS(data)
+
+
 def abs_path(rel_path):
     return os.path.join(os.path.dirname(__file__), rel_path)